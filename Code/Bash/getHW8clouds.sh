@@ -5,6 +5,7 @@
 ## concatenate into daily files
 ## E Klein. eklein@gmail.com
 ## last version 20201020
+## replaced by Code/Python/getHW8clouds.py (parallel download, clip in python, appends to a Zarr store)
 
 for yy in $(seq 2018 2019) 
 do
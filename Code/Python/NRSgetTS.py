@@ -3,18 +3,21 @@
 
 import os
 from datetime import date
-from itertools import groupby
 import argparse
 import numpy as np
 import pandas as pd
-import xarray as xr
+
+from catalogCache import getSiteCatalogue
+from availability import blockPlot, LEGEND
+from availabilityIndex import getAvailabilityIndex, dayPlot
+from fileCache import openDataset
 
 pd.options.display.max_colwidth = 200
 
 def args():
     parser = argparse.ArgumentParser(description="Get a TEMP timeseries from the gridded product at specified DEPTH")
     parser.add_argument('-site', dest='site', help='site code, like NRMMAI',  type=str, default=None, required=True)
-    parser.add_argument('-depth', dest='depth', help='selected depth, like 10',  type=float, default=None, required=True)
+    parser.add_argument('-depth', dest='depth', help='selected depth, like 10, or depths, like 10 20 50',  type=float, nargs='+', default=None, required=True)
     parser.add_argument('-ts', dest='dateStart', help='start time like 2015-12-01', default=None, type=str, required=False)
     parser.add_argument('-te', dest='dateEnd', help='end time like 2018-06-30', type=str, default=None, required=False)
     #parser.add_argument('-i', '--info', dest='info', help='display file info ONLY', type=bool, default=False, required=False)
@@ -24,44 +27,63 @@ def args():
 
 
 
-def blockPlot(x, lineLength = 80):
-    '''
-    Print a line block-plot of data availability of specified length
-    E. Klein. ekleins@gmail.com 2020-10-20
-    :param x: numpy array of dim 1
-    :param lineLength: lenght of the line plot
-    :return: string
-    '''
-    blockSymbols = ['\u2591', '\u2593']
-    ## make boolean vector 0-nodata 1-data
-    x_bool = np.isnan(x.values).astype(int).tolist()
-    ## run-length encoder
-    x_rle = [[key, len(list(group))] for key, group in groupby(x_bool)]
-    ## list of number of symbols
-    x_sum = sum(x[1] for x in x_rle)
-    x_symbols = list(round(lineLength * x[1]/x_sum) for x in x_rle)
-    return''.join(list(blockSymbols[x_rle[i][0]] * x_symbols[i] for i in range(len(x_rle))))
+def timeWindow(timeValues, dateStart=None, dateEnd=None):
+    """
+    TIME index range of a date window. TIME is monotonic in the gridded product
+    :param timeValues: numpy datetime64 array of TIME
+    :param dateStart: start date as yyyy-mm-dd. None for the start of the record
+    :param dateEnd: end date as yyyy-mm-dd, included. None for the end of the record
+    :return: (first, last) indices for isel(TIME=slice(first, last))
+    """
+    first = 0
+    last = len(timeValues)
+    if dateStart is not None:
+        first = np.searchsorted(timeValues, np.datetime64(str(dateStart), 'D'), side='left')
+    if dateEnd is not None:
+        last = np.searchsorted(timeValues, np.datetime64(str(dateEnd), 'D') + np.timedelta64(1, 'D'), side='left')
+    return int(first), int(max(first, last))
+
 
+def getTempSlab(nc, depths, dateStart=None, dateEnd=None):
+    """
+    Read TEMP at several depths within a date window in one read of a DEPTH x TIME hyperslab,
+    then select the depths in memory. The hyperslab goes from the shallowest to the deepest depth
+    with the largest stride that keeps all of them (the gcd of their index gaps): depths evenly
+    spaced, like 0 and 100 m, read only those levels, depths unevenly spaced read the levels in
+    between too, a few unrequested levels being cheaper than one request per depth
+    :param nc: gridded product xarray dataset
+    :param depths: list of depths, all in nc.DEPTH
+    :param dateStart: start date as yyyy-mm-dd. None for the start of the record
+    :param dateEnd: end date as yyyy-mm-dd, included. None for the end of the record
+    :return: TEMP DataArray with the selected depths and times
+    """
+    first, last = timeWindow(nc.TIME.values, dateStart, dateEnd)
+    depthIdx = [list(nc.DEPTH.values).index(dd) for dd in depths]
+    depthFirst, depthLast = min(depthIdx), max(depthIdx) + 1
+    step = max(int(np.gcd.reduce([ii - depthFirst for ii in depthIdx])), 1)
+    slab = nc.TEMP.isel(TIME=slice(first, last), DEPTH=slice(depthFirst, depthLast, step)).load()
+    return slab.isel(DEPTH=[(ii - depthFirst) // step for ii in depthIdx])
 
 
 def NRSgetTS(site, depth, dateStart='1970-01-01', dateEnd=date.today()):
     """
     Extract hourly temperature time series from NRS gridded product
+    Only the requested depths and dates are read, in one request
     :param site: site name
-    :param depth: selected depth
+    :param depth: selected depth or list of depths
     :param dateStart: start date as yyyy-mm-dd
     :param dateEnd: end date as yyyy-mm-dd
     :param info: print file info only
 
-    :return: name of the csv output file
+    :return: list of the csv output files, one per depth
     """
 
     webRoot = 'http://thredds.aodn.org.au/thredds/dodsC/'
     info=False
+    depths = [float(dd) for dd in np.atleast_1d(depth)]
 
     ## get gridded-_timeseries filename
-    url = ("http://geoserver-123.aodn.org.au/geoserver/ows?typeName=moorings_all_map&SERVICE=WFS&REQUEST=GetFeature&VERSION=1.0.0&outputFormat=csv&CQL_FILTER=(realtime='FALSE')and(site_code='%s')" % site)
-    df = pd.read_csv(url)
+    df = getSiteCatalogue(site)
     fileName = df['url'].loc[df['url'].str.contains('gridded_timeseries')].to_string(index=False).lstrip()
     print(fileName)
 
@@ -70,16 +92,17 @@ def NRSgetTS(site, depth, dateStart='1970-01-01', dateEnd=date.today()):
         print(fileName)
         return
 
-    print(os.path.join(webRoot, fileName))
-    nc = xr.open_dataset(os.path.join(webRoot, fileName))
+    url = os.path.join(webRoot, fileName)
+    print(url)
+    nc = openDataset(url)
     depthList = list(nc.DEPTH.values)
     coverageStart = nc.time_coverage_start
     coverageEnd = nc.time_coverage_end
 
 
-
-    if depth not in depthList:
-        print('ERROR: Requested DEPTH (%im) is not available.' % depth)
+    missingDepths = [dd for dd in depths if dd not in depthList]
+    if missingDepths:
+        print('ERROR: Requested DEPTH (%s m) is not available.' % ", ".join('%g' % dd for dd in missingDepths))
         info = True
 
     ## print file info
@@ -93,24 +116,44 @@ def NRSgetTS(site, depth, dateStart='1970-01-01', dateEnd=date.today()):
     print('Max DEPTH: ' + str(nc.geospatial_vertical_max))
     print('Included DEPTHS: ' + str(depthList))
 
+    ## availability of every DEPTH from the availability index, if it is up to date: no TEMP read
+    index = getAvailabilityIndex(url, nc.attrs.get('date_created'), build=False)
+    if index is not None:
+        for dd, days in zip(index['depths'], index['depthDays']):
+            print('Data availability at %gm:' % dd, dayPlot(days, lineLength=40))
+
 
     if info:
+        if index is not None:
+            print(LEGEND)
         return
 
 
-    ## extract TEMP at selected DEPTH
-    temp = nc.TEMP.sel(DEPTH=float(depth))
-
-    ## save csv
-    fileNameCSV = "_".join([site, 'TEMP', (str(int(depth))+'m'),
-                            (str.split(nc.time_coverage_start, "T")[0].replace("-","") + "-" +
-                             str.split(nc.time_coverage_end, "T")[0].replace("-","")),]) + '.csv'
-    temp.to_series().to_csv(fileNameCSV)
+    ## extract TEMP at selected DEPTHs and dates
+    tempSlab = getTempSlab(nc, depths, dateStart, dateEnd)
+    if len(tempSlab.TIME) == 0:
+        print('ERROR: no data between %s and %s' % (dateStart, dateEnd))
+        return
 
-    print('Data availabilty', blockPlot(temp))
-    print("Output file: " + fileNameCSV)
+    ## file name dates: the coverage, or the window if it is shorter
+    timeFirst, timeLast = timeWindow(nc.TIME.values, dateStart, dateEnd)
+    dateFirst = str.split(coverageStart, "T")[0] if timeFirst == 0 else str(tempSlab.TIME.values[0])[:10]
+    dateLast = str.split(coverageEnd, "T")[0] if timeLast == len(nc.TIME) else str(tempSlab.TIME.values[-1])[:10]
 
-    return
+    ## save csv
+    fileNames = []
+    for dd in depths:
+        temp = tempSlab.sel(DEPTH=dd)
+        fileNameCSV = "_".join([site, 'TEMP', (str(int(dd))+'m'),
+                                (dateFirst.replace("-","") + "-" + dateLast.replace("-","")),]) + '.csv'
+        temp.to_series().to_csv(fileNameCSV)
+
+        print('Data availabilty at %sm' % dd, blockPlot(temp))
+        print("Output file: " + fileNameCSV)
+        fileNames.append(fileNameCSV)
+    print(LEGEND)
+
+    return fileNames
 
 
 if __name__ == "__main__":
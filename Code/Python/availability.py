@@ -0,0 +1,138 @@
+## data availability of a time series: run-length encoding of the missing values,
+## coverage and gap statistics, and the character block plot used in the reports
+import numpy as np
+
+## index 0 no data, index 1 data
+BLOCK_SYMBOLS = ['\u2591', '\u2593']
+LEGEND = '\u2591 NO DATA, \u2593 DATA'
+
+
+def dataMask(x):
+    '''
+    Boolean mask of the valid values
+    :param x: numpy array, pandas series or xarray DataArray of dim 1. Float or datetime
+    :return: numpy boolean array, True where there is data
+    '''
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64) or np.issubdtype(x.dtype, np.timedelta64):
+        return ~np.isnat(x)
+    return ~np.isnan(x)
+
+
+def runLength(mask):
+    '''
+    Run-length encode a boolean vector
+    :param mask: numpy boolean array
+    :return: (starts, lengths, values) numpy arrays, one element per run
+    '''
+    mask = np.asarray(mask, dtype=bool)
+    if len(mask) == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0, dtype=bool)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(mask)) + 1))
+    lengths = np.diff(np.append(starts, len(mask)))
+    return starts, lengths, mask[starts]
+
+
+def availabilitySummary(x, time=None):
+    '''
+    Coverage and gap statistics of a series
+    :param x: numpy array, pandas series or xarray DataArray of dim 1. Float or datetime
+    :param time: optional time of every element, to report the dates of the longest gap.
+                 Taken from x if it is a DataArray with a TIME coordinate
+    :return: dict with the counts, coverage percentage, gap statistics (in samples) and the runs
+    '''
+    if time is None and hasattr(x, 'coords') and 'TIME' in x.coords:
+        time = x.TIME.values
+    starts, lengths, values = runLength(dataMask(x))
+    nTotal = int(lengths.sum())
+    nData = int(lengths[values].sum())
+    gaps = lengths[~values]
+    summary = {'nTotal': nTotal,
+               'nData': nData,
+               'coverage': 100.0 * nData / nTotal if nTotal else 0.0,
+               'nGaps': len(gaps),
+               'gapMax': int(gaps.max()) if len(gaps) else 0,
+               'gapMean': float(gaps.mean()) if len(gaps) else 0.0,
+               'gapMedian': float(np.median(gaps)) if len(gaps) else 0.0,
+               'runStarts': starts,
+               'runLengths': lengths,
+               'runData': values}
+    if time is not None and len(gaps):
+        gapIdx = np.flatnonzero(~values)[gaps.argmax()]
+        summary['gapMaxStart'] = time[starts[gapIdx]]
+        summary['gapMaxEnd'] = time[starts[gapIdx] + lengths[gapIdx] - 1]
+    return summary
+
+
+def blockSizes(lengths, lineLength=80):
+    '''
+    Number of symbols of every run, so the line is exactly lineLength long.
+    The rounding difference goes to the longest runs
+    :param lengths: run lengths
+    :param lineLength: length of the line plot
+    :return: numpy int array
+    '''
+    nSymbols = np.rint(lineLength * lengths / lengths.sum()).astype(int)
+    diffBlocks = lineLength - nSymbols.sum()
+    if diffBlocks != 0:
+        longest = np.argsort(-nSymbols, kind='stable')[:abs(diffBlocks)]
+        nSymbols[longest] += np.sign(diffBlocks)
+    return nSymbols
+
+
+def blockPlot(x, lineLength=80):
+    '''
+    Print a line block-plot of data availability of specified length
+    E. Klein. ekleins@gmail.com 2020-10-20
+    :param x: numpy array, pandas series or xarray DataArray of dim 1. Float or datetime
+    :param lineLength: lenght of the line plot
+    :return: string
+    '''
+    _, lengths, values = runLength(dataMask(x))
+    return runPlot(lengths, values, lineLength)
+
+
+def runPlot(lengths, values, lineLength=80):
+    '''
+    Block-plot of already run-length encoded data
+    :param lengths: run lengths
+    :param values: True for the runs with data
+    :param lineLength: length of the line plot
+    :return: string
+    '''
+    lengths = np.asarray(lengths)
+    values = np.asarray(values, dtype=bool)
+    keep = lengths > 0
+    lengths, values = lengths[keep], values[keep]
+    if len(lengths) == 0:
+        return ''
+    nSymbols = blockSizes(lengths, lineLength)
+    keep = nSymbols > 0
+    return ''.join(BLOCK_SYMBOLS[int(value)] * int(n) for value, n in zip(values[keep], nSymbols[keep]))
+
+
+def instrumentCoverage(nc):
+    '''
+    First and last TIME of every instrument in an **HOURLY** LTSP file, in one pass over the observations
+    :param nc: xarray dataset
+    :return: (timeMin, timeMax) numpy datetime64 arrays. NaT for the instruments without observations
+    '''
+    nInstruments = len(nc.INSTRUMENT)
+    time = nc.TIME.values
+    instrumentIndex = nc.instrument_index.values
+
+    ## sort by instrument if needed, the observations of each instrument are then one block
+    if np.any(np.diff(instrumentIndex) < 0):
+        order = np.argsort(instrumentIndex, kind='stable')
+        time = time[order]
+        instrumentIndex = instrumentIndex[order]
+
+    nObs = np.bincount(instrumentIndex, minlength=nInstruments)
+    blockStart = np.cumsum(nObs) - nObs
+    hasData = nObs > 0
+    timeMin = np.full(nInstruments, np.datetime64('NaT'), dtype=time.dtype)
+    timeMax = np.full(nInstruments, np.datetime64('NaT'), dtype=time.dtype)
+    if hasData.any():
+        timeMin[hasData] = np.minimum.reduceat(time, blockStart[hasData])
+        timeMax[hasData] = np.maximum.reduceat(time, blockStart[hasData])
+    return timeMin, timeMax
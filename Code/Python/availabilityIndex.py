@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+availabilityIndex.py
+Precomputed data availability of LTSP files, so the reports don't need to read the data.
+For every file (url) a small sidecar index is built once and stored as a compressed
+numpy .npz file in the QIMOS cache directory (see catalogCache). It holds the global
+attributes, and daily availability bitmaps (bit packed), number of observations and
+first/last time:
+  gridded: per variable and per DEPTH of TEMP
+  hourly: per variable and per instrument
+The index is keyed by the url and the date_created of the file: if the file is
+reprocessed the index is stale and is rebuilt the next time it is asked for.
+Run it for many sites to build or refresh the indexes of the whole network
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+import argparse
+from datetime import datetime
+
+import numpy as np
+
+from catalogCache import getCacheDir
+from availability import runLength, runPlot, instrumentCoverage
+from fileCache import openDataset
+
+INDEX_VERSION = 1
+
+
+def args():
+    parser = argparse.ArgumentParser(description="Build the availability index of LTSP files")
+    parser.add_argument('-sites', dest='sites', help='site codes, like NRSMAI NRSYON, or ALL', type=str, nargs='+', default=None, required=False)
+    parser.add_argument('-product', dest='products', help='LTSP products: hourly and/or gridded. Default both', type=str, nargs='+', default=['hourly', 'gridded'], required=False)
+    parser.add_argument('-files', dest='files', help='list of files or urls', type=str, nargs='+', default=None, required=False)
+    parser.add_argument('-rebuild', dest='rebuild', help='rebuild the indexes even if they are up to date', default=False, action="store_true", required=False)
+    vargs = parser.parse_args()
+    return(vargs)
+
+
+def getIndexDir():
+    """
+    get the directory of the availability indexes
+    :return: path
+    """
+    indexDir = os.path.join(getCacheDir(), 'availability')
+    os.makedirs(indexDir, exist_ok=True)
+    return indexDir
+
+
+def indexFileName(url):
+    """
+    name of the index file of a LTSP file
+    :param url: file name or url
+    :return: path of the .npz index
+    """
+    return os.path.join(getIndexDir(), hashlib.sha1(url.encode()).hexdigest()[:20] + '.npz')
+
+
+def _dayBitmap(nRows, nDays, rows, days):
+    bitmap = np.zeros((nRows, nDays), dtype=bool)
+    bitmap[rows, days] = True
+    return bitmap
+
+
+def buildIndex(fileName, nc=None):
+    """
+    read a gridded or hourly LTSP file and compute its availability index
+    :param fileName: file name or url
+    :param nc: the file already opened (e.g. with the Range reader), read instead of opening fileName
+    :return: index dict
+    """
+    if nc is None:
+        with openDataset(fileName) as nc:
+            return buildIndex(fileName, nc)
+
+    attrs = {key: str(value) for key, value in nc.attrs.items()}
+    index = {'url': fileName, 'date_created': attrs.get('date_created'), 'version': INDEX_VERSION,
+             'built': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'), 'attrs': attrs}
+
+    time = nc.TIME.values
+    dayStart = time.min().astype('datetime64[D]')
+    day = (time.astype('datetime64[D]') - dayStart).astype(int)
+    nDays = int(day.max()) + 1
+    index.update({'dayStart': str(dayStart), 'nDays': nDays})
+
+    if 'INSTRUMENT' in nc.dims:
+        index['product'] = 'hourly'
+        variables = [vv for vv in nc.data_vars if '_' not in vv and nc[vv].dims == ('OBSERVATION',)]
+        valid = {vv: ~np.isnan(nc[vv].values) for vv in variables}
+
+        instrumentIndex = nc.instrument_index.values
+        nInstruments = len(nc.INSTRUMENT)
+        timeMin, timeMax = instrumentCoverage(nc)
+        index['instruments'] = list(nc.instrument_id.values.astype(str))
+        index['instrumentDays'] = _dayBitmap(nInstruments, nDays, instrumentIndex, day)
+        index['instrumentCount'] = np.bincount(instrumentIndex, minlength=nInstruments)
+        index['instrumentTimeMin'] = timeMin.astype('datetime64[s]')
+        index['instrumentTimeMax'] = timeMax.astype('datetime64[s]')
+    else:
+        index['product'] = 'gridded'
+        variables = [vv for vv in nc.data_vars if nc[vv].dims[:1] == ('TIME',)]
+        valid = {vv: ~np.isnan(nc[vv].values) for vv in variables}
+
+        ## TEMP(TIME, DEPTH): one bitmap per DEPTH
+        validDepth = ~np.isnan(nc.TEMP.transpose('TIME', 'DEPTH').values)
+        timeIdx, depthIdx = np.nonzero(validDepth)
+        index['depths'] = [float(dd) for dd in nc.DEPTH.values]
+        index['depthDays'] = _dayBitmap(len(index['depths']), nDays, depthIdx, day[timeIdx])
+        index['depthCount'] = validDepth.sum(axis=0)
+
+    index['variables'] = variables
+    index['variableDays'] = np.zeros((len(variables), nDays), dtype=bool)
+    index['variableCount'] = np.zeros(len(variables), dtype=np.int64)
+    for i, vv in enumerate(variables):
+        ## any data at that time (any depth for the gridded)
+        validTime = valid[vv].reshape(len(time), -1).any(axis=1)
+        index['variableDays'][i, day[validTime]] = True
+        index['variableCount'][i] = valid[vv].sum()
+    return index
+
+
+## arrays stored in the .npz, the rest goes to the json header
+_BITMAPS = ['variableDays', 'depthDays', 'instrumentDays']
+_ARRAYS = ['variableCount', 'depthCount', 'instrumentCount', 'instrumentTimeMin', 'instrumentTimeMax']
+
+
+def writeIndex(index):
+    """
+    write the index in the cache, bitmaps packed 8 days per byte
+    :param index: index dict as returned by buildIndex
+    :return: index file name
+    """
+    header = {key: value for key, value in index.items() if key not in _BITMAPS + _ARRAYS}
+    arrays = {key: np.packbits(index[key], axis=1) for key in _BITMAPS if key in index}
+    arrays.update({key: index[key] for key in _ARRAYS if key in index})
+    fileName = indexFileName(index['url'])
+    ## unique temporary name: the threads of infoNetwork may write the same index at the same time
+    fd, tmpFile = tempfile.mkstemp(dir=getIndexDir(), prefix='index.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as ff:
+            np.savez_compressed(ff, header=np.array(json.dumps(header)), **arrays)
+        os.replace(tmpFile, fileName)
+    finally:
+        if os.path.exists(tmpFile):
+            os.remove(tmpFile)
+    return fileName
+
+
+def readIndex(url):
+    """
+    read the index of a file from the cache
+    :param url: file name or url
+    :return: index dict or None if there is no (valid) index
+    """
+    try:
+        with np.load(indexFileName(url), allow_pickle=False) as npz:
+            index = json.loads(str(npz['header']))
+            for key in npz.files:
+                if key in _BITMAPS:
+                    index[key] = np.unpackbits(npz[key], axis=1, count=index['nDays']).astype(bool)
+                elif key != 'header':
+                    index[key] = npz[key]
+    except (OSError, ValueError, KeyError):
+        return None
+    if index.get('version') != INDEX_VERSION or index.get('url') != url:
+        return None
+    return index
+
+
+def getAvailabilityIndex(fileName, dateCreated=None, build=True, rebuild=False, nc=None):
+    """
+    get the availability index of a file, (re)building it if it is missing or stale
+    :param fileName: file name or url
+    :param dateCreated: date_created of the file, if already known. Otherwise the file header is read
+    :param build: False to return None instead of building a missing or stale index
+    :param rebuild: True to rebuild the index even if it is up to date
+    :param nc: the file already opened, read instead of opening fileName to build the index
+    :return: index dict or None
+    """
+    index = None if rebuild else readIndex(fileName)
+    if index is not None:
+        if dateCreated is None:
+            with openDataset(fileName) as nc:
+                dateCreated = nc.attrs.get('date_created')
+        if str(index['date_created']) == str(dateCreated):
+            return index
+    if not build:
+        return None
+    index = buildIndex(fileName, nc)
+    writeIndex(index)
+    return index
+
+
+def dayPlot(days, lineLength=80):
+    """
+    block-plot of a daily availability bitmap
+    :param days: boolean array, one value per day
+    :param lineLength: length of the line plot
+    :return: string
+    """
+    _, lengths, values = runLength(days)
+    return runPlot(lengths, values, lineLength)
+
+
+if __name__ == "__main__":
+    vargs = args()
+    files = vargs.files or []
+    if vargs.sites:
+        from getLTSPname import getLTSPfileNames
+        sites = None if vargs.sites == ['ALL'] else vargs.sites
+        dfNames = getLTSPfileNames(sites=sites, products=vargs.products)
+        files += list(dfNames.url[dfNames.status == 'OK'])
+    for fileName in files:
+        index = readIndex(fileName)
+        try:
+            newIndex = getAvailabilityIndex(fileName, rebuild=vargs.rebuild)
+        except Exception as err:
+            print('failed: %s (%r)' % (fileName, err))
+            continue
+        status = 'up to date' if index is not None and index['built'] == newIndex['built'] else 'built'
+        print('%s: %s' % (status, fileName))
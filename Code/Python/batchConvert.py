@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+batchConvert.py
+Convert many LTSP files with hourly2csv or imos2csv in parallel.
+The files are given as a list or selected from the AODN catalogue (sites and products).
+Files already converted with the same options are skipped: local files are compared by
+size and modification time, remote files by the netCDF date_created attribute.
+A manifest (batch_manifest.json) with the timing and number of records of every file
+is written in the output directory
+"""
+
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import hourly2csv
+import imos2csv
+from getLTSPname import getLTSPfileNames
+from fileCache import openDataset
+
+MANIFEST = 'batch_manifest.json'
+
+
+def args():
+    parser = argparse.ArgumentParser(description="Convert many LTSP files in parallel with hourly2csv or imos2csv")
+    parser.add_argument('-tool', dest='tool', help='converter: hourly2csv or imos2csv. Default hourly2csv', type=str, default='hourly2csv', required=False)
+    parser.add_argument('-files', dest='files', help='list of files or urls to convert', type=str, nargs='+', default=None, required=False)
+    parser.add_argument('-sites', dest='sites', help='site codes to get the files from the catalogue, like NRSMAI NRSYON, or ALL', type=str, nargs='+', default=None, required=False)
+    parser.add_argument('-product', dest='products', help='LTSP products for the catalogue selection. Default hourly', type=str, nargs='+', default=['hourly'], required=False)
+    parser.add_argument('-param', dest='param', help='for imos2csv, parameters to extract. Default TEMP', type=str, nargs='+', default=['TEMP'], required=False)
+    parser.add_argument('-ds', dest='startDate', help='for imos2csv, start date in YYYY-MM-DD', type=str, default=None, required=False)
+    parser.add_argument('-de', dest='endDate', help='for imos2csv, end date in YYYY-MM-DD', type=str, default=None, required=False)
+    parser.add_argument('-format', dest='outputFormat', help='output format: csv, parquet or arrow. Default csv', type=str, default='csv', required=False)
+    parser.add_argument('-path', dest='output_path', help='path where the result files will be written. Default ./', type=str, default='./', required=False)
+    parser.add_argument('-workers', dest='workers', help='number of parallel processes. Default number of CPUs', type=int, default=None, required=False)
+    parser.add_argument('-force', dest='force', help='convert the files even if they are up to date', default=False, action="store_true", required=False)
+    vargs = parser.parse_args()
+    return(vargs)
+
+
+def getSourceSignature(fileName):
+    """
+    get what identifies the version of a source file
+    :param fileName: local file name or url
+    :return: dict with size and mtime (local files) or date_created (remote files)
+    """
+    if os.path.exists(fileName):
+        stat = os.stat(fileName)
+        return {'size': stat.st_size, 'mtime': stat.st_mtime}
+    with openDataset(fileName) as nc:
+        return {'date_created': nc.attrs.get('date_created')}
+
+
+def outputName(fileName, tool, options):
+    """
+    name of the output file of a conversion, from the input file name, so every input file
+    has its own output (imos2csv names its files after the site, the same for all the files of a site)
+    :param fileName: file name or url
+    :param tool: hourly2csv or imos2csv
+    :param options: conversion options
+    :return: file name without path and extension
+    """
+    baseName = (fileName.split('.nc')[0]).split('/')[-1]
+    if tool == 'imos2csv':
+        baseName += '_%s-%s' % (options['startDate'].replace('-', ''), options['endDate'].replace('-', ''))
+    return baseName
+
+
+def isUpToDate(entry, signature, tool, options):
+    """
+    check if the previous conversion of a file is still valid
+    :param entry: manifest entry of the previous run, or None
+    :param signature: current source signature
+    :param tool: hourly2csv or imos2csv
+    :param options: conversion options
+    :return: True if the output exists and was made from the same source with the same options
+    """
+    ## a skipped entry carries the output of the conversion it skipped
+    if not entry or entry.get('status') not in ['converted', 'skipped'] or entry.get('output') is None:
+        return False
+    return (entry.get('signature') == signature and entry.get('tool') == tool and entry.get('options') == options and
+            os.path.splitext(os.path.basename(entry['output']))[0] == outputName(entry['input'], tool, options) and
+            os.path.exists(entry['output']))
+
+
+def convertOne(fileName, tool, options, previous=None, force=False):
+    """
+    Convert one file, unless it is up to date. Runs in a worker process
+    :param fileName: file name or url
+    :param tool: hourly2csv or imos2csv
+    :param options: dict of converter options
+    :param previous: manifest entry of the previous run
+    :param force: convert even if it is up to date
+    :return: manifest entry
+    """
+    entry = {'input': fileName, 'tool': tool, 'options': options}
+    timeStart = time.time()
+    try:
+        signature = getSourceSignature(fileName)
+        entry['signature'] = signature
+        if not force and isUpToDate(previous, signature, tool, options):
+            entry.update({'status': 'skipped', 'output': previous['output'], 'nRecords': previous.get('nRecords'),
+                          'seconds': round(time.time() - timeStart, 3)})
+            return entry
+
+        if tool == 'hourly2csv':
+            outFileName, nRecords = hourly2csv.hourly2csv(fileName, options['outputFormat'], options['output_path'])
+        else:
+            outFileName, _, nRecords = imos2csv.imos2csv(fileName, options['param'], options['startDate'], options['endDate'],
+                                                         options['output_path'], outputFormat=options['outputFormat'],
+                                                         outName=outputName(fileName, tool, options))
+        entry.update({'status': 'converted', 'output': outFileName, 'nRecords': int(nRecords)})
+    except Exception as err:
+        entry.update({'status': 'failed', 'error': repr(err)})
+    entry['seconds'] = round(time.time() - timeStart, 3)
+    return entry
+
+
+def readManifest(output_path):
+    """
+    read the manifest of the previous runs
+    :param output_path: output directory
+    :return: dict of entries by input file
+    """
+    try:
+        with open(os.path.join(output_path, MANIFEST)) as ff:
+            return {entry['input']: entry for entry in json.load(ff)['files']}
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def batchConvert(files, tool='hourly2csv', param=None, startDate=None, endDate=None,
+                 outputFormat='csv', output_path='./', workers=None, force=False):
+    """
+    Convert a list of LTSP files in parallel
+    :param files: list of file names or urls
+    :param tool: hourly2csv or imos2csv
+    :param param: for imos2csv, list of parameters to extract. Default TEMP
+    :param startDate: for imos2csv, start date YYYY-MM-DD
+    :param endDate: for imos2csv, end date YYYY-MM-DD
+    :param outputFormat: csv, parquet or arrow
+    :param output_path: path where to write the resulting files and the manifest
+    :param workers: number of processes. Default number of CPUs
+    :param force: convert the files even if they are up to date
+    :return: list of manifest entries, in the order of files
+    """
+    if tool not in ['hourly2csv', 'imos2csv']:
+        raise ValueError('ERROR: %s is not a valid tool. Must be hourly2csv or imos2csv' % tool)
+    if tool == 'imos2csv' and not (startDate and endDate):
+        raise ValueError('ERROR: imos2csv needs start and end dates')
+    if param is None:
+        param = ['TEMP']
+
+    files = list(dict.fromkeys(files))
+    os.makedirs(output_path, exist_ok=True)
+    options = {'outputFormat': outputFormat, 'output_path': output_path}
+    if tool == 'imos2csv':
+        options.update({'param': list(param), 'startDate': startDate, 'endDate': endDate})
+
+    ## files with the same name would overwrite each other's output
+    outputs = {}
+    for fileName in files:
+        outputs.setdefault(outputName(fileName, tool, options), []).append(fileName)
+    duplicates = [fileName for names in outputs.values() if len(names) > 1 for fileName in names]
+    if duplicates:
+        raise ValueError('ERROR: these files would write the same output, convert them to different paths: ' + ', '.join(duplicates))
+
+    manifest = readManifest(output_path)
+    runStart = time.time()
+    entries = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(convertOne, fileName, tool, options, manifest.get(fileName), force): fileName
+                   for fileName in files}
+        for future in as_completed(futures):
+            entry = future.result()
+            entries[entry['input']] = entry
+            print('{status}: {input} ({seconds}s)'.format(**entry), flush=True)
+
+    manifest.update(entries)
+    with open(os.path.join(output_path, MANIFEST), 'w') as ff:
+        json.dump({'run_date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'run_seconds': round(time.time() - runStart, 3),
+                   'files': list(manifest.values())}, ff, indent=1)
+
+    return [entries[fileName] for fileName in files]
+
+
+if __name__ == "__main__":
+    vargs = args()
+    files = vargs.files or []
+    if vargs.sites:
+        sites = None if vargs.sites == ['ALL'] else vargs.sites
+        dfNames = getLTSPfileNames(sites=sites, products=vargs.products, params=vargs.param)
+        files += list(dfNames.url[dfNames.status == 'OK'])
+    if not files:
+        print('No files to convert. Use -files or -sites')
+    else:
+        result = batchConvert(files, vargs.tool, vargs.param, vargs.startDate, vargs.endDate,
+                              vargs.outputFormat, vargs.output_path, vargs.workers, vargs.force)
+        for status in ['converted', 'skipped', 'failed']:
+            print('{n} files {status}'.format(n=sum(entry['status'] == status for entry in result), status=status))
+        print('Manifest written to', os.path.join(vargs.output_path, MANIFEST))
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+catalogCache.py
+Local on-disk cache of the AODN geoserver moorings_all_map catalogue.
+The WFS csv is parsed once and stored as a parquet file with a small json
+sidecar (fetch time, ETag, Last-Modified). Within the TTL the parquet file is
+used directly, after it the server is asked with a conditional GET and the
+cache is only rewritten if the catalogue has changed. If the server can't be
+reached the (stale) cached copy is used, so the tools also work offline.
+
+The geoserver root can be changed with the QIMOS_GEOSERVER environment variable
+(e.g. a local stand-in server) and the cache directory with QIMOS_CACHE_DIR
+"""
+
+import os
+import io
+import json
+import time
+import argparse
+import urllib.request
+import urllib.error
+
+import pandas as pd
+
+GEOSERVER = 'http://geoserver-123.aodn.org.au/geoserver/ows'
+WFS_QUERY = '?typeName=moorings_all_map&SERVICE=WFS&REQUEST=GetFeature&VERSION=1.0.0&outputFormat=csv'
+CACHE_TTL = 24 * 3600
+
+## in-process copy of the catalogues: {cacheName: (loadTime, dataframe)}
+_memCache = {}
+
+
+def args():
+    parser = argparse.ArgumentParser(description="Manage the local cache of the AODN moorings catalogue")
+    parser.add_argument('-refresh', dest='refresh', help='force the download of the catalogue', default=False, action="store_true", required=False)
+    parser.add_argument('-realtime', dest='realtime', help='realtime catalogue instead of the delayed mode one', default=False, action="store_true", required=False)
+    parser.add_argument('-clear', dest='clear', help='remove all the cached catalogues', default=False, action="store_true", required=False)
+    vargs = parser.parse_args()
+    return(vargs)
+
+
+def getCacheDir():
+    """
+    get the cache directory. QIMOS_CACHE_DIR or ~/.cache/QIMOS
+    :return: path of the cache directory
+    """
+    cacheDir = os.environ.get('QIMOS_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'QIMOS'))
+    os.makedirs(cacheDir, exist_ok=True)
+    return cacheDir
+
+
+def getCatalogueURL(realtime=False):
+    """
+    build the WFS url of the moorings catalogue
+    :param realtime: True for the realtime files catalogue
+    :return: url string
+    """
+    geoserver = os.environ.get('QIMOS_GEOSERVER', GEOSERVER)
+    return geoserver + WFS_QUERY + "&CQL_FILTER=(realtime=%s)" % ('TRUE' if realtime else 'FALSE')
+
+
+def _readMeta(metaFile):
+    try:
+        with open(metaFile) as ff:
+            return json.load(ff)
+    except (OSError, ValueError):
+        return {}
+
+
+def _writeMeta(metaFile, meta):
+    tmpFile = metaFile + '.tmp'
+    with open(tmpFile, 'w') as ff:
+        json.dump(meta, ff)
+    os.replace(tmpFile, metaFile)
+
+
+def _download(url, meta, timeout=60):
+    """
+    conditional GET of the catalogue
+    :param url: WFS url
+    :param meta: cache metadata with etag and last_modified from the previous download
+    :return: (content, etag, last_modified). content is None if the server says not modified
+    """
+    request = urllib.request.Request(url)
+    if meta.get('etag'):
+        request.add_header('If-None-Match', meta['etag'])
+    if meta.get('last_modified'):
+        request.add_header('If-Modified-Since', meta['last_modified'])
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.read(), response.headers.get('ETag'), response.headers.get('Last-Modified')
+    except urllib.error.HTTPError as err:
+        if err.code == 304:
+            return None, meta.get('etag'), meta.get('last_modified')
+        raise
+
+
+def getCatalogue(realtime=False, ttl=CACHE_TTL, refresh=False, copy=True):
+    """
+    get the moorings_all_map catalogue from the local cache, refreshing it if needed
+    :param realtime: True for the realtime files catalogue
+    :param ttl: time to live of the cached catalogue in seconds
+    :param refresh: True to ignore the ttl and revalidate the catalogue against the server
+    :param copy: False to get the shared in-memory dataframe (read only). It is the same object until reloaded
+    :return: pandas dataframe
+    """
+    url = getCatalogueURL(realtime)
+    cacheName = 'moorings_all_map_realtime-%s' % ('TRUE' if realtime else 'FALSE')
+    now = time.time()
+
+    if not refresh and cacheName in _memCache:
+        loadTime, df = _memCache[cacheName]
+        if now - loadTime < ttl:
+            return df.copy() if copy else df
+
+    cacheDir = getCacheDir()
+    dataFile = os.path.join(cacheDir, cacheName + '.parquet')
+    metaFile = os.path.join(cacheDir, cacheName + '.json')
+    meta = _readMeta(metaFile)
+    isCached = os.path.exists(dataFile) and meta.get('url') == url
+
+    if isCached and not refresh and now - meta.get('fetched', 0) < ttl:
+        df = pd.read_parquet(dataFile)
+        _memCache[cacheName] = (meta['fetched'], df)
+        return df.copy() if copy else df
+
+    try:
+        content, etag, lastModified = _download(url, meta if isCached else {})
+    except (urllib.error.URLError, OSError) as err:
+        if not isCached:
+            raise
+        print('WARNING: catalogue server not available ({err}), using cached copy from {date}'.format(
+            err=err, date=time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(meta['fetched']))))
+        df = pd.read_parquet(dataFile)
+        _memCache[cacheName] = (now, df)
+        return df.copy() if copy else df
+
+    if content is None:
+        ## not modified: keep the same dataframe so anything built on it stays valid
+        df = _memCache[cacheName][1] if cacheName in _memCache else pd.read_parquet(dataFile)
+    else:
+        df = pd.read_csv(io.BytesIO(content))
+        tmpFile = dataFile + '.tmp'
+        df.to_parquet(tmpFile, index=False)
+        os.replace(tmpFile, dataFile)
+
+    _writeMeta(metaFile, {'url': url, 'fetched': now, 'etag': etag, 'last_modified': lastModified})
+    _memCache[cacheName] = (now, df)
+    return df.copy() if copy else df
+
+
+def getSiteCatalogue(site, realtime=False):
+    """
+    get the catalogue entries of one site
+    :param site: site code, like NRSMAI
+    :param realtime: True for the realtime files catalogue
+    :return: pandas dataframe
+    """
+    df = getCatalogue(realtime=realtime, copy=False)
+    return df[df.site_code == site].reset_index(drop=True)
+
+
+def clearCache():
+    """
+    remove all cached catalogues
+    :return: nothing
+    """
+    _memCache.clear()
+    cacheDir = getCacheDir()
+    for ff in os.listdir(cacheDir):
+        if ff.startswith('moorings_all_map_'):
+            os.remove(os.path.join(cacheDir, ff))
+    return
+
+
+if __name__ == "__main__":
+    vargs = args()
+    if vargs.clear:
+        clearCache()
+        print('Catalogue cache cleared')
+    else:
+        df = getCatalogue(realtime=vargs.realtime, refresh=vargs.refresh)
+        print('{n} catalogue entries cached in {path}'.format(n=len(df), path=getCacheDir()))
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+conftest.py
+fixtures shared by the tests: a local stand-in of the AODN geoserver serving a small
+synthetic moorings_all_map catalogue, with an empty catalogue cache, a stand-in of the
+S3 bucket that serves HTTP Range requests, synthetic hourly and gridded LTSP files, and a
+synthetic GBR logger parquet archive.
+Run with python -m pytest Code/Python
+"""
+
+import io
+import os
+import re
+import types
+import threading
+import functools
+import http.server
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+
+import catalogCache
+import getLTSPname
+
+
+def _row(site, path, variables, featureType='timeSeries', dataCategory='Temperature', fileVersion=2,
+         start='2008-08-28T00:00:00Z', end='2023-04-06T00:00:00Z'):
+    subFacility = 'NRS' if site.startswith('NRS') else 'QLD'
+    return {'site_code': site, 'url': 'IMOS/ANMN/%s/%s/%s' % (subFacility, site, path), 'variables': variables,
+            'feature_type': featureType, 'data_category': dataCategory, 'file_version': fileVersion,
+            'time_coverage_start': start, 'time_coverage_end': end}
+
+
+## NRSMAI has all the LTSP products, NRSYON two gridded files, PIL050 only instrument files
+CATALOGUE = pd.DataFrame([
+    _row('NRSMAI', 'aggregated_timeseries/IMOS_ANMN-NRS_TZ_20080828_NRSMAI_FV01_TEMP-aggregated-timeseries_END-20230406_C-20230511.nc', 'TEMP, DEPTH'),
+    _row('NRSMAI', 'aggregated_timeseries/IMOS_ANMN-NRS_SZ_20080828_NRSMAI_FV01_PSAL-aggregated-timeseries_END-20230406_C-20230511.nc', 'PSAL, DEPTH', dataCategory='CTD'),
+    _row('NRSMAI', 'hourly_timeseries/IMOS_ANMN-NRS_BOSTZ_20080828_NRSMAI_FV02_hourly-timeseries_END-20230406_C-20230511.nc', 'TEMP, PSAL, DEPTH'),
+    _row('NRSMAI', 'hourly_timeseries/IMOS_ANMN-NRS_BOSTZ_20080828_NRSMAI_FV02_hourly-timeseries-including-non-QC_END-20230406_C-20230511.nc', 'TEMP, PSAL, DEPTH'),
+    _row('NRSMAI', 'velocity_hourly_timeseries/IMOS_ANMN-NRS_UVW_20080828_NRSMAI_FV02_velocity-hourly-timeseries_END-20230406_C-20230511.nc', 'UCUR, VCUR, WCUR', dataCategory='Velocity'),
+    _row('NRSMAI', 'gridded_timeseries/IMOS_ANMN-NRS_TZ_20080828_NRSMAI_FV02_TEMP-gridded-timeseries_END-20230406_C-20230511.nc', 'TEMP'),
+    _row('NRSMAI', 'Temperature/IMOS_ANMN-NRS_TZ_20120101T000000Z_NRSMAI_FV01_NRSMAI-1201-SBE39-20_END-20120601T000000Z_C-20200101T000000Z.nc', 'TEMP, PRES',
+         fileVersion=1, start='2012-01-01T00:00:00Z', end='2012-06-01T00:00:00Z'),
+    _row('NRSYON', 'hourly_timeseries/IMOS_ANMN-NRS_BOSTZ_20081028_NRSYON_FV02_hourly-timeseries_END-20230406_C-20230511.nc', 'TEMP, DEPTH'),
+    _row('NRSYON', 'gridded_timeseries/IMOS_ANMN-NRS_TZ_20081028_NRSYON_FV02_TEMP-gridded-timeseries_END-20230406_C-20230511.nc', 'TEMP'),
+    _row('NRSYON', 'gridded_timeseries/IMOS_ANMN-NRS_TZ_20081028_NRSYON_FV02_TEMP-gridded-timeseries_END-20230406_C-20230601.nc', 'TEMP'),
+    _row('PIL050', 'Temperature/IMOS_ANMN-QLD_TZ_20120221T000000Z_PIL050_FV01_PIL050-1202-SBE56-25_END-20120801T000000Z_C-20200101T000000Z.nc', 'TEMP',
+         fileVersion=1, start='2012-02-21T00:00:00Z', end='2012-08-01T00:00:00Z'),
+    _row('PIL050', 'Velocity/IMOS_ANMN-QLD_AETVZ_20120221T000000Z_PIL050_FV00_PIL050-1202-WORKHORSE-ADCP-46_END-20120801T000000Z_C-20200101T000000Z.nc', 'UCUR, VCUR',
+         featureType='profile', dataCategory='Velocity', fileVersion=0, start='2012-02-21T00:00:00Z', end='2012-08-01T00:00:00Z'),
+])
+
+
+@pytest.fixture
+def catalogue(tmp_path, monkeypatch):
+    ## the WFS request is a GET of /ows with a query string: the query is ignored by the server
+    wwwDir = tmp_path / 'geoserver'
+    wwwDir.mkdir()
+    csvFile = wwwDir / 'ows'
+    CATALOGUE.to_csv(csvFile, index=False)
+    monkeypatch.setenv('QIMOS_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(catalogCache, '_memCache', {})
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=str(wwwDir))
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv('QIMOS_GEOSERVER', 'http://127.0.0.1:%i/ows' % httpd.server_port)
+    yield types.SimpleNamespace(csvFile=csvFile, httpd=httpd)
+    httpd.shutdown()
+    httpd.server_close()
+
+
+class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """
+    static files with keep-alive connections and single Range requests, like S3.
+    The client address of every connection goes to the server's connections list
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connections.append(self.client_address)
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return None
+        size = os.path.getsize(path)
+        match = re.match(r'bytes=(\d+)-(\d+)$', self.headers.get('Range', ''))
+        with open(path, 'rb') as ff:
+            if match:
+                start, end = int(match[1]), min(int(match[2]), size - 1)
+                ff.seek(start)
+                data = ff.read(end - start + 1)
+                self.send_response(206)
+                self.send_header('Content-Range', 'bytes %i-%i/%i' % (start, end, size))
+            else:
+                data = ff.read()
+                self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        return io.BytesIO(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def s3(tmp_path, monkeypatch):
+    ## the imos-data bucket served from a temporary directory. The catalogue urls map to it
+    bucketDir = tmp_path / 's3' / 'imos-data'
+    bucketDir.mkdir(parents=True)
+    handler = functools.partial(RangeRequestHandler, directory=str(tmp_path / 's3'))
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    httpd.connections = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setitem(getLTSPname.WEBROOTS, 'S3', 'http://127.0.0.1:%i/imos-data/' % httpd.server_port)
+    yield types.SimpleNamespace(bucketDir=bucketDir, httpd=httpd, url=getLTSPname.WEBROOTS['S3'])
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def makeHourly(fileName, seed=0):
+    """
+    synthetic hourly LTSP file of PIL050, laid out like the product: the observations stored by
+    instrument and sorted by TIME in each instrument. 4 instruments, the third one without
+    observations, the second one without PSAL, a 200 hours gap in every instrument
+    :param fileName: netCDF file to write
+    :param seed: random seed of the values
+    :return: xarray dataset
+    """
+    rng = np.random.default_rng(seed)
+    spans = [('2012-01-01', '2012-03-01'), ('2012-02-01', '2012-06-01'), None, ('2012-01-15T06', '2012-01-30')]
+    times, index = [], []
+    for ii, span in enumerate(spans):
+        if span is None:
+            continue
+        tt = np.arange(np.datetime64(span[0], 'h'), np.datetime64(span[1], 'h'))
+        tt = tt[(tt < tt[0] + np.timedelta64(100, 'h')) | (tt >= tt[0] + np.timedelta64(300, 'h'))]
+        times.append(tt)
+        index.append(np.full(len(tt), ii, dtype='int32'))
+    time = np.concatenate(times).astype('datetime64[ns]')
+    index = np.concatenate(index)
+    nominalDepth = np.array([10, 20, 30, 40], dtype='float32')
+    nObs = len(time)
+
+    ds = xr.Dataset({'DEPTH': ('OBSERVATION', (nominalDepth[index] + rng.normal(0, 0.5, nObs)).astype('float32')),
+                     'TEMP': ('OBSERVATION', (25 - nominalDepth[index] / 10 + rng.normal(0, 0.5, nObs)).astype('float32')),
+                     'TEMP_count': ('OBSERVATION', rng.integers(1, 7, nObs).astype('int16')),
+                     'PSAL': ('OBSERVATION', np.where(index == 1, np.nan, 35 + rng.normal(0, 0.1, nObs)).astype('float32')),
+                     'instrument_index': ('OBSERVATION', index),
+                     'instrument_id': ('INSTRUMENT', np.array([b'SBE39-%i; 100%i' % (ii, ii) for ii in range(4)], dtype='S256')),
+                     'source_file': ('INSTRUMENT', np.array([b'IMOS_ANMN-QLD_PIL050_%i.nc' % ii for ii in range(4)], dtype='S256'))},
+                    coords={'TIME': ('OBSERVATION', time),
+                            'LATITUDE': ('INSTRUMENT', np.full(4, -20.05)),
+                            'LONGITUDE': ('INSTRUMENT', np.full(4, 116.415)),
+                            'NOMINAL_DEPTH': ('INSTRUMENT', nominalDepth)},
+                    attrs={'site_code': 'PIL050',
+                           'title': 'Long time series Hourly Aggregated product',
+                           'abstract': 'Hourly Time Series Product: synthetic PIL050 file for the tests',
+                           'history': '2021-04-28: created',
+                           'time_coverage_start': '2012-01-01T00:00:00Z',
+                           'time_coverage_end': '2012-05-31T23:00:00Z',
+                           'geospatial_lat_max': -20.05, 'geospatial_lat_min': -20.05,
+                           'geospatial_lon_max': 116.415, 'geospatial_lon_min': 116.415,
+                           'geospatial_vertical_min': 10.0, 'geospatial_vertical_max': 40.0,
+                           'date_created': '2021-08-24T19:59:36',
+                           'featureType': 'timeSeries'})
+    ds.TIME.encoding.update({'units': 'days since 1950-01-01 00:00:00 UTC', 'dtype': 'float64'})
+    ds.to_netcdf(fileName)
+    return ds
+
+
+@pytest.fixture
+def hourlyFile(tmp_path):
+    fileName = str(tmp_path / 'IMOS_ANMN-QLD_BOSTZ_20120101_PIL050_FV02_hourly-timeseries_END-20120601_C-20210428.nc')
+    makeHourly(fileName)
+    return fileName
+
+
+def makeGridded(fileName, seed=0):
+    """
+    synthetic gridded LTSP file of NRSMAI: hourly TEMP(TIME, DEPTH) of 2012 at 0 to 100m every 10m.
+    The deepest depths have no data in the first 3 months, and every depth has a gap in June
+    :param fileName: netCDF file to write
+    :param seed: random seed of the values
+    :return: xarray dataset
+    """
+    rng = np.random.default_rng(seed)
+    time = pd.date_range('2012-01-01', '2012-12-31T23:00', freq='h')
+    depth = np.arange(0.0, 110.0, 10.0)
+    temp = (22 - depth / 20 + rng.normal(0, 0.5, (len(time), len(depth)))).astype('float32')
+    temp[time < '2012-04-01', 8:] = np.nan
+    temp[(time >= '2012-06-10') & (time < '2012-06-20'), :] = np.nan
+    ds = xr.Dataset({'TEMP': (('TIME', 'DEPTH'), temp)}, coords={'TIME': time, 'DEPTH': depth},
+                    attrs={'site_code': 'NRSMAI',
+                           'source_file_download': 'https://s3-ap-southeast-2.amazonaws.com/imos-data/IMOS/ANMN/NRS/NRSMAI/gridded_timeseries/NRSMAI.nc',
+                           'source_file_opendap': 'http://thredds.aodn.org.au/thredds/dodsC/IMOS/ANMN/NRS/NRSMAI/gridded_timeseries/NRSMAI.nc',
+                           'geospatial_lat_max': -42.6, 'geospatial_lat_min': -42.6,
+                           'geospatial_lon_max': 148.23, 'geospatial_lon_min': 148.23,
+                           'time_coverage_start': '2012-01-01T00:00:00Z',
+                           'time_coverage_end': '2012-12-31T23:00:00Z',
+                           'geospatial_vertical_max': 100.0,
+                           'date_created': '2023-05-11T10:00:00'})
+    ds.to_netcdf(fileName)
+    return ds
+
+
+@pytest.fixture
+def griddedFile(tmp_path):
+    fileName = str(tmp_path / 'IMOS_ANMN-NRS_TZ_20120101_NRSMAI_FV02_TEMP-gridded-timeseries_END-20121231_C-20230511.nc')
+    makeGridded(fileName)
+    return fileName
+
+
+## reefs of the logger archive: a numeric looking reef id, and two reefs with the same site name
+LOGGER_SITES = ['Davies Reef - 18-096', 'Myrmidon Reef - 18-064', 'Heron Island - 23-052', 'One Tree - 1001',
+                'Lizard Island - 14-116a', 'Lizard Island - 14-116b']
+
+
+def makeLoggers(parquetDir, seed=0, nFiles=3, nRows=20000):
+    """
+    synthetic GBR logger parquet archive: the rows of all the reefs and parameters mixed,
+    in several files of several row groups
+    :param parquetDir: directory of the archive
+    :param seed: random seed
+    :param nFiles: number of parquet files
+    :param nRows: number of rows per file
+    :return: dataframe of all the rows, in the order of the archive
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(parquetDir, exist_ok=True)
+    names, codes = zip(*[line.split(' - ') for line in LOGGER_SITES])
+    parameters = ['Water Temperature', 'Water Pressure']
+    dfs = []
+    for part in range(nFiles):
+        ## no data of the last reef
+        idx = rng.integers(0, len(codes) - 1, nRows)
+        df = pd.DataFrame({'site': np.array(names)[idx], 'gbrmpa_reef_id': np.array(codes)[idx],
+                           'lat': -18 - idx / 10, 'lon': 147 + idx / 10, 'depth': rng.uniform(1, 10, nRows).round(1),
+                           'time': pd.Timestamp('2010-01-01') + pd.to_timedelta(rng.integers(0, 10 * 365 * 86400, nRows), 's'),
+                           'parameter': np.array(parameters)[rng.integers(0, 2, nRows)],
+                           'qc_val': rng.normal(26, 2, nRows).round(3)})
+        df.to_parquet(os.path.join(parquetDir, 'part.%i.parquet' % part), index=False, row_group_size=5000)
+        dfs.append(df)
+    return pd.concat(dfs, ignore_index=True)
+
+
+@pytest.fixture
+def loggers(tmp_path):
+    pytest.importorskip('pyarrow')
+    parquetDir = str(tmp_path / 'parquet')
+    return parquetDir, makeLoggers(parquetDir)
@@ -5,16 +5,16 @@
 
 import os
 import sys
-from datetime import date, datetime
-from itertools import groupby
+from datetime import datetime
 import argparse
 
 import matplotlib.pyplot as plt
-import numpy as np
 import pandas as pd
-import xarray as xr
 from tabulate import tabulate
 
+from catalogCache import getCatalogue
+from fileCache import openDataset
+
 pd.options.display.max_colwidth = 200
 
 
@@ -62,8 +62,7 @@ def getFileName(site, param=None):
         print('ERROR: {0} is a wrong parameter. Must be T or V'.format(param))
         sys.exit()
 
-    url = ("http://geoserver-123.aodn.org.au/geoserver/ows?typeName=moorings_all_map&SERVICE=WFS&REQUEST=GetFeature&VERSION=1.0.0&outputFormat=csv&CQL_FILTER=(realtime='FALSE')")
-    df = pd.read_csv(url)
+    df = getCatalogue()
     siteList = df.site_code.unique().tolist()
     if site not in siteList:
         print("The site code {site} is not valid. EXIT".format(site=site))
@@ -134,7 +133,7 @@ def exploreMooring(fileName, param,  makePlot=False):
     print("IMOS ANMN Explorer")
     print("File: {}".format(fileName))
     table = []
-    with xr.open_dataset(fileName) as nc:
+    with openDataset(fileName) as nc:
 
         # ## convert HEIGHT_ABOVE_SENSOR to DEPTH
         # if nc['HEIGHT_ABOVE_SENSOR'].positive =='up':
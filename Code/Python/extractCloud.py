@@ -1,14 +1,27 @@
 ## extract cloud variables from already clipped VISST product at lat/lon
 ## coordinates pairs are read from a text file
+## all the sites are snapped to the nearest grid cell at once (siteIndex.GridIndex) and
+## extracted with one pointwise selection along a site dimension. Sites out of the grid are left out
+## the product is one netCDF file, the directory of daily files or the Zarr cube of getHW8clouds.py.
+## With -store the site time series are kept in a Zarr store (time, site) that is updated incrementally:
+## only the time steps of the cube after the last one in the store are read and appended, the new sites
+## get their full history, and the monthly climatology of every site is updated from the new values only
 ## E Klein. ekleins@gmail.com
 ## 2020-10-21
 
 import os
-import itertools
+import glob
+import argparse
 import numpy as np
 import pandas as pd
 import xarray as xr
 
+from siteIndex import GridIndex
+from getHW8clouds import TIME_CHUNK, TIME_ENCODING, readState, writeState, truncateZarr
+
+## sites of the state file of a site store
+SITE_COLUMNS = ['Site', 'Latitude', 'Longitude', 'latIndex', 'lonIndex']
+
 ## setup directories
 dataDir = "VISST/GBR_cat"
 resultsDir = "VISST/GBR_cat"
@@ -17,33 +30,260 @@ resultsDir = "VISST/GBR_cat"
 dataFileName = "GBR_2016_SepOct.nc"
 coordsFileName = "coords.csv"
 
-## read data and coordinates files
-nc = xr.open_dataset(os.path.join(dataDir, dataFileName))
-df = pd.read_csv(os.path.join(dataDir, coordsFileName))
 
-## set latitude and longitude as indices
-nc = nc.set_index(lat="latitude", lon="longitude")
+def args():
+    parser = argparse.ArgumentParser(description="Extract cloud variables from a clipped VISST file at many sites")
+    parser.add_argument('-file', dest='fileName', help='VISST netCDF file, directory of daily files or Zarr cube. Default %s' % os.path.join(dataDir, dataFileName), type=str, default=os.path.join(dataDir, dataFileName), required=False)
+    parser.add_argument('-coords', dest='coordsFileName', help='csv file with Site, Latitude and Longitude columns. Default %s' % os.path.join(dataDir, coordsFileName), type=str, default=os.path.join(dataDir, coordsFileName), required=False)
+    parser.add_argument('-maxdist', dest='maxDistance', help='max distance in km from the site to the centre of its grid cell. Default no limit', type=float, default=None, required=False)
+    parser.add_argument('-path', dest='outPath', help='path of the output csv file. Default %s' % resultsDir, type=str, default=resultsDir, required=False)
+    parser.add_argument('-store', dest='store', help='Zarr store of the site time series, updated with the new time steps only. The output csv file is the monthly climatology of the sites', type=str, default=None, required=False)
+    vargs = parser.parse_args()
+    return(vargs)
+
+
+def prepareCloud(nc):
+    """
+    index the VISST dataset by latitude and longitude, keep the clear sky longwave flux
+    and shortwave albedo and remove the cloud and scene type dimensions
+    :param nc: xarray dataset
+    :return: xarray dataset
+    """
+    ## set latitude and longitude as indices
+    nc = nc.set_index(lat="latitude", lon="longitude")
+
+    ## select flux and albedo variable only for clear sky
+    if 'broadband_longwave_flux' in nc:
+        nc['LW_flux'] = nc.broadband_longwave_flux[:,:,:,0]
+    if 'broadband_shortwave_albedo' in nc:
+        nc['SW_albedo'] = nc.broadband_shortwave_albedo[:,:,:,0]
+
+    ## clean the dataset
+    nc = nc.drop_vars(["broadband_longwave_flux", "broadband_shortwave_albedo", 'cld_type', 'scn_type'], errors='ignore')
+    return nc.squeeze()
+
+
+def openCloud(fileName):
+    """
+    open a clipped VISST product
+    :param fileName: netCDF file, directory of daily netCDF files or Zarr cube (getHW8clouds.py)
+    :return: xarray dataset
+    """
+    if fileName.rstrip('/').endswith('.zarr'):
+        return xr.open_zarr(fileName)
+    if os.path.isdir(fileName):
+        return xr.open_mfdataset(sorted(glob.glob(os.path.join(fileName, '*.nc'))), combine='nested', concat_dim='time')
+    return xr.open_dataset(fileName)
+
+
+def siteCells(nc, df, maxDistance=None):
+    """
+    nearest grid cell of the sites. The sites out of the grid (or further than maxDistance
+    from the cell centre) are left out
+    :param nc: xarray dataset as returned by prepareCloud
+    :param df: dataframe with Site, Latitude and Longitude columns
+    :param maxDistance: max distance in km from the site to the centre of its grid cell. Default no limit
+    :return: dataframe of the sites in the domain, dataframe of their cells (siteIndex.GridIndex.query)
+    """
+    cells = GridIndex(nc.indexes['lat'], nc.indexes['lon']).query(df.Latitude, df.Longitude, maxDistance)
+    if not cells.inDomain.all():
+        print('WARNING: sites out of the domain, not extracted: ' + ', '.join(df.Site[~cells.inDomain.values].astype(str)))
+        df, cells = df[cells.inDomain.values], cells[cells.inDomain]
+    return df, cells
+
+
+def selectCells(nc, cells):
+    """
+    pointwise selection of the grid cells
+    :param nc: xarray dataset as returned by prepareCloud
+    :param cells: dataframe of the cells, as returned by siteCells
+    :return: xarray dataset with a site dimension, in memory
+    """
+    latIdx, lonIdx = cells.latIndex.values, cells.lonIndex.values
+    ## read the box around the sites in contiguous reads (the netCDF backend reads array
+    ## indexers one index at a time), one time chunk of the cube at a time so only the box
+    ## of a chunk and the site series are in memory, then select the points of each chunk
+    latStart, lonStart = latIdx.min(), lonIdx.min()
+    ncBox = nc.isel(lat=slice(latStart, latIdx.max() + 1), lon=slice(lonStart, lonIdx.max() + 1))
+    siteLat, siteLon = xr.DataArray(latIdx - latStart, dims='site'), xr.DataArray(lonIdx - lonStart, dims='site')
+    if 'time' not in ncBox.dims:
+        return ncBox.load().isel(lat=siteLat, lon=siteLon)
+    blocks = [ncBox.isel(time=slice(start, start + TIME_CHUNK)).load().isel(lat=siteLat, lon=siteLon)
+              for start in range(0, len(ncBox.time), TIME_CHUNK)]
+    if len(blocks) == 1:
+        return blocks[0]
+    ## same variable order as one block: the order of the csv columns
+    ds = xr.concat(blocks, dim='time', data_vars='minimal', coords='minimal', compat='override')
+    return xr.Dataset({name: ds.variables[name] for name in blocks[0].variables}, attrs=ds.attrs).set_coords(list(blocks[0].coords))
+
+
+def extractSites(nc, df, maxDistance=None):
+    """
+    extract the time series of all the sites in one pointwise selection.
+    The sites out of the grid (or further than maxDistance from the cell centre) are left out
+    :param nc: xarray dataset as returned by prepareCloud
+    :param df: dataframe with Site, Latitude and Longitude columns
+    :param maxDistance: max distance in km from the site to the centre of its grid cell. Default no limit
+    :return: dataframe indexed by time (and any other dimension), one block of rows per site,
+             with the lat/lon of the grid cell and the Site
+    """
+    df, cells = siteCells(nc, df, maxDistance)
+    if len(df) == 0:
+        raise ValueError('ERROR: no site in the domain of the grid')
+    ncSites = selectCells(nc, cells)
+
+    ## one block of rows per site, in the order of the coordinates file
+    dfSites = ncSites.to_dataframe(dim_order=['site'] + [dim for dim in ncSites.dims if dim != 'site'])
+    siteIdx = dfSites.index.get_level_values('site')
+    dfSites = dfSites.droplevel('site')
+    dfSites['Site'] = df.Site.values[siteIdx]
+    return dfSites
+
+
+def _monthlySums(ds):
+    ## sum and number of the values of every variable and site by month of the year, arrays (12, site)
+    ds = ds.astype('float64')
+    month = ds.time.dt.month
+    sums = ds.fillna(0).groupby(month).sum('time').reindex(month=range(1, 13), fill_value=0)
+    counts = ds.notnull().groupby(month).sum('time').reindex(month=range(1, 13), fill_value=0)
+    return ({vv: sums[vv].transpose('month', 'site').values for vv in ds.data_vars},
+            {vv: counts[vv].transpose('month', 'site').values for vv in ds.data_vars})
+
+
+def _siteDataset(nc, sites, cells):
+    ## time series of the sites, indexed by site name, with the site positions
+    ds = selectCells(nc, cells).drop_vars(['lat', 'lon'])
+    ds = ds.assign_coords(site=np.array(sites.Site.astype(str), dtype=object),
+                          Latitude=('site', sites.Latitude.values.astype(float)),
+                          Longitude=('site', sites.Longitude.values.astype(float)),
+                          latCell=('site', cells.latitude.values), lonCell=('site', cells.longitude.values))
+    return ds.transpose('time', 'site', ...)
+
+
+def _siteRecords(sites, cells):
+    ## rows of the state file: site, position and grid cell
+    return [[str(site), float(lat), float(lon), int(latIndex), int(lonIndex)] for site, lat, lon, latIndex, lonIndex in
+            zip(sites.Site, sites.Latitude, sites.Longitude, cells.latIndex, cells.lonIndex)]
+
+
+def _storedCells(nc, state, store):
+    ## sites of the store with the grid cells they were snapped to when they were added
+    sites = pd.DataFrame(state['sites'], columns=SITE_COLUMNS)
+    latAxis, lonAxis = nc.indexes['lat'].values, nc.indexes['lon'].values
+    if (sites.latIndex >= len(latAxis)).any() or (sites.lonIndex >= len(lonAxis)).any():
+        raise ValueError('ERROR: the grid cells of the sites of %s are not in the cloud product' % store)
+    cells = pd.DataFrame({'latIndex': sites.latIndex.values, 'lonIndex': sites.lonIndex.values,
+                          'latitude': latAxis[sites.latIndex.values], 'longitude': lonAxis[sites.lonIndex.values]})
+    return sites, cells
+
+
+def updateSiteStore(nc, df, store, maxDistance=None):
+    """
+    update the Zarr store of the site time series: the time steps of the product after the last one
+    in the store are extracted and appended for all the sites of the store, and the sites of df that
+    are not in the store are added with their full history. The monthly sums of every site are kept
+    in the state file next to the store and updated with the new values only. The sites are snapped
+    to their grid cell (and checked against maxDistance) once, when they are added
+    :param nc: xarray dataset as returned by prepareCloud, time sorted (e.g. the cube of getHW8clouds.py)
+    :param df: dataframe with Site, Latitude and Longitude columns
+    :param store: Zarr store (.zarr) of the site time series
+    :param maxDistance: max distance in km from the site to the centre of its grid cell. Default no limit
+    :return: state dict: sites, number of time steps, last time, monthly sums and counts
+    """
+    state = readState(store, {'sites': [], 'nTime': 0, 'lastTime': None, 'climSum': {}, 'climCount': {}})
+    if state['nTime'] and os.path.exists(store):
+        truncateZarr(store, {'time': state['nTime'], 'site': len(state['sites'])})
+    if 'time' not in nc.dims:
+        nc = nc.expand_dims('time')
+
+    def addSums(sums, counts, newSites=False):
+        ## new sites are new columns of the (12, site) arrays, new time steps are added to them
+        for key, values in (('climSum', sums), ('climCount', counts)):
+            for vv in values:
+                stored = np.array(state[key].get(vv, np.zeros((12, 0))))
+                state[key][vv] = (np.concatenate([stored, values[vv]], axis=1) if newSites else stored + values[vv]).tolist()
+
+    ## new sites: full history up to the last time step of the store
+    storedSites = [row[0] for row in state['sites']]
+    dfNew = df[~df.Site.astype(str).isin(storedSites)].drop_duplicates('Site')
+    cellsNew = None
+    if len(dfNew):
+        dfNew, cellsNew = siteCells(nc, dfNew, maxDistance)
+    if len(dfNew) and state['nTime']:
+        ncHistory = nc.sel(time=slice(None, pd.Timestamp(state['lastTime'])))
+        if len(ncHistory.time) != state['nTime']:
+            raise ValueError('ERROR: the %i time steps of %s are not in the cloud product' % (state['nTime'], store))
+        ds = _siteDataset(ncHistory, dfNew, cellsNew)
+        ds.drop_vars('time').to_zarr(store, append_dim='site')
+        addSums(*_monthlySums(ds), newSites=True)
+        state['sites'] += _siteRecords(dfNew, cellsNew)
+        writeState(store, state)
+        print('%i sites added: %s' % (len(dfNew), ', '.join(dfNew.Site.astype(str))))
+    sites, cells = _storedCells(nc, state, store) if state['nTime'] else (dfNew, cellsNew)
+    if len(sites) == 0:
+        raise ValueError('ERROR: no site in the domain of the grid')
+
+    ## new time steps of all the sites
+    timeIndex = nc.indexes['time']
+    first = timeIndex.searchsorted(pd.Timestamp(state['lastTime']), side='right') if state['lastTime'] else 0
+    if first == len(timeIndex):
+        return state
+    ds = _siteDataset(nc.isel(time=slice(first, None)), sites, cells)
+    if state['nTime'] == 0:
+        encoding = {vv: {'chunks': (TIME_CHUNK, len(sites))} for vv in ds.data_vars}
+        encoding['time'] = TIME_ENCODING
+        ds.to_zarr(store, mode='w', encoding=encoding, zarr_format=2)
+        addSums(*_monthlySums(ds), newSites=True)
+        state['sites'] = _siteRecords(sites, cells)
+    else:
+        ds.to_zarr(store, append_dim='time')
+        addSums(*_monthlySums(ds))
+    state['nTime'] += len(ds.time)
+    state['lastTime'] = str(ds.indexes['time'][-1])
+    writeState(store, state)
+    return state
+
+
+def siteClimatology(store):
+    """
+    monthly climatology of the sites of a store, from the sums of its state file (no data is read)
+    :param store: Zarr store of the site time series
+    :return: dataframe indexed by Site and month, mean and number of values of every variable
+    """
+    state = readState(store, {})
+    if not state.get('nTime'):
+        raise ValueError('ERROR: %s is empty' % store)
+    index = pd.MultiIndex.from_product([[row[0] for row in state['sites']], range(1, 13)], names=['Site', 'month'])
+    dfClim = pd.DataFrame(index=index)
+    for vv in state['climSum']:
+        ## arrays (12, site) to one row per site and month
+        sums, counts = np.array(state['climSum'][vv]).T.ravel(), np.array(state['climCount'][vv]).T.ravel()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            dfClim[vv] = np.where(counts > 0, sums / counts, np.nan)
+        dfClim[vv + '_count'] = counts.astype(int)
+    return dfClim
 
-## select flux and albedo variable only for clear sky
-nc['LW_flux'] = nc.broadband_longwave_flux[:,:,:,0]
-nc['SW_albedo'] = nc.broadband_shortwave_albedo[:,:,:,0]
 
-## clean the dataset
-nc = nc.drop(["broadband_longwave_flux", "broadband_shortwave_albedo", 'cld_type', 'scn_type'])
-nc = nc.squeeze()
+if __name__ == "__main__":
+    vargs = args()
 
+    ## read data and coordinates files
+    nc = prepareCloud(openCloud(vargs.fileName))
+    df = pd.read_csv(vargs.coordsFileName)
 
-## extract data from coordinates
-df_sites = pd.DataFrame()
-for i in range(len(df)):
-    print(i, df.Site[i])
-    llat = df.Latitude[i]
-    llon = df.Longitude[i]
-    nc_select = nc.sel(lat=[llat], lon=[llon], method="nearest").squeeze()
-    timeLen = len(nc_select.time)
+    if vargs.store:
+        ## append the new time steps to the site store and write the site climatology
+        nTime = readState(vargs.store, {'nTime': 0})['nTime']
+        state = updateSiteStore(nc, df, vargs.store, vargs.maxDistance)
+        print('%i new time steps, %i sites, %i time steps in %s' % (state['nTime'] - nTime, len(state['sites']), state['nTime'], vargs.store))
+        outFileName = os.path.join(vargs.outPath, ("clouds_climatology_" + os.path.basename(vargs.store.rstrip('/')).split(".")[0] + ".csv"))
+        siteClimatology(vargs.store).to_csv(outFileName)
+        print('climatology of %i sites written to %s' % (len(state['sites']), outFileName))
+    else:
+        ## extract data from coordinates
+        df_sites = extractSites(nc, df, vargs.maxDistance)
 
-    data = nc_select.to_dataframe()
-    data['Site'] = df.Site[i]
-    df_sites = df_sites.append(data)
-## write results
-df_sites.to_csv(os.path.join(dataDir, ("clouds_" + dataFileName.split(".")[0] + ".csv")))
+        ## write results
+        outFileName = os.path.join(vargs.outPath, ("clouds_" + os.path.basename(vargs.fileName).split(".")[0] + ".csv"))
+        df_sites.to_csv(outFileName)
+        print('%i sites extracted to %s' % (df_sites.Site.nunique(), outFileName))
@@ -1,54 +1,305 @@
 ## This function extracts the full temp logger data set from a GBR specific site
 ## data comes from the full logger dataset stored as parquet files
-## the site must be picked from list
+## the site must be picked from list, or given with -site
+## the site and parameter filters go into the parquet reader with the columns to read,
+## so only the row groups of the site are decoded. In an archive rewritten with
+## -repartition (partitioned by reef id and parameter) only the files of the site are read
+## many sites (several -site or -regex) are extracted in one scan of the archive
 import os
-import datetime
+import re
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import pandas as pd
-import dask
-import dask.dataframe as dd
 
 parquetDir = '/DATA/AIMS/Loggers/parquet'
 dataDir = '/DATA/AIMS/Loggers/loggers_GBR'
 rootDir = '/DATA/AIMS/Loggers'
 outDir = '/DATA/AIMS/Loggers/Extracted'
 
+PARAMETER = "Water Temperature"
+PARTITIONS = ['gbrmpa_reef_id', 'parameter']
+ROW_GROUP_SIZE = 64 * 1024
+BATCH_SIZE = 256 * 1024
+BUFFER_ROWS = 1024 * 1024
+WORKERS = 4
+
+
+def args():
+    parser = argparse.ArgumentParser(description="Extract the logger data of GBR sites from the parquet archive")
+    parser.add_argument('-site', dest='sites', help='site codes (gbrmpa_reef_id) or numbers in the site list. Default: pick it from the list', type=str, nargs='+', default=None, required=False)
+    parser.add_argument('-regex', dest='regex', help='extract the sites of the site list that match this regular expression, like "Davies|Myrmidon" or "." for all', type=str, default=None, required=False)
+    parser.add_argument('-param', dest='parameter', help='parameter. Default "%s"' % PARAMETER, type=str, default=PARAMETER, required=False)
+    parser.add_argument('-columns', dest='columns', help='columns to extract. Default all', type=str, nargs='+', default=None, required=False)
+    parser.add_argument('-parquet', dest='parquetDir', help='parquet archive. Default %s' % parquetDir, type=str, default=parquetDir, required=False)
+    parser.add_argument('-sitelist', dest='siteListFile', help='site list, one "site name - site code" per line. Default %s' % os.path.join(rootDir, "siteList.txt"), type=str, default=os.path.join(rootDir, "siteList.txt"), required=False)
+    parser.add_argument('-path', dest='outDir', help='output directory. Default %s' % outDir, type=str, default=outDir, required=False)
+    parser.add_argument('-workers', dest='workers', help='number of files written at the same time in a multi-site extraction. Default %i' % WORKERS, type=int, default=WORKERS, required=False)
+    parser.add_argument('-repartition', dest='repartitionDir', help='rewrite the archive into this directory, partitioned by reef id and parameter, and exit', type=str, default=None, required=False)
+    vargs = parser.parse_args()
+    return(vargs)
+
+
+def readSiteList(fileName=os.path.join(rootDir, "siteList.txt")):
+    """
+    read the list of sites
+    :param fileName: text file, one "site name - site code" per line
+    :return: list of strings
+    """
+    with open(fileName) as ff:
+        return ff.read().splitlines()
+
+
+def siteCodeName(siteLine):
+    """
+    :param siteLine: line of the site list, "site name - site code"
+    :return: site code, site name without spaces or commas (for the output file name)
+    """
+    siteCode = siteLine.split(' - ')[-1]
+    siteName = siteLine.split(' - ')[0].replace(" ", "").replace(",", "")
+    return siteCode, siteName
+
 
-print("TEMP LOGGER EXTRACTOR")
+def isPartitioned(parquetDir):
+    """
+    :param parquetDir: parquet archive
+    :return: True if the archive is partitioned by reef id and parameter (see repartitionArchive)
+    """
+    return any(ff.startswith(PARTITIONS[0] + '=') for ff in os.listdir(parquetDir))
 
 
-with open(os.path.join(rootDir, "siteList.txt")) as ff:
-    siteList = ff.read().splitlines()
+def loggerDataset(parquetDir=parquetDir):
+    """
+    open the parquet archive as a pyarrow dataset, nothing is read yet
+    :param parquetDir: parquet archive, plain or partitioned by reef id and parameter
+    :return: pyarrow dataset
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
 
+    if not isPartitioned(parquetDir):
+        return ds.dataset(parquetDir, format='parquet')
+    ## string partition values, otherwise numeric looking reef ids would be read as integers.
+    ## The schema of the original archive keeps the order of the columns
+    partitioning = ds.partitioning(pa.schema([(name, pa.string()) for name in PARTITIONS]), flavor='hive')
+    schema = pq.read_schema(os.path.join(parquetDir, '_common_metadata'))
+    return ds.dataset(parquetDir, format='parquet', partitioning=partitioning, schema=schema)
 
-go = 'r'
-while go == 'r':
-    ## select site
-    for i, site in enumerate(siteList):
-        print(i, site)
 
-    siteID = input("Input your site number: ")
-    if int(siteID) > len(siteList)-1:
-        go = input("Invalid site number, re-try (r), or exit (e) ")
+def siteFilter(siteCodes, parameter=PARAMETER):
+    """
+    filter expression on the reef id and the parameter
+    :param siteCodes: site code or list of site codes
+    :param parameter: parameter, None for all
+    :return: pyarrow dataset expression
+    """
+    import pyarrow.dataset as ds
+
+    if isinstance(siteCodes, str):
+        expression = ds.field('gbrmpa_reef_id') == siteCodes
     else:
-        print('Selected site is ', siteList[int(siteID)])
-        go = input("Proceed (p), re-try (r), or exit (e) ")
+        expression = ds.field('gbrmpa_reef_id').isin(list(siteCodes))
+    if parameter is not None:
+        expression = expression & (ds.field('parameter') == parameter)
+    return expression
+
+
+def extractSite(siteCode, parameter=PARAMETER, parquetDir=parquetDir, columns=None):
+    """
+    extract the logger data of one site
+    :param siteCode: site code (gbrmpa_reef_id)
+    :param parameter: parameter, None for all
+    :param parquetDir: parquet archive
+    :param columns: list of columns to read, None for all
+    :return: dataframe
+    """
+    dataset = loggerDataset(parquetDir)
+    return dataset.to_table(columns=columns, filter=siteFilter(siteCode, parameter)).to_pandas()
+
+
+def selectSites(siteList, sites=None, regex=None):
+    """
+    select sites from the site list
+    :param siteList: list of sites, "site name - site code"
+    :param sites: list of site codes or numbers in the list. Codes not in the list are kept as they are
+    :param regex: regular expression matched against the lines of the list (name or code)
+    :return: list of site lines
+    """
+    selected = []
+    for site in sites or []:
+        if site.isdigit() and int(site) < len(siteList):
+            selected.append(siteList[int(site)])
+        else:
+            ## site code, with its name from the list if it is there
+            selected.append(([line for line in siteList if siteCodeName(line)[0] == site] + [site])[0])
+    if regex is not None:
+        selected += [line for line in siteList if re.search(regex, line) and line not in selected]
+    return selected
+
+
+def _writeBlock(table, fileName, header):
+    table.to_pandas().to_csv(fileName, index=False, header=header, mode='w' if header else 'a')
+
 
-if go == 'e':
-    exit()
+def extractSites(siteLines, parameter=PARAMETER, parquetDir=parquetDir, columns=None, outDir=outDir,
+                 workers=WORKERS, batchSize=BATCH_SIZE, bufferRows=BUFFER_ROWS):
+    """
+    extract the logger data of many sites in one scan of the archive. The record batches are
+    split by site as they are read and buffered; when the buffers hold more than bufferRows rows
+    they are appended to one csv per site by a pool of writers, so the memory stays bounded
+    :param siteLines: list of sites, "site name - site code" (or only the code)
+    :param parameter: parameter, None for all
+    :param parquetDir: parquet archive
+    :param columns: list of columns to extract, None for all
+    :param outDir: output directory
+    :param workers: number of writing threads
+    :param batchSize: max number of rows read at a time
+    :param bufferRows: max number of rows buffered before writing
+    :return: dict site code: (output file name, number of records)
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
 
+    outFiles = {}
+    for siteLine in siteLines:
+        siteCode, siteName = siteCodeName(siteLine)
+        fileName = os.path.join(outDir, siteName) + ".csv"
+        if fileName in [outFile for outFile, _ in outFiles.values()]:
+            fileName = os.path.join(outDir, siteName + '_' + siteCode) + ".csv"
+        outFiles[siteCode] = (fileName, 0)
 
-## Do the extraction
-print("Extracting logger data for " + siteList[int(siteID)] + ". It will take few minutes...")
-siteCode = siteList[int(siteID)].split(' - ')[-1]
-siteName = siteList[int(siteID)].split(' - ')[0].replace(" ", "").replace(",", "")
+    dataset = loggerDataset(parquetDir)
+    columns = columns or dataset.schema.names
+    readColumns = columns + ([] if 'gbrmpa_reef_id' in columns else ['gbrmpa_reef_id'])
+    scanner = dataset.scanner(columns=readColumns, filter=siteFilter(list(outFiles), parameter),
+                              batch_size=batchSize, batch_readahead=1, fragment_readahead=1)
 
-dfp = dd.read_parquet(parquetDir)
-dfSite = dfp[(dfp.gbrmpa_reef_id==siteCode) & (dfp.parameter=="Water Temperature")].compute()
+    buffers = {}
+    pending = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
 
-## save data
-dfSite.to_csv(os.path.join(outDir, siteName) + ".csv", index=False)
-print("Extracted logger data saved in", (os.path.join(outDir, siteName) + ".csv"))
+        def flush():
+            for code, blocks in buffers.items():
+                fileName, nRecords = outFiles[code]
+                table = pa.Table.from_batches(blocks)
+                ## one write at a time per file, in order
+                if code in pending:
+                    pending.pop(code).result()
+                pending[code] = pool.submit(_writeBlock, table, fileName, nRecords == 0)
+                outFiles[code] = (fileName, nRecords + table.num_rows)
+            buffers.clear()
+
+        nBuffered = 0
+        for batch in scanner.to_batches():
+            if batch.num_rows == 0:
+                continue
+            ## rows of each site, in the order of the archive
+            siteIndex = pc.dictionary_encode(batch.column('gbrmpa_reef_id'))
+            indices = siteIndex.indices.to_numpy(zero_copy_only=False)
+            counts = np.bincount(indices, minlength=len(siteIndex.dictionary))
+            batch = batch.take(np.argsort(indices, kind='stable')).select(columns)
+            blockStart = 0
+            for code, count in zip(siteIndex.dictionary.to_pylist(), counts):
+                buffers.setdefault(code, []).append(batch.slice(blockStart, count))
+                blockStart += count
+            nBuffered += batch.num_rows
+            if nBuffered >= bufferRows:
+                flush()
+                nBuffered = 0
+        flush()
+        for future in pending.values():
+            future.result()
+
+    ## sites without data: header only
+    for code, (fileName, nRecords) in outFiles.items():
+        if nRecords == 0:
+            pd.DataFrame(columns=columns).to_csv(fileName, index=False)
+    return outFiles
+
+
+def repartitionArchive(parquetDir, newParquetDir):
+    """
+    rewrite the archive partitioned by reef id and parameter
+    (newParquetDir/gbrmpa_reef_id=CODE/parameter=NAME/part-N.parquet), streaming, one batch at a time
+    :param parquetDir: parquet archive
+    :param newParquetDir: directory of the partitioned archive
+    :return: newParquetDir
+    """
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    dataset = loggerDataset(parquetDir)
+    ## rows are buffered per partition up to ROW_GROUP_SIZE, so the row groups don't get tiny
+    ds.write_dataset(dataset, newParquetDir, format='parquet', partitioning=PARTITIONS, partitioning_flavor='hive',
+                     basename_template='part-{i}.parquet', existing_data_behavior='delete_matching',
+                     min_rows_per_group=ROW_GROUP_SIZE, max_rows_per_group=ROW_GROUP_SIZE, preserve_order=True)
+    pq.write_metadata(dataset.schema, os.path.join(newParquetDir, '_common_metadata'))
+    return newParquetDir
+
+
+def pickSite(siteList):
+    """
+    ask for the site number
+    :param siteList: list of sites
+    :return: line of the selected site, None to exit
+    """
+    go = 'r'
+    while go == 'r':
+        ## select site
+        for i, site in enumerate(siteList):
+            print(i, site)
+
+        siteID = input("Input your site number: ")
+        if int(siteID) > len(siteList)-1:
+            go = input("Invalid site number, re-try (r), or exit (e) ")
+        else:
+            print('Selected site is ', siteList[int(siteID)])
+            go = input("Proceed (p), re-try (r), or exit (e) ")
+
+    if go == 'e':
+        return None
+    return siteList[int(siteID)]
+
+
+if __name__ == "__main__":
+    vargs = args()
+
+    if vargs.repartitionDir:
+        print("Rewriting " + vargs.parquetDir + " partitioned by reef id and parameter...")
+        print("Partitioned archive saved in", repartitionArchive(vargs.parquetDir, vargs.repartitionDir))
+        exit()
+
+    print("TEMP LOGGER EXTRACTOR")
+
+    siteList = readSiteList(vargs.siteListFile)
+    if vargs.sites is None and vargs.regex is None:
+        siteLine = pickSite(siteList)
+        if siteLine is None:
+            exit()
+        siteLines = [siteLine]
+    else:
+        siteLines = selectSites(siteList, vargs.sites, vargs.regex)
 
+    if len(siteLines) > 1:
+        ## all the sites in one scan
+        print("Extracting logger data for %i sites..." % len(siteLines))
+        outFiles = extractSites(siteLines, vargs.parameter, vargs.parquetDir, vargs.columns, vargs.outDir, vargs.workers)
+        for fileName, nRecords in outFiles.values():
+            print("%i records of extracted logger data saved in %s" % (nRecords, fileName))
+        exit()
+    elif not siteLines:
+        print("No site selected")
+        exit()
+    siteLine = siteLines[0]
 
+    ## Do the extraction
+    print("Extracting logger data for " + siteLine + "...")
+    siteCode, siteName = siteCodeName(siteLine)
+    dfSite = extractSite(siteCode, vargs.parameter, vargs.parquetDir, vargs.columns)
 
+    ## save data
+    outFileName = os.path.join(vargs.outDir, siteName) + ".csv"
+    dfSite.to_csv(outFileName, index=False)
+    print("%i records of extracted logger data saved in %s" % (len(dfSite), outFileName))
@@ -1,90 +1,333 @@
 ## Extract a variable from hourly LTSP
 ## return a rectangular masked array with nominal depth as rows and time as columns
-import sys
 from datetime import datetime
 import xarray as xr
 import numpy as np
-from numpy import ma
 
-def getVariable(fileName, varname, equalDepths=False):
+from fileCache import openDataset
+
+## default chunk of the lazy grid: NOMINAL_DEPTH rows, TIME hours
+CHUNKS = (50, 24*30)
+
+
+def readHourly(fileName, varname):
+    '''
+    Read the variable and the coordinates of the observations from hourly LTSP
+    :param fileName: name of the LTSP hourly file
+    :param varname: name of the variable, like TEMP
+    :return: dict with param, depth, time, nominalDepth, instrumentID arrays and the attributes.
+             None if the file is not an hourly LTSP
+    '''
+    with openDataset(fileName) as nc:
+        if 'HOURLY' not in nc.abstract.upper():
+            print("ERROR: the file is not an hourly LTSP")
+            return
+
+        ## get variables
+        obs = {'param': nc[varname].values,
+               'depth': nc.DEPTH.values,
+               'time': nc.TIME.values.astype('datetime64[h]'),
+               'nominalDepth': nc.NOMINAL_DEPTH.values,
+               'instrumentID': nc.instrument_index.values,
+               'param_attrs': nc[varname].attrs,
+               'depth_attrs': nc['DEPTH'].attrs,
+               'nominalDepth_attrs': nc['NOMINAL_DEPTH'].attrs}
+
+        ## update global attrs
+        todayDate = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+        global_attrs = nc.attrs
+        global_attrs['author_email'] = 'e.klein@aims.gov.au'
+        global_attrs['date_created'] = todayDate
+        global_attrs['keywords'] = 'DEPTH, ' + varname + ', HOURLY, AGGREGATED'
+        global_attrs['history'] = global_attrs['history'] + ' ' + todayDate + \
+                                  ': Transformed into rectangular array using https://github.com/diodon/QIMOS/blob/main/Code/Python/extractVariable.py'
+        obs['global_attrs'] = global_attrs
+
+    ## keep the instrument order, so later instruments overwrite earlier ones at the same depth and time
+    if np.any(np.diff(obs['instrumentID']) < 0):
+        order = np.argsort(obs['instrumentID'], kind='stable')
+        for item in ['param', 'depth', 'time', 'instrumentID']:
+            obs[item] = obs[item][order]
+
+    return obs
+
+
+def gridIndex(obs, equalDepths=False):
+    '''
+    Make the NOMINAL_DEPTH and TIME axes of the rectangular grid and the
+    row/column of every observation
+    :param obs: observations as returned by readHourly
+    :param equalDepths: True for 0.1m NOMINAL_DEPTH spacing
+    :return: ndSeq, timeSeq, rowIdx, colIdx
+    '''
+    time = obs['time']
+    nominalDepth = obs['nominalDepth']
+
+    ## full depth/time range
+    dateStart = time.min()
+    dateEnd = time.max() + np.timedelta64(1, "h")
+    timeSeq = np.arange(dateStart, dateEnd, dtype='datetime64[h]')
+
+    if equalDepths:
+        ndInc = 0.1
+        ndStart = nominalDepth.min()
+        ndEnd = nominalDepth.max() + ndInc
+        ndSeq = np.arange(ndStart, ndEnd, ndInc)
+    else:
+        ndSeq = np.unique(nominalDepth)
+
+    colIdx = np.searchsorted(timeSeq, time)
+    if equalDepths:
+        ## nearest row: np.arange accumulates rounding error, so searchsorted can land one row too deep
+        rowIdx = np.rint((nominalDepth - ndStart) / ndInc).astype(int)[obs['instrumentID']]
+    else:
+        rowIdx = np.searchsorted(ndSeq, nominalDepth)[obs['instrumentID']]
+    return ndSeq, timeSeq, rowIdx, colIdx
+
+
+def makeDataset(obs, varname, ndSeq, timeSeq, param_data, depth_data):
+    '''
+    Build the rectangular dataset with the attributes of the original file
+    '''
+    param_DA = xr.DataArray(param_data, coords=[ndSeq, timeSeq],
+                            dims=['NOMINAL_DEPTH', "TIME"],
+                            attrs=obs['param_attrs'])
+    depth_DA = xr.DataArray(depth_data, coords=[ndSeq, timeSeq],
+                            dims=['NOMINAL_DEPTH', "TIME"],
+                            attrs=obs['nominalDepth_attrs'])
+    return xr.Dataset({varname: param_DA, 'DEPTH': depth_DA},
+                      attrs=obs['global_attrs'])
+
+
+def getVariable(fileName, varname, equalDepths=False, dtype='float64'):
     '''
     Extract a single variable from hourly LTSP
     E Klein 20210823
     :param fileName: name of the LTSP hourly file
     :param varname: nae of the variable, like TEMP
+    :param equalDepths: True for 0.1m NOMINAL_DEPTH spacing
+    :param dtype: float64 or float32 for the output matrices
     :return: netCDF dataset
     '''
+    obs = readHourly(fileName, varname)
+    if obs is None:
+        return
+
+    ## create empty matrix full depth/time range
+    ndSeq, timeSeq, rowIdx, colIdx = gridIndex(obs, equalDepths)
+    param_fullMat = np.full([len(ndSeq), len(timeSeq)], np.nan, dtype=dtype)
+    depth_fullMat = np.full([len(ndSeq), len(timeSeq)], np.nan, dtype=dtype)
+
+    ## scatter all the observations at once
+    param_fullMat[rowIdx, colIdx] = obs['param']
+    depth_fullMat[rowIdx, colIdx] = obs['depth']
+
+    return makeDataset(obs, varname, ndSeq, timeSeq, param_fullMat, depth_fullMat)
+
+
+class SparseVariable(object):
+    '''
+    Rectangular NOMINAL_DEPTH x TIME variable stored as two CSR sparse matrices (variable and DEPTH)
+    with one row per NOMINAL_DEPTH. Only the observed cells are stored, so the memory scales with
+    the number of observations and not with the depth x time extent of the grid.
+    Where two instruments share a depth and time the last instrument is kept, as in getVariable
+    :param obs: observations as returned by readHourly
+    :param varname: name of the variable
+    :param ndSeq: NOMINAL_DEPTH axis
+    :param timeSeq: TIME axis
+    :param rowIdx: row of every observation
+    :param colIdx: column of every observation
+    :param dtype: float64 or float32
+    '''
 
-#    try:
-        with xr.open_dataset(fileName) as nc:
-            if 'HOURLY' not in nc.abstract.upper():
-                print("ERROR: the file is not an hourly LTSP")
-                return
+    def __init__(self, obs, varname, ndSeq, timeSeq, rowIdx, colIdx, dtype='float64'):
+        from scipy import sparse
 
-            ## get variables
-            param = nc[varname].values
-            depth = nc.DEPTH.values
-            time = nc.TIME.values.astype('datetime64[h]')
-            nominalDepth = nc.NOMINAL_DEPTH.values
-            instrumentID = nc.instrument_index.values
-            instrumentUnique = np.unique(instrumentID)
+        self.varname = varname
+        self.NOMINAL_DEPTH = ndSeq
+        self.TIME = timeSeq
+        self.attrs = {item: obs[item] for item in ['param_attrs', 'nominalDepth_attrs', 'global_attrs']}
+        shape = (len(ndSeq), len(timeSeq))
 
-            param_attrs = nc[varname].attrs
-            depth_attrs = nc['DEPTH'].attrs
-            nominalDepth_attrs = nc['NOMINAL_DEPTH'].attrs
+        ## one value per cell, the last observation wins. np.unique leaves the cells in row major order
+        cell = rowIdx.astype(np.int64) * shape[1] + colIdx
+        _, lastIdx = np.unique(cell[::-1], return_index=True)
+        keep = len(cell) - 1 - lastIdx
+        rows = rowIdx[keep]
+        indices = colIdx[keep]
+        indptr = np.searchsorted(rows, np.arange(shape[0] + 1))
 
-            ## update global attrs
-            todayDate = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
-            global_attrs = nc.attrs
-            global_attrs['author_email'] = 'e.klein@aims.gov.au'
-            global_attrs['date_created'] = todayDate
-            global_attrs['keywords'] = 'DEPTH, ' + varname + ', HOURLY, AGGREGATED'
-            global_attrs['history'] = global_attrs['history'] + ' ' + todayDate + \
-                                      ': Transformed into rectangular array using https://github.com/diodon/QIMOS/blob/main/Code/Python/extractVariable.py'
+        self.param = sparse.csr_matrix((obs['param'][keep].astype(dtype), indices, indptr), shape=shape)
+        self.depth = sparse.csr_matrix((obs['depth'][keep].astype(dtype), indices, indptr), shape=shape)
 
+    @property
+    def shape(self):
+        return self.param.shape
 
+    @property
+    def nnz(self):
+        return self.param.nnz
 
-        ## create empty matrix full depth/time range
-        dateStart = min(time)
-        dateEnd = max(time) + np.timedelta64(1, "h")
-        timeSeq = np.arange(dateStart, dateEnd, dtype='datetime64[h]')
+    def _subset(self, rows, cols):
+        sub = object.__new__(SparseVariable)
+        sub.varname = self.varname
+        sub.attrs = self.attrs
+        sub.NOMINAL_DEPTH = self.NOMINAL_DEPTH[rows]
+        sub.TIME = self.TIME[cols]
+        sub.param = self.param[rows][:, cols]
+        sub.depth = self.depth[rows][:, cols]
+        return sub
 
-        if equalDepths:
-            ndInc = 0.1
-            ndStart = min(nominalDepth)
-            ndEnd = max(nominalDepth) + ndInc
-            ndSeq = np.arange(ndStart, ndEnd, 0.1)
-        else:
-            ndSeq = np.unique(nominalDepth)
+    def rowIndex(self, nominalDepth):
+        '''
+        Rows of the nearest NOMINAL_DEPTH
+        :param nominalDepth: depth or list of depths
+        :return: array of row numbers
+        '''
+        nominalDepth = np.atleast_1d(nominalDepth)
+        return np.abs(self.NOMINAL_DEPTH[:, None] - nominalDepth[None, :]).argmin(axis=0)
 
-        param_fullMat = np.full([len(ndSeq), len(timeSeq)], np.nan)
-        depth_fullMat = np.full([len(ndSeq), len(timeSeq)], np.nan)
+    def sel(self, nominalDepth=None, timeStart=None, timeEnd=None):
+        '''
+        Subset of rows (nearest NOMINAL_DEPTH) and/or a TIME window, still sparse
+        :param nominalDepth: depth or list of depths. None for all
+        :param timeStart: first time, like 2015-12-01. None for the start of the record
+        :param timeEnd: last time, like 2018-06-30. None for the end of the record
+        :return: SparseVariable
+        '''
+        rows = slice(None) if nominalDepth is None else self.rowIndex(nominalDepth)
+        first = 0 if timeStart is None else np.searchsorted(self.TIME, np.datetime64(timeStart, 'h'), side='left')
+        last = len(self.TIME) if timeEnd is None else np.searchsorted(self.TIME, np.datetime64(timeEnd, 'h'), side='right')
+        return self._subset(rows, slice(first, last))
 
-        for i, instrument in enumerate(instrumentUnique):
-            mask = ma.make_mask(instrumentID==instrument)
-            timeMasked = time[mask]
-            paramMasked = param[mask]
-            depthMasked = depth[mask]
+    def getRow(self, nominalDepth):
+        '''
+        Observations of the row of the nearest NOMINAL_DEPTH
+        :param nominalDepth: depth
+        :return: pandas dataframe with TIME, variable and DEPTH
+        '''
+        import pandas as pd
 
-            timeIdx = (np.searchsorted(timeSeq, timeMasked))
-            nominaldepthIdx = (np.searchsorted(ndSeq, nominalDepth[i]))
-            param_fullMat[nominaldepthIdx, timeIdx] = paramMasked
-            depth_fullMat[nominaldepthIdx, timeIdx] = depthMasked
+        row = self.rowIndex(nominalDepth)[0]
+        start, end = self.param.indptr[row], self.param.indptr[row + 1]
+        return pd.DataFrame({'TIME': self.TIME[self.param.indices[start:end]],
+                             self.varname: self.param.data[start:end],
+                             'DEPTH': self.depth.data[start:end]})
 
-        param_DA = xr.DataArray(param_fullMat, coords=[ndSeq, timeSeq],
-                                dims=['NOMINAL_DEPTH', "TIME"],
-                                attrs=param_attrs)
-        depth_DA = xr.DataArray(depth_fullMat, coords=[ndSeq, timeSeq],
-                                dims=['NOMINAL_DEPTH', "TIME"],
-                                attrs=nominalDepth_attrs)
-        param_DS = xr.Dataset({varname: param_DA, 'DEPTH': depth_DA},
-                              attrs=global_attrs)
+    @staticmethod
+    def _toDense(matrix):
+        dense = np.full(matrix.shape, np.nan, dtype=matrix.dtype)
+        coo = matrix.tocoo()
+        dense[coo.row, coo.col] = coo.data
+        return dense
 
-        return param_DS
-    # except:
-    #     print("ERROR: bad file name, or bad variable name?")
-    #     return
+    def toDataset(self):
+        '''
+        Convert to the dense NaN filled dataset, as returned by getVariable
+        :return: xarray dataset
+        '''
+        return makeDataset(self.attrs, self.varname, self.NOMINAL_DEPTH, self.TIME,
+                           self._toDense(self.param), self._toDense(self.depth))
 
 
+def getVariableSparse(fileName, varname, equalDepths=False, dtype='float64'):
+    '''
+    Extract a single variable from hourly LTSP as sparse (CSR) NOMINAL_DEPTH x TIME matrices
+    :param fileName: name of the LTSP hourly file
+    :param varname: name of the variable, like TEMP
+    :param equalDepths: True for 0.1m NOMINAL_DEPTH spacing
+    :param dtype: float64 or float32 for the output matrices
+    :return: SparseVariable
+    '''
+    obs = readHourly(fileName, varname)
+    if obs is None:
+        return
+
+    ndSeq, timeSeq, rowIdx, colIdx = gridIndex(obs, equalDepths)
+    return SparseVariable(obs, varname, ndSeq, timeSeq, rowIdx, colIdx, dtype)
+
 
+def _fillBlock(values, rowIdx, colIdx, shape, dtype):
+    block = np.full(shape, np.nan, dtype=dtype)
+    block[rowIdx, colIdx] = values
+    return block
+
+
+def getVariableLazy(fileName, varname, equalDepths=False, dtype='float32', chunks=CHUNKS):
+    '''
+    Extract a single variable from hourly LTSP as a lazy (dask) rectangular array.
+    Only the observations are kept in memory; each chunk of the grid is built when
+    it is computed, and chunks without observations are just filled with NaN
+    :param fileName: name of the LTSP hourly file
+    :param varname: name of the variable, like TEMP
+    :param equalDepths: True for 0.1m NOMINAL_DEPTH spacing
+    :param dtype: float32 or float64 for the output matrices
+    :param chunks: (NOMINAL_DEPTH, TIME) chunk size
+    :return: xarray dataset backed by dask arrays
+    '''
+    import dask.array as da
+    from dask.base import tokenize
+
+    obs = readHourly(fileName, varname)
+    if obs is None:
+        return
+
+    ndSeq, timeSeq, rowIdx, colIdx = gridIndex(obs, equalDepths)
+    rowChunk, colChunk = chunks
+    nRowBlocks = -(-len(ndSeq) // rowChunk)
+    nColBlocks = -(-len(timeSeq) // colChunk)
+    blockChunks = (tuple(min(rowChunk, len(ndSeq) - i * rowChunk) for i in range(nRowBlocks)),
+                   tuple(min(colChunk, len(timeSeq) - j * colChunk) for j in range(nColBlocks)))
+
+    ## group the observations by block, keeping their order inside each block
+    blockKey = (rowIdx // rowChunk) * nColBlocks + colIdx // colChunk
+    order = np.argsort(blockKey, kind='stable')
+    blockKey = blockKey[order]
+    blockRow = rowIdx[order] % rowChunk
+    blockCol = colIdx[order] % colChunk
+    keys, blockStart, nObs = np.unique(blockKey, return_index=True, return_counts=True)
+    blocks = {key: (start, start + n) for key, start, n in zip(keys, blockStart, nObs)}
+
+    data = {}
+    for item in ['param', 'depth']:
+        values = obs[item][order]
+        name = 'extractVariable-' + item + '-' + tokenize(fileName, varname, equalDepths, dtype, chunks)
+        dsk = {}
+        for i in range(nRowBlocks):
+            for j in range(nColBlocks):
+                shape = (blockChunks[0][i], blockChunks[1][j])
+                if i * nColBlocks + j in blocks:
+                    start, end = blocks[i * nColBlocks + j]
+                    dsk[(name, i, j)] = (_fillBlock, values[start:end], blockRow[start:end], blockCol[start:end], shape, dtype)
+                else:
+                    dsk[(name, i, j)] = (np.full, shape, np.nan, dtype)
+        data[item] = da.Array(dsk, name, chunks=blockChunks, dtype=dtype)
+
+    return makeDataset(obs, varname, ndSeq, timeSeq, data['param'], data['depth'])
+
+
+def writeVariable(fileName, varname, outFileName, equalDepths=False, dtype='float32', chunks=CHUNKS):
+    '''
+    Extract a single variable from hourly LTSP into a chunked netCDF4 or Zarr (.zarr) file,
+    one chunk at a time, so the full grid is never in memory.
+    In Zarr the chunks without data are not written
+    :param fileName: name of the LTSP hourly file
+    :param varname: name of the variable, like TEMP
+    :param outFileName: output file name. Zarr store if it ends with .zarr, netCDF4 otherwise
+    :param equalDepths: True for 0.1m NOMINAL_DEPTH spacing
+    :param dtype: float32 or float64 for the output matrices
+    :param chunks: (NOMINAL_DEPTH, TIME) chunk size
+    :return: output file name
+    '''
+    ds = getVariableLazy(fileName, varname, equalDepths, dtype, chunks)
+    if ds is None:
+        return
 
+    if outFileName.endswith('.zarr'):
+        encoding = {item: {'write_empty_chunks': False, '_FillValue': np.nan} for item in [varname, 'DEPTH']}
+        ds.to_zarr(outFileName, mode='w', encoding=encoding)
+    else:
+        chunksizes = (min(chunks[0], ds.sizes['NOMINAL_DEPTH']), min(chunks[1], ds.sizes['TIME']))
+        encoding = {item: {'zlib': True, 'chunksizes': chunksizes, '_FillValue': np.nan} for item in [varname, 'DEPTH']}
+        ds.to_netcdf(outFileName, encoding=encoding)
+    return outFileName
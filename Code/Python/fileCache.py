@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+fileCache.py
+Local read-through cache of the AODN netCDF files (LTSP products and others).
+The THREDDS OPeNDAP (dodsC), THREDDS fileServer and S3 urls of a file all map to
+the same entry, keyed by the path of the file (IMOS/ANMN/...). The file is
+downloaded once (OPeNDAP urls from the THREDDS fileServer) into a content
+addressed store (objects/<sha256>.nc) and opened locally afterwards.
+Every open checks the size of the local copy, a full sha256 check can be asked for.
+After the TTL the server is asked (HEAD) if the file has changed. If the server
+can't be reached the local copy is used. When the cache grows over its max size
+the least recently used files are removed.
+
+By default a file already in the cache is always used, but files are only
+downloaded if QIMOS_FILE_CACHE=1 (or cache=True in openDataset), so the tools
+that only read a few values of a file don't download the whole file.
+QIMOS_FILE_CACHE_SIZE sets the max size in GB (default 20) and QIMOS_FILE_SERVER
+the root of the server to download from (e.g. a local mirror)
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import tempfile
+import argparse
+import threading
+import urllib.request
+import urllib.error
+
+import xarray as xr
+
+from catalogCache import getCacheDir, CACHE_TTL
+
+FILE_SERVER = 'http://thredds.aodn.org.au/thredds/fileServer/'
+CACHE_SIZE_GB = 20
+BLOCK_SIZE = 1024 * 1024
+## objects not in the index younger than that may be downloads of another process not indexed yet
+ORPHAN_AGE = 3600
+
+## the thread pools of the tools update the index at the same time
+_indexLock = threading.RLock()
+
+## roots of the THREDDS OPeNDAP, THREDDS fileServer and S3 urls
+_URL_ROOT = re.compile(r'^https?://[^/]+/(thredds/dodsC|thredds/fileServer|imos-data)/')
+
+
+def args():
+    parser = argparse.ArgumentParser(description="Manage the local cache of AODN netCDF files")
+    parser.add_argument('-get', dest='urls', help='urls of the files to download into the cache', type=str, nargs='+', default=None, required=False)
+    parser.add_argument('-list', dest='list', help='list the cached files', default=False, action="store_true", required=False)
+    parser.add_argument('-verify', dest='verify', help='check the sha256 of all the cached files and remove the corrupted ones', default=False, action="store_true", required=False)
+    parser.add_argument('-clear', dest='clear', help='remove all the cached files', default=False, action="store_true", required=False)
+    vargs = parser.parse_args()
+    return(vargs)
+
+
+def getFileCacheDir():
+    """
+    get the directory of the file cache, inside the QIMOS cache directory
+    :return: path
+    """
+    cacheDir = os.path.join(getCacheDir(), 'files')
+    os.makedirs(os.path.join(cacheDir, 'objects'), exist_ok=True)
+    return cacheDir
+
+
+def isCacheEnabled():
+    """
+    :return: True if the files have to be downloaded into the cache (QIMOS_FILE_CACHE=1)
+    """
+    return os.environ.get('QIMOS_FILE_CACHE', '0').lower() in ['1', 'true', 'yes']
+
+
+def getMaxSize():
+    """
+    :return: max size of the cache in bytes, from QIMOS_FILE_CACHE_SIZE in GB
+    """
+    return int(float(os.environ.get('QIMOS_FILE_CACHE_SIZE', CACHE_SIZE_GB)) * 1024 ** 3)
+
+
+def getFileKey(url):
+    """
+    cache key of a url: the path of the file after the THREDDS or S3 root
+    :param url: OPeNDAP, fileServer or S3 url
+    :return: key, or None if the url is not an AODN THREDDS or S3 url
+    """
+    match = _URL_ROOT.match(url)
+    return url[match.end():] if match else None
+
+
+def getDownloadURL(url):
+    """
+    url to download the whole file. OPeNDAP urls are changed to the THREDDS fileServer
+    :param url: OPeNDAP, fileServer or S3 url
+    :return: url
+    """
+    if '/thredds/dodsC/' in url:
+        return os.environ.get('QIMOS_FILE_SERVER', FILE_SERVER) + getFileKey(url)
+    return url
+
+
+def _objectFile(sha256):
+    return os.path.join(getFileCacheDir(), 'objects', sha256 + '.nc')
+
+
+def _readIndex():
+    try:
+        with open(os.path.join(getFileCacheDir(), 'index.json')) as ff:
+            return json.load(ff)
+    except (OSError, ValueError):
+        return {}
+
+
+def _updateIndex(update=None, remove=None):
+    ## re-read the index just before writing, so other processes' entries are kept
+    indexFile = os.path.join(getFileCacheDir(), 'index.json')
+    with _indexLock:
+        index = _readIndex()
+        index.update(update or {})
+        for key in remove or []:
+            index.pop(key, None)
+        ff, tmpFile = tempfile.mkstemp(dir=getFileCacheDir(), prefix='index.', suffix='.tmp')
+        try:
+            with os.fdopen(ff, 'w') as ff:
+                json.dump(index, ff, indent=1)
+            os.replace(tmpFile, indexFile)
+        finally:
+            if os.path.exists(tmpFile):
+                os.remove(tmpFile)
+    return index
+
+
+def _removeObject(sha256):
+    ## remove an object no index entry refers to any more
+    with _indexLock:
+        if not any(entry['sha256'] == sha256 for entry in _readIndex().values()) and os.path.exists(_objectFile(sha256)):
+            os.remove(_objectFile(sha256))
+
+
+def fileHash(fileName):
+    """
+    sha256 of a file
+    :param fileName: file name
+    :return: hex digest
+    """
+    sha = hashlib.sha256()
+    with open(fileName, 'rb') as ff:
+        for block in iter(lambda: ff.read(BLOCK_SIZE), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _isValid(entry, verify=False):
+    objectFile = _objectFile(entry['sha256'])
+    if not os.path.exists(objectFile) or os.path.getsize(objectFile) != entry['size']:
+        return False
+    return not verify or fileHash(objectFile) == entry['sha256']
+
+
+def _isModified(url, entry, timeout=60):
+    request = urllib.request.Request(url, method='HEAD')
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        etag = response.headers.get('ETag')
+        lastModified = response.headers.get('Last-Modified')
+        size = response.headers.get('Content-Length')
+    if etag and entry.get('etag'):
+        return etag != entry['etag']
+    if lastModified and entry.get('last_modified'):
+        return lastModified != entry['last_modified']
+    return size is not None and int(size) != entry['size']
+
+
+def _download(url, timeout=60):
+    """
+    download a file into the store, computing its sha256 on the way
+    :param url: download url
+    :return: cache entry
+    """
+    ## unique temporary file: several threads and processes can download at the same time
+    ff, tmpFile = tempfile.mkstemp(dir=os.path.join(getFileCacheDir(), 'objects'), prefix='download.', suffix='.tmp')
+    os.close(ff)
+    sha = hashlib.sha256()
+    size = 0
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response, open(tmpFile, 'wb') as ff:
+            expected = response.headers.get('Content-Length')
+            etag = response.headers.get('ETag')
+            lastModified = response.headers.get('Last-Modified')
+            for block in iter(lambda: response.read(BLOCK_SIZE), b''):
+                sha.update(block)
+                ff.write(block)
+                size += len(block)
+        if expected is not None and int(expected) != size:
+            raise IOError('ERROR: incomplete download of %s: %i of %s bytes' % (url, size, expected))
+        os.replace(tmpFile, _objectFile(sha.hexdigest()))
+    finally:
+        if os.path.exists(tmpFile):
+            os.remove(tmpFile)
+    now = time.time()
+    return {'url': url, 'sha256': sha.hexdigest(), 'size': size, 'etag': etag, 'last_modified': lastModified,
+            'fetched': now, 'accessed': now}
+
+
+def evict(maxSize=None, keep=None):
+    """
+    remove the least recently used files until the cache is under its max size
+    :param maxSize: max size in bytes. Default QIMOS_FILE_CACHE_SIZE
+    :param keep: key not to remove (the file just downloaded)
+    :return: list of removed keys
+    """
+    maxSize = getMaxSize() if maxSize is None else maxSize
+    ## in the lock: an entry added while the cache is evicted is not removed with its object
+    with _indexLock:
+        index = _readIndex()
+        ## the same content can be in several entries: one object per sha256, last access of any of them
+        objects = {}
+        for key, entry in index.items():
+            sizeAccess = objects.get(entry['sha256'], (entry['size'], 0, []))
+            objects[entry['sha256']] = (entry['size'], max(sizeAccess[1], entry['accessed']), sizeAccess[2] + [key])
+        totalSize = sum(size for size, _, _ in objects.values())
+
+        ## objects left behind by an interrupted refresh, not in the index
+        objectDir = os.path.join(getFileCacheDir(), 'objects')
+        for ff in os.listdir(objectDir):
+            objectFile = os.path.join(objectDir, ff)
+            if (ff.endswith('.nc') and ff[:-len('.nc')] not in objects and
+                    time.time() - os.path.getmtime(objectFile) > ORPHAN_AGE):
+                os.remove(objectFile)
+
+        removed = []
+        for sha256, (size, _, keys) in sorted(objects.items(), key=lambda item: item[1][1]):
+            if totalSize <= maxSize:
+                break
+            if keep in keys:
+                continue
+            if os.path.exists(_objectFile(sha256)):
+                os.remove(_objectFile(sha256))
+            totalSize -= size
+            removed += keys
+        if removed:
+            _updateIndex(remove=removed)
+    return removed
+
+
+def getLocalFile(url, download=None, ttl=CACHE_TTL, refresh=False, verify=False):
+    """
+    get the local copy of a file, downloading it if needed
+    :param url: OPeNDAP, fileServer or S3 url
+    :param download: True to download the file if it is not in the cache or has changed.
+                     Default QIMOS_FILE_CACHE
+    :param ttl: seconds before asking the server if the file has changed
+    :param refresh: True to ask the server if the file has changed, even within the ttl
+    :param verify: True to check the sha256 of the local copy
+    :return: local file name, or None if the file is not (and is not to be) in the cache
+    """
+    key = getFileKey(url)
+    if key is None:
+        return None
+    download = isCacheEnabled() if download is None else download
+    downloadURL = getDownloadURL(url)
+    entry = _readIndex().get(key)
+    oldSha256 = None
+
+    if entry is not None and not _isValid(entry, verify):
+        print('WARNING: local copy of %s is corrupted, removed' % key)
+        if os.path.exists(_objectFile(entry['sha256'])):
+            os.remove(_objectFile(entry['sha256']))
+        _updateIndex(remove=[key])
+        entry = None
+
+    if entry is not None:
+        if refresh or time.time() - entry['fetched'] >= ttl:
+            try:
+                modified = _isModified(downloadURL, entry)
+            except (urllib.error.URLError, OSError) as err:
+                print('WARNING: file server not available ({err}), using the local copy of {key}'.format(err=err, key=key))
+                modified = False
+            if not modified:
+                entry['fetched'] = time.time()
+            elif not download:
+                return None
+            else:
+                oldSha256 = entry['sha256']
+                entry = None
+        if entry is not None:
+            entry['accessed'] = time.time()
+            _updateIndex({key: entry})
+            return _objectFile(entry['sha256'])
+
+    if not download:
+        return None
+    entry = _download(downloadURL)
+    _updateIndex({key: entry})
+    ## the changed file replaces the old copy, unless another entry has the same content
+    if oldSha256 is not None and oldSha256 != entry['sha256']:
+        _removeObject(oldSha256)
+    evict(keep=key)
+    return _objectFile(entry['sha256'])
+
+
+def openDataset(url, cache=None, session=None, **kwargs):
+    """
+    xr.open_dataset through the file cache: the local copy is opened if there is one
+    (or if cache downloads are enabled), otherwise the url. S3 and THREDDS fileServer
+    urls are opened remotely with HTTP Range requests (see rangeReader.py)
+    :param url: file name or url
+    :param cache: True to download the file into the cache if needed. Default QIMOS_FILE_CACHE
+    :param session: requests.Session shared by the Range requests of the files opened remotely
+    :param kwargs: passed to xr.open_dataset
+    :return: xarray dataset
+    """
+    localFile = None
+    try:
+        localFile = getLocalFile(url, download=cache)
+    except (urllib.error.URLError, OSError) as err:
+        print('WARNING: could not cache {url} ({err}), opening it remotely'.format(url=url, err=err))
+    if localFile is None and re.match(r'^https?://', url) and '/thredds/dodsC/' not in url:
+        from rangeReader import openRangeDataset
+        return openRangeDataset(url, session=session, **kwargs)
+    return xr.open_dataset(localFile or url, **kwargs)
+
+
+def clearFileCache():
+    """
+    remove all the cached files
+    :return: nothing
+    """
+    cacheDir = getFileCacheDir()
+    for ff in os.listdir(os.path.join(cacheDir, 'objects')):
+        os.remove(os.path.join(cacheDir, 'objects', ff))
+    if os.path.exists(os.path.join(cacheDir, 'index.json')):
+        os.remove(os.path.join(cacheDir, 'index.json'))
+    return
+
+
+if __name__ == "__main__":
+    vargs = args()
+    if vargs.clear:
+        clearFileCache()
+        print('File cache cleared')
+    for url in vargs.urls or []:
+        print('{url} -> {local}'.format(url=url, local=getLocalFile(url, download=True)))
+    if vargs.verify:
+        for key, entry in _readIndex().items():
+            if not _isValid(entry, verify=True):
+                print('corrupted, removed: ' + key)
+                if os.path.exists(_objectFile(entry['sha256'])):
+                    os.remove(_objectFile(entry['sha256']))
+                _updateIndex(remove=[key])
+    if vargs.list:
+        index = _readIndex()
+        for key, entry in sorted(index.items(), key=lambda item: item[1]['accessed'], reverse=True):
+            print('{size:10.1f} MB  {accessed}  {key}'.format(size=entry['size'] / 1024 ** 2, key=key,
+                  accessed=time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(entry['accessed']))))
+        print('{n} files, {size:.1f} of {maxSize:.1f} GB'.format(n=len(index), size=sum(entry['size'] for entry in index.values()) / 1024 ** 3,
+              maxSize=getMaxSize() / 1024 ** 3))
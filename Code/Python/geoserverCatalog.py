@@ -10,12 +10,16 @@ Last version 2020-03-11
 
 from __future__ import print_function
 
+import re
 import sys
 import argparse
 from datetime import datetime
 
+import numpy as np
 import pandas as pd
 
+from catalogCache import getCatalogue
+
 
 def args():
     parser = argparse.ArgumentParser(description="Get a list of urls from the AODN geoserver")
@@ -35,6 +39,151 @@ def args():
     return(vargs)
 
 
+class MooringsCatalogue(object):
+    """
+    In-memory moorings catalogue with precomputed indexes, so a query is an
+    intersection of boolean row bitmaps instead of regex scans over the whole table.
+    Rows are kept sorted by time_coverage_start
+    :param df: moorings_all_map dataframe as returned by catalogCache.getCatalogue
+    """
+
+    FEATURE_TYPES = ["timeseries", "profile", "timeseriesprofile"]
+    FILE_VERSIONS = [0, 1, 2]
+
+    def __init__(self, df):
+        self.source = df
+        df = df.sort_values(by='time_coverage_start', kind='stable').reset_index(drop=True)
+        self.df = df
+        self.nRows = len(df)
+        self.urls = df.url.to_numpy(dtype=object)
+
+        ## site_code -> rows
+        self.siteIndex = {site: self._bitmap(rows) for site, rows in df.groupby('site_code').indices.items()}
+
+        ## variable -> rows
+        varRows = {}
+        for i, variables in enumerate(df.variables.fillna('')):
+            for varname in variables.split(', '):
+                varRows.setdefault(varname, []).append(i)
+        self.variableIndex = {varname: self._bitmap(rows) for varname, rows in varRows.items() if varname}
+
+        ## categoricals
+        self.featureTypeIndex = self._categoryIndex(df.feature_type.str.lower())
+        self.dataCategoryIndex = self._categoryIndex(df.data_category.str.lower())
+        self.fileVersionIndex = self._categoryIndex(df.file_version)
+
+        ## time coverage interval index: valid rows sorted by start and by end
+        self.timeStart, self.startOrder = self._sortedTimes(df.time_coverage_start)
+        self.timeEnd, self.endOrder = self._sortedTimes(df.time_coverage_end)
+
+    def _bitmap(self, rows):
+        mask = np.zeros(self.nRows, dtype=bool)
+        mask[rows] = True
+        return mask
+
+    def _categoryIndex(self, values):
+        codes, categories = pd.factorize(values)
+        return {category: codes == i for i, category in enumerate(categories)}
+
+    @staticmethod
+    def _sortedTimes(values):
+        times = pd.to_datetime(values, utc=True, errors='coerce').dt.tz_localize(None).to_numpy()
+        valid = np.flatnonzero(~np.isnat(times))
+        order = valid[np.argsort(times[valid], kind='stable')]
+        return times[order], order
+
+    @staticmethod
+    def _parseDate(date, label):
+        try:
+            return np.datetime64(datetime.strptime(date, '%Y-%m-%d'))
+        except ValueError:
+            raise ValueError('ERROR: invalid %s date.' % label)
+
+    def query(self, varname=None, site=None, featuretype=None, fileversion=None, datacategory=None,
+              timestart=None, timeend=None, filterout=None, filterin=None):
+        """
+        select the catalogue rows matching all the criteria. Same arguments as get_moorings_urls
+        :return: numpy array of row numbers, sorted by time_coverage_start
+        """
+        mask = np.ones(self.nRows, dtype=bool)
+
+        if varname:
+            if varname not in self.variableIndex:
+                raise ValueError('ERROR: %s not a valid variable name' % varname)
+            mask &= self.variableIndex[varname]
+
+        if site:
+            if site not in self.siteIndex:
+                raise ValueError('ERROR: %s is not a valid site code' % site)
+            mask &= self.siteIndex[site]
+
+        if featuretype:
+            if featuretype not in self.FEATURE_TYPES:
+                raise ValueError('ERROR: %s is not a valid feature type' % featuretype)
+            mask &= self.featureTypeIndex.get(featuretype.lower(), False)
+
+        if datacategory:
+            if datacategory.lower() not in self.dataCategoryIndex:
+                raise ValueError('ERROR: %s is not a valid data category' % datacategory)
+            mask &= self.dataCategoryIndex[datacategory.lower()]
+
+        if fileversion is not None:
+            if fileversion not in self.FILE_VERSIONS:
+                raise ValueError('ERROR: %s is not a valid file version' % fileversion)
+            mask &= self.fileVersionIndex.get(fileversion, False)
+
+        if timestart:
+            ## files ending on or after timestart
+            first = np.searchsorted(self.timeEnd, self._parseDate(timestart, 'start'), side='left')
+            mask &= self._bitmap(self.endOrder[first:])
+
+        if timeend:
+            ## files starting on or before timeend
+            last = np.searchsorted(self.timeStart, self._parseDate(timeend, 'end'), side='right')
+            mask &= self._bitmap(self.startOrder[:last])
+
+        rows = np.flatnonzero(mask)
+
+        ## the url filters are free regex, only applied to the rows left
+        if filterout is not None:
+            for keyword in filterout:
+                pattern = re.compile(keyword)
+                rows = np.array([i for i in rows if not pattern.search(self.urls[i])], dtype=int)
+
+        if filterin is not None:
+            for keyword in filterin:
+                rows = np.array([i for i in rows if keyword in self.urls[i]], dtype=int)
+
+        return rows
+
+    def getURLs(self, webroot='', **criteria):
+        """
+        get the urls of the files matching the criteria
+        :param webroot: url root to prepend to the file path
+        :param criteria: selection arguments, see query
+        :return: list of URLs
+        """
+        return [webroot + url for url in self.urls[self.query(**criteria)]]
+
+
+## one indexed catalogue per realtime mode, rebuilt only when the cached catalogue is reloaded
+_catalogues = {}
+
+
+def getMooringsCatalogue(realtime=False):
+    """
+    get the indexed moorings catalogue, built once per catalogue download
+    :param realtime: True for the realtime files catalogue
+    :return: MooringsCatalogue
+    """
+    df = getCatalogue(realtime=realtime, copy=False)
+    catalogue = _catalogues.get(realtime)
+    if catalogue is None or catalogue.source is not df:
+        catalogue = MooringsCatalogue(df)
+        _catalogues[realtime] = catalogue
+    return catalogue
+
+
 def get_moorings_urls(varname=None, site=None, featuretype=None, fileversion=None, datacategory=None, realtime=False, timestart=None, timeend=None, filterout=None, filterin=None, webURL='S3'):
     """
     get moorings file URLS from AODN geoserver
@@ -57,73 +206,13 @@ def get_moorings_urls(varname=None, site=None, featuretype=None, fileversion=Non
     elif webURL == "wget":
         WEBROOT = 'http://thredds.aodn.org.au/thredds/fileServer/'
     else:
-        WEBROOT = 'https://s3-ap-southeast-2.amazon.com/imos-data/'
+        WEBROOT = 'https://s3-ap-southeast-2.amazonaws.com/imos-data/'
     
         
-    if realtime:
-        url = "http://geoserver-123.aodn.org.au/geoserver/ows?typeName=moorings_all_map&SERVICE=WFS&REQUEST=GetFeature&VERSION=1.0.0&outputFormat=csv&CQL_FILTER=(realtime=TRUE)"
-    else:
-        url = "http://geoserver-123.aodn.org.au/geoserver/ows?typeName=moorings_all_map&SERVICE=WFS&REQUEST=GetFeature&VERSION=1.0.0&outputFormat=csv&CQL_FILTER=(realtime=FALSE)"
-
-    df = pd.read_csv(url)
-    df = df.sort_values(by='time_coverage_start')
-    criteria_all = df.url != None
-
-    if varname:
-        separator = ', '
-        varnames_all = set(separator.join(list(df.variables)).split(', '))
-        if varname in varnames_all:
-            criteria_all = criteria_all & df.variables.str.contains('.*\\b'+varname+'\\b.*', regex=True)
-        else:
-            raise ValueError('ERROR: %s not a valid variable name' % varname)
-
-    if site:
-        site_all = list(df.site_code.unique())
-        if site in site_all:
-            criteria_all = criteria_all & df.site_code.str.contains(site, regex=False)
-        else:
-            raise ValueError('ERROR: %s is not a valid site code' % site)
-
-    if featuretype:
-        if featuretype in ["timeseries", "profile", "timeseriesprofile"]:
-            criteria_all = criteria_all & (df.feature_type.str.lower() == featuretype.lower())
-        else:
-            raise ValueError('ERROR: %s is not a valid feature type' % featuretype)
-
-    if datacategory:
-        datacategory_all = list(df.data_category.str.lower().unique())
-        if datacategory.lower() in datacategory_all:
-            criteria_all = criteria_all & (df.data_category.str.lower() == datacategory.lower())
-        else:
-            raise ValueError('ERROR: %s is not a valid data category' % datacategory)
-
-    if fileversion is not None:
-        if fileversion in [0, 1, 2]:
-            criteria_all = criteria_all & (df.file_version == fileversion)
-        else:
-            raise ValueError('ERROR: %s is not a valid file version' % fileversion)
-
-    if timestart:
-        try:
-            criteria_all = criteria_all & (pd.to_datetime(df.time_coverage_end) >= datetime.strptime(timestart, '%Y-%m-%d'))
-        except ValueError:
-            raise ValueError('ERROR: invalid start date.')
-
-    if timeend:
-        try:
-            criteria_all = criteria_all & (pd.to_datetime(df.time_coverage_start) <=  datetime.strptime(timeend, '%Y-%m-%d'))
-        except ValueError:
-            raise ValueError('ERROR: invalid end date.')
-
-    if filterout is not None:
-        for keyword in filterout:
-            criteria_all = criteria_all & (~df.url.str.contains(keyword, regex=True))
-
-    if filterin is not None:
-        for keyword in filterin:
-            criteria_all = criteria_all & (df.url.str.contains(keyword, regex=False))
-
-    return list(WEBROOT + df.url[criteria_all])
+    catalogue = getMooringsCatalogue(realtime=realtime)
+    return catalogue.getURLs(webroot=WEBROOT, varname=varname, site=site, featuretype=featuretype,
+                             fileversion=fileversion, datacategory=datacategory, timestart=timestart,
+                             timeend=timeend, filterout=filterout, filterin=filterin)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+getHW8clouds.py
+Get the VISST Himawari-8 cloud product from satcorps, clip cloud_percentage of the total
+cloud (cld_type 0) to the GBR box and append it day by day to a time chunked Zarr store
+(or write one netCDF file per day, like Code/Bash/getHW8clouds.sh did).
+The granules of a day are listed from the server directory index and downloaded by a
+pool of workers while the previous day is being appended. Every granule is clipped as
+soon as it is downloaded and the full granule is deleted: only the clipped day is kept
+in memory. The ingested days are recorded in a state file next to the store, so an
+interrupted run starts again where it stopped. The store is append only: days older
+than the last ingested day are skipped.
+QIMOS_VISST_SERVER changes the server root (e.g. a local mirror)
+"""
+
+import os
+import re
+import json
+import time
+import tempfile
+import threading
+import argparse
+import urllib.request
+import urllib.error
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+VISST_SERVER = 'https://satcorps.larc.nasa.gov/prod/HIMWARI-FD/visst-grid-netcdf/'
+## lat min, lat max, lon min, lon max
+GBR_BOX = (-30.0, -7.45, 141.0, 160.0)
+VARIABLES = ['cloud_percentage']
+INCLUDE = 'SH'
+WORKERS = 8
+PREFETCH_DAYS = 2
+TIME_CHUNK = 24 * 7
+## granule times of any day can be appended
+TIME_ENCODING = {'units': 'seconds since 1970-01-01 00:00:00', 'dtype': 'float64'}
+
+## netCDF-C is not thread safe: the granules are downloaded in parallel but opened one at a time
+_netcdfLock = threading.Lock()
+
+
+def args():
+    parser = argparse.ArgumentParser(description="Get the VISST HW8 cloud product clipped to the GBR")
+    parser.add_argument('-start', dest='dateStart', help='first day, YYYY-MM-DD', type=str, default=None, required=True)
+    parser.add_argument('-end', dest='dateEnd', help='last day, YYYY-MM-DD. Default the first day', type=str, default=None, required=False)
+    parser.add_argument('-store', dest='store', help='output: Zarr store (.zarr) or directory of daily netCDF files', type=str, default=None, required=True)
+    parser.add_argument('-box', dest='box', help='lat min, lat max, lon min, lon max. Default %s' % ' '.join(str(xx) for xx in GBR_BOX), type=float, nargs=4, default=GBR_BOX, required=False)
+    parser.add_argument('-var', dest='variables', help='variables to keep. Default %s' % ' '.join(VARIABLES), type=str, nargs='+', default=VARIABLES, required=False)
+    parser.add_argument('-include', dest='include', help='regular expression of the granule file names to get. Default %s' % INCLUDE, type=str, default=INCLUDE, required=False)
+    parser.add_argument('-workers', dest='workers', help='number of granules downloaded at the same time. Default %i' % WORKERS, type=int, default=WORKERS, required=False)
+    vargs = parser.parse_args()
+    return(vargs)
+
+
+def getServer():
+    """
+    :return: root url of the VISST grids, QIMOS_VISST_SERVER or the satcorps server
+    """
+    server = os.environ.get('QIMOS_VISST_SERVER', VISST_SERVER)
+    return server if server.endswith('/') else server + '/'
+
+
+def listGranules(day, server=None, include=INCLUDE, timeout=60):
+    """
+    list the granules of a day from the server directory index
+    :param day: date
+    :param server: root url. Default getServer()
+    :param include: regular expression of the file names to get
+    :return: sorted list of urls. Empty if there is no directory for that day
+    """
+    dayURL = (server or getServer()) + pd.Timestamp(day).strftime('%Y/%m/%d/')
+    try:
+        with urllib.request.urlopen(dayURL, timeout=timeout) as response:
+            content = response.read().decode('utf-8', errors='replace')
+    except urllib.error.HTTPError as err:
+        if err.code == 404:
+            return []
+        raise
+    fileNames = set(os.path.basename(ff) for ff in re.findall(r'href="([^"?#]+\.NC)"', content, re.IGNORECASE))
+    return [dayURL + ff for ff in sorted(fileNames) if re.search(include, ff)]
+
+
+def boxIndex(lat, lon, box=GBR_BOX):
+    """
+    hyperslab of a lat/lon box
+    :param lat: latitude axis, ascending or descending
+    :param lon: longitude axis
+    :param box: lat min, lat max, lon min, lon max
+    :return: lat and lon slices
+    """
+    latIdx = np.flatnonzero((lat >= box[0]) & (lat <= box[1]))
+    lonIdx = np.flatnonzero((lon >= box[2]) & (lon <= box[3]))
+    if len(latIdx) == 0 or len(lonIdx) == 0:
+        raise ValueError('ERROR: the box %s is out of the grid' % (box,))
+    return slice(latIdx.min(), latIdx.max() + 1), slice(lonIdx.min(), lonIdx.max() + 1)
+
+
+def _download(url, fileName, timeout=120, retries=3):
+    for attempt in range(retries):
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as response, open(fileName, 'wb') as ff:
+                expected = response.headers.get('Content-Length')
+                for block in iter(lambda: response.read(1024 * 1024), b''):
+                    ff.write(block)
+            if expected is not None and int(expected) != os.path.getsize(fileName):
+                raise IOError('ERROR: incomplete download of %s' % url)
+            return
+        except (urllib.error.URLError, OSError):
+            if attempt == retries - 1:
+                raise
+            time.sleep(2 ** attempt)
+
+
+def clipGranule(url, box=GBR_BOX, variables=VARIABLES):
+    """
+    download a granule and clip it to the box, total cloud only. The granule is deleted after the clip
+    :param url: url of the granule
+    :param box: lat min, lat max, lon min, lon max
+    :param variables: variables to keep
+    :return: clipped dataset, in memory, with a time dimension
+    """
+    ff, fileName = tempfile.mkstemp(suffix='.nc', prefix='visst_')
+    os.close(ff)
+    try:
+        _download(url, fileName)
+        with _netcdfLock, xr.open_dataset(fileName) as nc:
+            latSlice, lonSlice = boxIndex(nc.latitude.values, nc.longitude.values, box)
+            ## latitude and longitude are data variables of the granules: keep them as coordinates
+            nc = nc.set_coords([vv for vv in ['latitude', 'longitude'] if vv in nc.data_vars])
+            ds = nc[variables].isel(lat=latSlice, lon=lonSlice)
+            if 'time' not in ds.coords and 'time' in nc.variables:
+                ds = ds.assign_coords(time=nc['time'])
+            if 'cld_type' in ds.dims:
+                ds = ds.isel(cld_type=slice(0, 1))
+            ds = ds.drop_vars(['cld_type'], errors='ignore').load()
+    finally:
+        os.remove(fileName)
+    if 'time' not in ds.dims:
+        ds = ds.expand_dims('time')
+    return ds
+
+
+def stateFileName(store):
+    return store.rstrip('/') + '.state.json'
+
+
+def readState(store, default=None):
+    """
+    read the state of a store
+    :param store: Zarr store or directory of daily files
+    :param default: state of a new store. Default no ingested day, no time step
+    :return: state dict: ingested days, number of time steps
+    """
+    try:
+        with open(stateFileName(store)) as ff:
+            return json.load(ff)
+    except (OSError, ValueError):
+        return default if default is not None else {'days': {}, 'nTime': 0}
+
+
+def writeState(store, state):
+    ## atomic: the state is the last thing written, so it never counts an interrupted append
+    tmpFile = stateFileName(store) + '.%i.tmp' % os.getpid()
+    with open(tmpFile, 'w') as ff:
+        json.dump(state, ff, indent=1)
+    os.replace(tmpFile, stateFileName(store))
+
+
+def truncateZarr(store, sizes):
+    """
+    cut the arrays of a Zarr store back to the sizes of the state after an interrupted append
+    :param store: Zarr store
+    :param sizes: dict, dimension name: size
+    """
+    import zarr
+
+    group = zarr.open_group(store, mode='r+')
+    for _, array in group.arrays():
+        dims = array.attrs.get('_ARRAY_DIMENSIONS') or getattr(array.metadata, 'dimension_names', None) or []
+        shape = tuple(sizes.get(dim, size) for dim, size in zip(dims, array.shape))
+        if dims and shape != array.shape:
+            array.resize(shape)
+    zarr.consolidate_metadata(store)
+
+
+def appendDay(ds, store, day, state):
+    """
+    append the clipped granules of a day to the store and record it in the state
+    :param ds: dataset of the day
+    :param store: Zarr store (.zarr) or directory of daily netCDF files
+    :param day: date
+    :param state: state dict
+    :return: state
+    """
+    dayKey = pd.Timestamp(day).strftime('%Y%m%d')
+    if store.endswith('.zarr'):
+        if state['nTime'] == 0:
+            encoding = {vv: {'chunks': (TIME_CHUNK,) + ds[vv].shape[1:]} for vv in ds.data_vars}
+            encoding['time'] = TIME_ENCODING
+            ds.to_zarr(store, mode='w', encoding=encoding, zarr_format=2)
+        else:
+            ds.to_zarr(store, append_dim='time')
+    else:
+        os.makedirs(store, exist_ok=True)
+        fileName = os.path.join(store, 'GBR_cloud-percentage_%s.nc' % dayKey)
+        encoding = {vv: {'zlib': True} for vv in ds.data_vars}
+        encoding['time'] = TIME_ENCODING
+        ds.to_netcdf(fileName + '.tmp', unlimited_dims=['time'], encoding=encoding)
+        os.replace(fileName + '.tmp', fileName)
+    state['days'][dayKey] = len(ds.time)
+    state['nTime'] += len(ds.time)
+    writeState(store, state)
+    return state
+
+
+def ingest(dateStart, dateEnd=None, store='GBR_cloud-percentage.zarr', box=GBR_BOX, variables=VARIABLES,
+           include=INCLUDE, workers=WORKERS, server=None):
+    """
+    get, clip and append the granules of a range of days. The days already ingested are skipped
+    :param dateStart: first day
+    :param dateEnd: last day. Default the first day
+    :param store: Zarr store (.zarr) or directory of daily netCDF files
+    :param box: lat min, lat max, lon min, lon max
+    :param variables: variables to keep
+    :param include: regular expression of the granule file names to get
+    :param workers: number of granules downloaded at the same time
+    :param server: root url. Default getServer()
+    :return: state dict
+    """
+    server = server or getServer()
+    state = readState(store)
+    if store.endswith('.zarr') and state['nTime'] and os.path.exists(store):
+        truncateZarr(store, {'time': state['nTime']})
+    lastDay = max(state['days']) if state['days'] else None
+    days = []
+    for day in pd.date_range(dateStart, dateEnd or dateStart, freq='D'):
+        dayKey = day.strftime('%Y%m%d')
+        if dayKey in state['days']:
+            continue
+        if store.endswith('.zarr') and lastDay is not None and dayKey < lastDay:
+            print('WARNING: %s is older than the last day in the store (%s), skipped' % (dayKey, lastDay))
+            continue
+        days.append(day)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+
+        def submitDay(day):
+            urls = listGranules(day, server, include)
+            return day, [pool.submit(clipGranule, url, box, variables) for url in urls]
+
+        def finishDay(day, futures):
+            if not futures:
+                print('%s: no granules' % day.strftime('%Y-%m-%d'))
+                return
+            granules = [future.result() for future in futures]
+            ds = xr.concat(granules, dim='time', combine_attrs='drop_conflicts').sortby('time')
+            appendDay(ds, store, day, state)
+            print('%s: %i granules' % (day.strftime('%Y-%m-%d'), len(granules)))
+
+        ## the granules of the next days are downloaded while a day is appended
+        pending = deque()
+        try:
+            for day in days:
+                pending.append(submitDay(day))
+                if len(pending) > PREFETCH_DAYS:
+                    finishDay(*pending.popleft())
+            while pending:
+                finishDay(*pending.popleft())
+        except Exception:
+            for _, futures in pending:
+                for future in futures:
+                    future.cancel()
+            raise
+    return state
+
+
+if __name__ == "__main__":
+    vargs = args()
+    timeStart = time.time()
+    state = ingest(vargs.dateStart, vargs.dateEnd, vargs.store, tuple(vargs.box), vargs.variables, vargs.include, vargs.workers)
+    print('%i days, %i time steps in %s (%.1f seconds)' % (len(state['days']), state['nTime'], vargs.store, time.time() - timeStart))
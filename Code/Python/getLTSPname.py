@@ -1,15 +1,22 @@
 import argparse
 import pandas as pd
 
+from catalogCache import getCatalogue, getSiteCatalogue
+
 pd.set_option('display.max_colwidth', None)
 
+WEBROOTS = {'opendap': 'http://thredds.aodn.org.au/thredds/dodsC/',
+            'wget': 'http://thredds.aodn.org.au/thredds/fileServer/',
+            'S3': 'https://s3-ap-southeast-2.amazonaws.com/imos-data/'}
+PRODUCTS = ['aggregated', 'hourly', 'velocity-hourly', 'gridded']
+
 def args():
     parser = argparse.ArgumentParser(description="Get LTSP file name")
     parser.add_argument('-site', dest='site', help='site code, like NRMMAI',  type=str, default=None, required=True)
     parser.add_argument('-product',dest='product', help='product type: aggregated, hourly, velocity-hourly or gridded', type=str, default='hourly', required=True)
     parser.add_argument('-QC',dest='QC', help='for the hourly, QCed data only. Default True', type=bool, default=True, required=False)
     parser.add_argument('-param',dest='param', help='for the aggregated, parameter, like TEMP, or "velocity"', type=str, default='TEMP', required=False)
-    parser.add_argument('-weburl',dest='webURL', help='url root for the file: S3: Amazon AWS (for download, fastest), wget (AODN THREDDS, for download), opendap (AODN THREDDS to open remotely). Default opendap', type=str, default='opendap', required=False)
+    parser.add_argument('-weburl',dest='webURL', help='url root for the file: S3: Amazon AWS (for download, fastest, or to open remotely with rangeReader), wget (AODN THREDDS, for download), opendap (AODN THREDDS to open remotely). Default opendap', type=str, default='opendap', required=False)
 
     vargs = parser.parse_args()
     return(vargs)
@@ -29,40 +36,102 @@ def getLTSPfileName(site, product="gridded", QC=True, param="TEMP", webURL="open
     E. Klein. eklein at ocean-analytics dot com dot au
     '''
     
-    if webURL == "opendap": 
-        WEBROOT = 'http://thredds.aodn.org.au/thredds/dodsC/'
-    elif webURL == "wget":
-        WEBROOT = 'http://thredds.aodn.org.au/thredds/fileServer/'
-    elif webURL == "S3":
-        WEBROOT = 'https://s3-ap-southeast-2.amazon.com/imos-data/'
+    if webURL in WEBROOTS:
+        WEBROOT = WEBROOTS[webURL]
     else:
         print("ERROR: wrong webURL: it must be one of S3, opendap or wget")
 
   
-    urlGeoServer = "http://geoserver-123.aodn.org.au/geoserver/ows?typeName=moorings_all_map&SERVICE=WFS&REQUEST=GetFeature&VERSION=1.0.0&outputFormat=csv&CQL_FILTER=(realtime='FALSE')and(site_code='" + site + "')"
-    df = pd.read_csv(urlGeoServer)
+    df = getSiteCatalogue(site)
     url = df['url']
     
     #fileName = df$url[grepl(paste0(product,"-timeseries"), df$url)]
     fileName = "TEST"
     
     
-    if product == "gridded": 
-        fileName = url[url.str.contains("gridded")]
+    mask = productMask(url, product, QC, param)
+    if mask is not None:
+        fileName = url[mask]
+    else:
+        print("ERROR: invalid combination of arguments or wrong names")
+
+    
+    return WEBROOT + fileName.to_string(index=False, header=False).strip()
+
+
+def productMask(url, product, QC=True, param="TEMP"):
+    '''
+    select the urls of one type of LTSP product
+    url: pandas series of file urls
+    product: product type (aggregated, hourly, velocity-hourly or gridded)
+    QC: for the hourly, include only good data
+    param: for aggregated product, parameter code as IMOS standard (e.g. TEMP)
+    return: boolean series, None if the product is not valid
+    '''
+    if product == "gridded":
+        return url.str.contains("gridded")
     elif product=="velocity-hourly":
-        fileName = url[url.str.contains("velocity-hourly")]
+        return url.str.contains("velocity-hourly")
     elif product=="hourly":
         if QC:
-            fileName = url[url.str.contains("(?<!velocity-)hourly-timeseries(?!-including)", regex=True)]
+            return url.str.contains("(?<!velocity-)hourly-timeseries(?!-including)", regex=True)
         else:
-            fileName = url[url.str.contains("including-non")]
+            return url.str.contains("including-non")
     elif product=="aggregated":
-        fileName = url[url.str.contains(param) & url.str.contains("aggregated")]
+        return url.str.contains(param) & url.str.contains("aggregated")
     else:
-        print("ERROR: invalid combination of arguments or wrong names")
+        return None
 
-    
-    return WEBROOT + fileName.to_string(index=False, header=False).strip()
+
+def getLTSPfileNames(sites=None, products=None, params=None, QC=True, webURL="opendap"):
+    '''
+    get the urls of the LTSP files for many sites in one go.
+    The catalogue is read once and every product is matched once for all the sites
+
+    require: pandas
+    sites: list of site_code. None for all the sites with LTSP products
+    products: list of product types (aggregated, hourly, velocity-hourly or gridded). None for all of them
+    params: for aggregated product, list of parameter codes as IMOS standard (e.g. TEMP). None for TEMP
+    QC: for the hourly, include only good data (default True)
+    webURL: web source of the file (S3, wget or opendap)
+    return: dataframe with one row per site/product/param: site, product, param, url, status, nMatches, candidates
+            status is OK (one file), MISSING (no file) or AMBIGUOUS (more than one file, url is empty
+            and all the files are in candidates)
+    '''
+    if webURL not in WEBROOTS:
+        raise ValueError("ERROR: wrong webURL: it must be one of S3, opendap or wget")
+    WEBROOT = WEBROOTS[webURL]
+    if products is None:
+        products = PRODUCTS
+    if params is None:
+        params = ["TEMP"]
+
+    invalid = [product for product in products if product not in PRODUCTS]
+    if invalid:
+        raise ValueError("ERROR: invalid product type: %s" % ", ".join(invalid))
+
+    df = getCatalogue(copy=False)
+    if sites is None:
+        sites = sorted(df.site_code[df.url.str.contains("_timeseries/")].unique())
+    df = df[df.site_code.isin(sites)]
+    url = df['url']
+
+    table = []
+    for product in products:
+        for param in (params if product == "aggregated" else [None]):
+            matches = df.loc[productMask(url, product, QC, param)].groupby('site_code')['url'].apply(list)
+            for site in sites:
+                candidates = [WEBROOT + item for item in matches.get(site, [])]
+                if len(candidates) == 1:
+                    status = 'OK'
+                elif len(candidates) == 0:
+                    status = 'MISSING'
+                else:
+                    status = 'AMBIGUOUS'
+                table.append([site, product, param, candidates[0] if status == 'OK' else None,
+                              status, len(candidates), candidates])
+
+    return pd.DataFrame(table, columns=['site', 'product', 'param', 'url', 'status', 'nMatches', 'candidates'])
 
 
 if __name__ == "__main__":
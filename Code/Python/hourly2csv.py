@@ -1,20 +1,27 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
 import argparse
 import numpy as np
 import pandas as pd
-import xarray as xr
+
+from ltspWriter import LTSPWriter
+from fileCache import openDataset
 
 
 def args():
     parser = argparse.ArgumentParser(description="Convert LSTP hourly file to CSV file")
     parser.add_argument('-filename', dest='fileName', help='filename of the hourly product',
                         type=str, default=None, required=True)
+    parser.add_argument('-format', dest='outputFormat', help='output format: csv, parquet or arrow. Default csv',
+                        type=str, default='csv', required=False)
+    parser.add_argument('-path', dest='output_path', help='path where the result files will be written. Default ./',
+                        type=str, default='./', required=False)
     vargs = parser.parse_args()
     return(vargs)
 
-def hourly2csv(fileName):
+def hourly2csv(fileName, outputFormat='csv', output_path='./'):
     """
     Convert an hourly LTSP file into a csv file.
     It will produce the same file name but with a csv extension
@@ -22,51 +29,48 @@ def hourly2csv(fileName):
     :author Eduardo Klein
     :date August 2022
     :param fileName: name of the file to convert
-    :return: nothing
+    :param outputFormat: csv, parquet (partitioned by site and instrument_index) or arrow.
+                         For parquet and arrow, the global attributes and the instrument metadata
+                         go into the file key/value metadata instead of the _MD.csv file
+    :param output_path: path where to write the resulting files
+    :return: [file name, number of data records]
     """
 
-    outFileName = (fileName.split('.nc')[0]).split('/')[-1]
-    with xr.open_dataset(fileName) as nc:
+    outFileName = os.path.join(output_path, (fileName.split('.nc')[0]).split('/')[-1])
+    with openDataset(fileName) as nc:
 
         ## get metadata
-        nObs = []
-        timeStart = []
-        timeEnd = []
         nInstruments =list(nc.INSTRUMENT.values)
-        instrumentsID = list(np.unique(nc.instrument_id))
-        instrumentsID = [i.decode('UTF8') for i in instrumentsID]
+        instrumentsID = [i.decode('UTF8') for i in nc.instrument_id.values]
         latList = list(nc.LATITUDE.values)
         lonList = list(nc.LONGITUDE.values)
         ndepthList = list(nc.NOMINAL_DEPTH.values)
         siteCode = nc.site_code
-
-        nc = nc.drop_vars(['instrument_id', 'source_file'])
-        gg = nc.groupby('instrument_index')
-
-        ## do the first instrument
-        print('Processing site {site} INSTRUMENT 0'.format(site=siteCode), end=' ', flush=True)
-        nc0 = gg[0]
-        ## get metadata
-        nObs.append(len(gg[0].OBSERVATION))
-        timeStart.append(str(gg[0].TIME.min().dt.strftime('%Y-%m-%dT%H:%M:%S').values))
-        timeEnd.append(str(gg[0].TIME.max().dt.strftime('%Y-%m-%dT%H:%M:%S').values))
-        ## get data
-        nc0 = nc0.drop_dims('INSTRUMENT')
-        df = nc0.to_pandas()
-        df.to_csv(outFileName + '.csv', header=True, index=False, mode='w')
-
-        #loop over the rest of the instruments
-        for i in range(1, len(gg)):
-            print(i, end=' ', flush=True)
-            ## get metadata
-            nObs.append(len(gg[i].OBSERVATION))
-            timeStart.append(str(gg[i].TIME.min().dt.strftime('%Y-%m-%dT%H:%M:%S').values))
-            timeEnd.append(str(gg[i].TIME.max().dt.strftime('%Y-%m-%dT%H:%M:%S').values))
-            ## get data
-            nc0 = gg[i]
-            nc0 = nc0.drop_dims('INSTRUMENT')
-            df = nc0.to_pandas()
-            df.to_csv(outFileName + 'csv', header=False, index=False, mode='a')
+        attrs = dict(nc.attrs)
+
+        ## get all the OBSERVATION variables at once
+        print('Processing site {site}: {n} INSTRUMENTS'.format(site=siteCode, n=len(nInstruments)), flush=True)
+        df = nc.drop_vars(['instrument_id', 'source_file']).drop_dims('INSTRUMENT').to_pandas()
+
+    ## sort by instrument, keeping the order inside each instrument
+    instrumentIndex = df['instrument_index'].to_numpy()
+    if np.any(np.diff(instrumentIndex) < 0):
+        order = np.argsort(instrumentIndex, kind='stable')
+        df = df.iloc[order]
+        instrumentIndex = instrumentIndex[order]
+
+    ## number of observations, start and end of each instrument
+    nObs = np.bincount(instrumentIndex, minlength=len(nInstruments))
+    blockEnd = np.cumsum(nObs)
+    blockStart = blockEnd - nObs
+    hasData = nObs > 0
+    time = df['TIME'].to_numpy().astype('datetime64[s]')
+    timeStart = np.full(len(nInstruments), '', dtype=object)
+    timeEnd = np.full(len(nInstruments), '', dtype=object)
+    if hasData.any():
+        timeInt = time.astype('int64')
+        timeStart[hasData] = np.datetime_as_string(np.minimum.reduceat(timeInt, blockStart[hasData]).astype('datetime64[s]'))
+        timeEnd[hasData] = np.datetime_as_string(np.maximum.reduceat(timeInt, blockStart[hasData]).astype('datetime64[s]'))
 
     dfMetadata = pd.DataFrame({'instrumentID': nInstruments,
                                'instrumentName': instrumentsID,
@@ -77,13 +81,22 @@ def hourly2csv(fileName):
                                'endTime': timeEnd,
                                'nObservations': nObs})
 
-    dfMetadata.to_csv(outFileName + '_MD.csv', header=True, index=False, mode='w')
+    ## write the data in one pass. Parquet needs one partition per instrument
+    writer = LTSPWriter(outFileName, outputFormat, siteCode=siteCode, attrs=attrs, instruments=dfMetadata)
+    if outputFormat == 'parquet':
+        for i in np.flatnonzero(hasData):
+            writer.write(df.iloc[blockStart[i]:blockEnd[i]], nInstruments[i])
+    else:
+        writer.write(df)
+    writer.close(list(df.columns))
 
     print(flush=True)
-    print('LTSP hourly product for {site} was written to {fname}'.format(site=siteCode, fname=outFileName + '.csv'))
-    print('LTSP hourly product METADATA for {site} was written to {fname}'.format(site=siteCode, fname=outFileName + '_MD.csv'))
+    print('LTSP hourly product for {site} was written to {fname}'.format(site=siteCode, fname=writer.fileName))
+    if outputFormat == 'csv':
+        dfMetadata.to_csv(outFileName + '_MD.csv', header=True, index=False, mode='w')
+        print('LTSP hourly product METADATA for {site} was written to {fname}'.format(site=siteCode, fname=outFileName + '_MD.csv'))
 
-    return
+    return [writer.fileName, writer.nRecords]
 
 
 if __name__ == "__main__":
@@ -92,6 +105,6 @@ if __name__ == "__main__":
     if "hourly" not in fileName:
         print("not a LTSP hourly file. EXIT")
     else:
-        hourly2csv(fileName)
+        hourly2csv(fileName, vargs.outputFormat, vargs.output_path)
 
 
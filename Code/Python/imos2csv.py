@@ -1,14 +1,18 @@
 ## transform IMOS LTSP netCDF to cvs, with metadata on the top
 import argparse
 import os
-import sys
 
-import xarray as xr
 import pandas as pd
 import numpy as np
 
+from ltspWriter import LTSPWriter
+from fileCache import openDataset
 
-def imos2csv(fileName, param, startDate, endDate, output_path='./'):
+## sampling interval of the OBSERVATION binary search
+STRIDE = 4096
+
+
+def imos2csv(fileName, param, startDate, endDate, output_path='./', chunkSize=None, outputFormat='csv', outName=None):
     '''
     Extract variables from hourly aggregated LTSP between two dates
     and save it in a tsv file with metadata on top
@@ -18,7 +22,14 @@ def imos2csv(fileName, param, startDate, endDate, output_path='./'):
     :param startDate: start date YYYY-MM-DD
     :param endDate: end date YYYY-MM-DD
     :param output_path: path where to write the resulting file
-    :return:
+    :param chunkSize: number of OBSERVATIONs read at a time. If set, the file is streamed in chunks
+                      and the memory used depends on the chunk size, not on the file length.
+                      Only the OBSERVATIONs inside the date range are read
+    :param outputFormat: csv (tab separated, metadata on top), parquet (partitioned by site and
+                         instrument_index) or arrow. For parquet and arrow the metadata goes into
+                         the file key/value metadata
+    :param outName: name of the resulting file, without extension. Default <site_code>_<start>-<end>
+    :return: [file name, number of metadata lines, number of data records]
     '''
 
     ## for file name
@@ -29,10 +40,10 @@ def imos2csv(fileName, param, startDate, endDate, output_path='./'):
     endDate = np.datetime64(endDate)
     print(param)
 
-    with xr.open_dataset(fileName) as nc:
+    with openDataset(fileName) as nc:
         ## file name
         siteCode = nc.site_code
-        fileNameCSV = os.path.join(output_path, "_".join([siteCode, (dateStart+'-'+dateEnd)])+'.csv')
+        outFileName = os.path.join(output_path, outName or "_".join([siteCode, (dateStart+'-'+dateEnd)]))
 
         ## update and save attrs
         nc.attrs['time_coverage_start'] = startDate
@@ -45,21 +56,107 @@ def imos2csv(fileName, param, startDate, endDate, output_path='./'):
         metadata.append('missing_value: -99999')
         metadata = sorted(metadata)
 
-        with open(fileNameCSV, 'w') as ff:
-            for item in metadata:
-                ff.write('%s\n' %item)
+        if outputFormat == 'csv':
+            with open(outFileName + '.csv', 'w') as ff:
+                for item in metadata:
+                    ff.write('%s\n' %item)
+
+        instruments = pd.DataFrame({'instrument_index': nc.INSTRUMENT.values,
+                                    'instrument_id': np.char.decode(nc.instrument_id.values.astype(bytes), 'utf-8'),
+                                    'nominalDepth': nc.NOMINAL_DEPTH.values,
+                                    'latitude': nc.LATITUDE.values,
+                                    'longitude': nc.LONGITUDE.values})
+        writer = LTSPWriter(outFileName, outputFormat, siteCode=siteCode, attrs=nc.attrs, instruments=instruments,
+                            sep='\t', append=True)
+
+        ## OBSERVATION ranges of every instrument inside the date range
+        obsRanges = observationRanges(nc, startDate, endDate)
+        nRecords = writeRanges(nc, param, obsRanges, writer, chunkSize)
 
-        ## select parameter and date range
-        selectedParam = ['instrument_index', 'instrument_id', 'TIME', 'DEPTH']
-        [selectedParam.append(item) for item in param]
-        nc = nc[selectedParam]
-        nc = nc.drop(['LATITUDE', 'LONGITUDE', 'NOMINAL_DEPTH'])
-        nc = nc.where((nc.TIME>=startDate) & (nc.TIME<=endDate), drop=True)
-        df = nc.to_dataframe()
-        df['instrument_id'] = df['instrument_id'].str.decode('utf-8')
-        df.to_csv(fileNameCSV, sep='\t', index=False, mode='a')
+    return [writer.fileName, len(metadata), nRecords]
+
+
+def searchSorted(var, values, lo, hi, side='left', stride=STRIDE):
+    '''
+    Binary search of values in the sorted block var[lo:hi] of a not loaded variable.
+    Only a strided sample of the block and a window of stride elements around each
+    value are read, so the search doesn't transfer the whole variable
+    :param var: sorted 1-D xarray variable (lazy)
+    :param values: list of values to search
+    :param lo: first index of the block
+    :param hi: last index + 1 of the block
+    :param side: left or right, as numpy searchsorted
+    :param stride: sampling interval of the coarse search
+    :return: numpy array of indices in var
+    '''
+    values = np.atleast_1d(values)
+    if hi <= lo:
+        return np.full(len(values), lo)
+    sample = var[lo:hi:stride].values
+    values = values.astype(sample.dtype)
+    kk = np.searchsorted(sample, values, side=side)
+    result = []
+    for value, k in zip(values, kk):
+        if k == 0:
+            result.append(lo)
+            continue
+        ## sample k-1 is before value and sample k (if any) is after
+        windowStart = lo + (k - 1) * stride + 1
+        windowEnd = min(lo + k * stride, hi)
+        window = var[windowStart:windowEnd].values
+        result.append(windowStart + np.searchsorted(window, value, side=side))
+    return np.array(result)
+
+
+def observationRanges(nc, startDate, endDate, stride=STRIDE):
+    '''
+    Get the OBSERVATION index ranges of each instrument between two dates.
+    Observations are stored by instrument and sorted by TIME in each instrument block,
+    so the block limits and the dates are found by binary search
+    :param nc: hourly LTSP xarray dataset, not loaded
+    :param startDate: start date as datetime64
+    :param endDate: end date as datetime64, included
+    :param stride: sampling interval of the coarse search
+    :return: list of (instrument_index, start, stop)
+    '''
+    nObs = nc.sizes['OBSERVATION']
+    nInstruments = nc.sizes['INSTRUMENT']
+    blockLimits = searchSorted(nc.instrument_index, np.arange(nInstruments + 1), 0, nObs, 'left', stride)
+    obsRanges = []
+    for i in range(nInstruments):
+        lo, hi = blockLimits[i], blockLimits[i + 1]
+        first, last = (searchSorted(nc.TIME, [startDate], lo, hi, 'left', stride)[0],
+                       searchSorted(nc.TIME, [endDate], lo, hi, 'right', stride)[0])
+        if first < last:
+            obsRanges.append((i, first, last))
+    return obsRanges
+
+
+def writeRanges(nc, param, obsRanges, writer, chunkSize=None):
+    '''
+    Append the selected variables in the OBSERVATION ranges to the output file.
+    Only those slices are read, in chunks of chunkSize OBSERVATIONs if set,
+    with the instrument_id of the range
+    :param nc: hourly LTSP xarray dataset, not loaded
+    :param param: list of parameter to extract
+    :param obsRanges: list of (instrument_index, start, stop) as from observationRanges
+    :param writer: LTSPWriter of the output file
+    :param chunkSize: number of OBSERVATIONs read at a time. None to read each range at once
+    :return: number of data records written
+    '''
+    instrumentID = np.char.decode(nc.instrument_id.values.astype(bytes), 'utf-8')
+    columns = ['instrument_index', 'instrument_id', 'DEPTH'] + list(param) + ['TIME']
+    for instrument, rangeStart, rangeStop in obsRanges:
+        step = chunkSize or (rangeStop - rangeStart)
+        for start in range(rangeStart, rangeStop, step):
+            chunk = nc[['DEPTH', 'TIME'] + list(param)].isel(OBSERVATION=slice(start, min(start + step, rangeStop)))
+            df = pd.DataFrame({item: chunk[item].values for item in columns[2:]})
+            df.insert(0, 'instrument_index', instrument)
+            df.insert(1, 'instrument_id', instrumentID[instrument])
+            writer.write(df, instrument)
 
-    return [fileNameCSV, len(metadata), len(df)]
+    writer.close(columns)
+    return writer.nRecords
 
 
 if __name__ == "__main__":
@@ -71,12 +168,19 @@ if __name__ == "__main__":
     parser.add_argument('-de', dest='endDate', help="end date in YYYY-MM-DD", required=True)
     parser.add_argument('-path', dest='output_path', help="path where the result file will be written. Default ./",
                         default="./", required=False)
+    parser.add_argument('-chunk', dest='chunkSize', help="number of observations read at a time, for long files. Default all",
+                        type=int, default=None, required=False)
+    parser.add_argument('-format', dest='outputFormat', help="output format: csv, parquet or arrow. Default csv",
+                        default="csv", required=False)
     args = parser.parse_args()
-    result = imos2csv(args.fileName, args.param, args.startDate, args.endDate, args.output_path)
+    result = imos2csv(args.fileName, args.param, args.startDate, args.endDate, args.output_path, args.chunkSize, args.outputFormat)
     print('CONVERSION DONE!')
-    print('TSV file name: ' + result[0])
-    print('metadata from line 1 thru line ' + str(result[1]))
-    print('data start at line ' + str(result[1]+1))
+    if args.outputFormat == 'csv':
+        print('TSV file name: ' + result[0])
+        print('metadata from line 1 thru line ' + str(result[1]))
+        print('data start at line ' + str(result[1]+1))
+    else:
+        print('output file name: ' + result[0])
     print('total number of data records: ' + str(result[2]))
     
 
@@ -2,60 +2,33 @@
 # -*- coding: utf-8 -*-
 
 import os
-from datetime import date, datetime
-from itertools import groupby
 import argparse
 import numpy as np
 import pandas as pd
-import xarray as xr
 from tabulate import tabulate
 
+from catalogCache import getSiteCatalogue
+from availability import blockPlot, runPlot, instrumentCoverage, LEGEND
+from availabilityIndex import getAvailabilityIndex, dayPlot
+from fileCache import openDataset
+
 pd.options.display.max_colwidth = 200
 
+## max number of values read per variable for the availability bars, unless full
+MAX_SAMPLES = 4000
+
 
 def args():
     parser = argparse.ArgumentParser(description="Information about IMOS-LTSP product")
     parser.add_argument('-site', dest='site', help='site code, like NRMMAI',  type=str, default=None, required=True)
     parser.add_argument('-type', dest='fileType', help='file type: H - hourly, G - gridded', type=str, default=None, required=True)
+    parser.add_argument('-full', dest='full', help='read all the values for the availability bars instead of a decimated sample', default=False, action="store_true", required=False)
+    parser.add_argument('-index', dest='index', help='build the availability index of the file if missing or out of date, and use it for the bars', default=False, action="store_true", required=False)
     vargs = parser.parse_args()
     return(vargs)
 
 
 
-def blockPlot(x, lineLength = 80):
-    """
-    Print a line block-plot of data availability of specified length
-    E. Klein. eklein at ocean-analytics dot com dot au. 2020-10-20
-    :param x: numpy array of dim 1
-    :param lineLength: lenght of the line plot
-    :return: string
-    """
-
-    blockSymbols = ['\u2593', '\u2591']
-    ## make boolean vector 1-nodata 0-data
-    if x.dtype == 'float32':
-        x_bool = np.isnan(x.values).astype(int).tolist()
-    else:
-        x_bool = np.isnan(x).astype(int).tolist()
-    ## run-length encoder
-    x_rle = [[key, len(list(group))] for key, group in groupby(x_bool)]
-    ## list of number of symbols
-    x_sum = len(x)
-    x_symbols = list([i, round(lineLength * rle[1] / x_sum)] for i, rle in enumerate(x_rle))
-    nBlocks =sum([item[1] for item in x_symbols])
-    if nBlocks != lineLength:
-        x_symbols = sorted(x_symbols, key=lambda x: x[1], reverse=True)
-        diffSign = np.sign(lineLength - nBlocks)
-        diffBlocks = abs(lineLength - nBlocks)
-        for block in range(diffBlocks):
-            x_symbols[block][1] += diffSign
-        x_symbols = sorted(x_symbols, key=lambda x: x[0], reverse=False)
-    x_symbols = [x_symbols[i][1] for i in range(len(x_symbols))]
-    return ''.join(list(blockSymbols[x_rle[i][0]] * int(x_symbols[i]) for i in range(len(x_rle))))
-
-
-
-
 def getFileName(site, fType, param=None, webroot='opendap'):
     '''
     get the file name of the LTSP files
@@ -76,13 +49,12 @@ def getFileName(site, fType, param=None, webroot='opendap'):
     if webroot=='opendap':
         webRoot = 'http://thredds.aodn.org.au/thredds/dodsC/'
     elif webroot=='wget':
-        webRoot = 'https://s3-ap-southeast-2.amazon.com/imos-data/'
+        webRoot = 'https://s3-ap-southeast-2.amazonaws.com/imos-data/'
     else:
         webRoot = ''
 
     ## get gridded-_timeseries filename
-    url = ("http://geoserver-123.aodn.org.au/geoserver/ows?typeName=moorings_all_map&SERVICE=WFS&REQUEST=GetFeature&VERSION=1.0.0&outputFormat=csv&CQL_FILTER=(realtime='FALSE')and(site_code='%s')" % site)
-    df = pd.read_csv(url)
+    df = getSiteCatalogue(site)
     fileName = df['url'].loc[df['url'].str.contains(fileType[fType])].to_string(index=False).lstrip()
     if fType=='A':
         if not param:
@@ -100,15 +72,39 @@ def getFileName(site, fType, param=None, webroot='opendap'):
 
 
 
-def infoLTSPg(site):
+def sampleStride(n, full=False, maxSamples=MAX_SAMPLES):
+    '''
+    Stride to read at most maxSamples values of an array for the availability bars
+    :param n: length of the array
+    :param full: True to read all the values
+    :param maxSamples: max number of values to read
+    :return: stride
+    '''
+    if full:
+        return 1
+    return max(1, -(-n // maxSamples))
+
+
+def printBarsNote(stride, index):
+    if index is not None:
+        print('Availability by day, from the availability index built on %s' % index['built'])
+    elif stride > 1:
+        print('Availability from 1 of every %i values. Use -full for all the values' % stride)
+
+
+def infoLTSPg(site, full=False, buildIndex=False):
     """
     Produce a summary report for **gridded** LTSP for a site
+    The availability bars come from the availability index of the file if it is up to date.
+    Otherwise only the attributes, the coordinates and a decimated sample of TEMP are read, unless full
     :param site: site name
+    :param full: True to read the whole TEMP array for the availability bars
+    :param buildIndex: True to build the availability index if it is missing or out of date
     :return: tabulated printout
     """
 
     fileName = getFileName(site, "G")
-    nc = xr.open_dataset(fileName)
+    nc = openDataset(fileName)
     depthList = list(nc.DEPTH.values)
 
     table = list()
@@ -123,24 +119,38 @@ def infoLTSPg(site):
     table.append(['Time coverage:', nc.time_coverage_start + ' through ' + nc.time_coverage_end])
     table.append(['Max DEPTH:', str(nc.geospatial_vertical_max)])
     table.append(['Included DEPTHS:',  ", ".join(str(x) for x in depthList)])
-    for dd in depthList:
-        temp = nc.TEMP.sel(DEPTH=float(dd))
-        table.append(['Data Availability at '+ str(dd) + "m:", blockPlot(temp, lineLength=40)])
+    index = getAvailabilityIndex(fileName, nc.attrs.get('date_created'), build=buildIndex)
+    stride = 1
+    if index is not None:
+        for dd, days in zip(index['depths'], index['depthDays']):
+            table.append(['Data Availability at '+ str(dd) + "m:", dayPlot(days, lineLength=40)])
+    else:
+        ## all depths in one read
+        stride = sampleStride(nc.sizes['TIME'], full)
+        tempSample = nc.TEMP.isel(TIME=slice(None, None, stride)).load()
+        for dd in depthList:
+            temp = tempSample.sel(DEPTH=float(dd))
+            table.append(['Data Availability at '+ str(dd) + "m:", blockPlot(temp, lineLength=40)])
 
     print(tabulate(table))
-    print('\u2591 NO DATA, \u2593 DATA')
+    print(LEGEND)
+    printBarsNote(stride, index)
     return
 
 
-def infoLTSPh(site, infoInst=False):
+def infoLTSPh(site, infoInst=False, full=False, buildIndex=False):
     """
     Produce a summary report for **hourly** LTSP for a site
+    The availability bars come from the availability index of the file if it is up to date.
+    Otherwise only the attributes and a decimated sample of every variable are read, unless full
     :param site: site name
     :param infoInst: True for additional information on the instruments
+    :param full: True to read the whole variables for the availability bars
+    :param buildIndex: True to build the availability index if it is missing or out of date
     :return: tabulated printout
     """
     fileName = getFileName(site, 'H')
-    nc = xr.open_dataset(fileName)
+    nc = openDataset(fileName)
     varList = list(nc.data_vars)
     varIdx = [i for i, val in enumerate(["_" in item for item in varList]) if not val]
     varListClean = [varList[i] for i in varIdx]
@@ -159,42 +169,74 @@ def infoLTSPh(site, infoInst=False):
     table.append(['DATA variables:',  ", ".join(str(x) for x in varListClean)])
     table.append(['Number of Instruments', len(nc.INSTRUMENT)])
 
-    for vv in varListClean:
-        table.append([vv, blockPlot(nc[vv])])
+    index = getAvailabilityIndex(fileName, nc.attrs.get('date_created'), build=buildIndex)
+    stride = 1
+    if index is not None:
+        variableDays = dict(zip(index['variables'], index['variableDays']))
+        for vv in varListClean:
+            table.append([vv, dayPlot(variableDays[vv]) if vv in variableDays else ''])
+    else:
+        stride = sampleStride(nc.sizes['OBSERVATION'], full)
+        for vv in varListClean:
+            table.append([vv, blockPlot(nc[vv].isel(OBSERVATION=slice(None, None, stride)))])
 
     print(tabulate(table, tablefmt="plain"))
-    print('\u2591 NO DATA, \u2593 DATA')
+    print(LEGEND)
+    printBarsNote(stride, index)
 
     if infoInst:
-        infoHourlyInstrument(nc)
+        infoHourlyInstrument(nc, index)
 
     return
 
 
-def infoHourlyInstrument(nc):
+def infoHourlyInstrument(nc, index=None):
     '''
     Produce detailed information of every instrument in an **HOURLY** LTSP file
     :param nc: xarray dataset
+    :param index: availability index of the file. If given, the coverage comes from it
+                  and the bars show the days with data of every instrument
     :return: tabulated printout
     '''
     timeFormat='%Y-%m-%d'
-    timeRange0 = pd.date_range(start=np.min(nc.TIME.values), end=np.max(nc.TIME.values), freq='1H').to_numpy()
-    nInstruments = len(nc.INSTRUMENT)
+    if index is not None:
+        timeMin, timeMax = index['instrumentTimeMin'], index['instrumentTimeMax']
+    else:
+        timeMin, timeMax = instrumentCoverage(nc)
+    instrumentID = nc.instrument_id.values.astype(str)
+
+    ## hours of the file record before, during and after the coverage of each instrument
+    hour = np.timedelta64(1, 'h')
+    hasData = ~np.isnat(timeMin)
+    headers = ['Instrument_index', 'Instrument id', 'Coverage FROM', 'Coverage THRU', 'Data Availability']
+    if not hasData.any():
+        ## no observation at all: no coverage to plot
+        print(tabulate([[ii, instrumentID[ii], '', '', ''] for ii in range(len(instrumentID))], tablefmt="plain", headers=headers))
+        print('No instrument with observations')
+        return
+    timeStart = timeMin[hasData].min()
+    nHours = (timeMax[hasData].max() - timeStart) // hour + 1
+    hoursFrom = np.zeros(len(instrumentID), dtype=int)
+    hoursThru = np.zeros(len(instrumentID), dtype=int)
+    hoursFrom[hasData] = -((timeStart - timeMin[hasData]) // hour)
+    hoursThru[hasData] = (timeMax[hasData] - timeStart) // hour + 1
+
     table = list()
-    for ii in range(nInstruments):
-        timeRangeInst = np.copy(timeRange0)
-        ## this is a trick to override the NaT returned by np.min
-        ncTimeInst = nc.TIME[np.where(~np.isnat(nc.TIME.where(nc.instrument_index==ii)))].values
-        timeMin = pd.to_datetime(np.min(ncTimeInst)).to_numpy()
-        timeMax = pd.to_datetime(np.max(ncTimeInst)).to_numpy()
-        timeRangeInst[(timeRangeInst<timeMin) | (timeRangeInst>timeMax)] = np.datetime64('NaT')
+    for ii in range(len(instrumentID)):
+        if index is not None:
+            bar = dayPlot(index['instrumentDays'][ii], lineLength=40)
+        else:
+            bar = runPlot([hoursFrom[ii], hoursThru[ii] - hoursFrom[ii], nHours - hoursThru[ii]],
+                          [False, True, False], lineLength=40)
+        if not hasData[ii]:
+            table.append([ii, instrumentID[ii], '', '', bar])
+            continue
         table.append([ii,
-              nc.instrument_id[ii].values.astype(str),
-              pd.to_datetime(timeMin).strftime(timeFormat),
-              pd.to_datetime(timeMax).strftime(timeFormat),
-              blockPlot(timeRangeInst, lineLength=40)])
-    print(tabulate(table, tablefmt="plain",
-                   headers=['Instrument_index', 'Instrument id', 'Coverage FROM', 'Coverage THRU', 'Data Availability']))
+              instrumentID[ii],
+              pd.to_datetime(timeMin[ii]).strftime(timeFormat),
+              pd.to_datetime(timeMax[ii]).strftime(timeFormat),
+              bar])
+    print(tabulate(table, tablefmt="plain", headers=headers))
     return
 
 
@@ -203,8 +245,8 @@ def infoHourlyInstrument(nc):
 if __name__ == "__main__":
     vargs = args()
     if vargs.fileType == "G":
-        infoLTSPg(vargs.site)
+        infoLTSPg(vargs.site, full=vargs.full, buildIndex=vargs.index)
     elif vargs.fileType == "H":
-        infoLTSPh(vargs.site)
+        infoLTSPh(vargs.site, full=vargs.full, buildIndex=vargs.index)
     else:
         print("File TYPE %s unknown. Must be G or H" % vargs.fileType)
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+infoNetwork.py
+Status of the LTSP products of many sites (or the whole network) in one table or json document.
+The file names of all the sites come from one read of the (cached) catalogue and the files
+are opened concurrently, so the run takes about as long as the slowest file: on S3 with
+HTTP Range requests (rangeReader.py) by a pool of threads sharing one requests.Session,
+so the connections are reused from one file to the next. The files that can't be read
+that way are opened with OPeNDAP by a pool of processes, as netCDF-C is not thread safe.
+The availability comes from the availability index of the file if it is up to date
+(see availabilityIndex.py), otherwise from a decimated sample of TEMP
+"""
+
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy as np
+from tabulate import tabulate
+
+from getLTSPname import getLTSPfileNames
+from catalogCache import getCatalogue
+from availability import availabilitySummary, blockPlot, LEGEND
+from availabilityIndex import getAvailabilityIndex, dayPlot
+from infoLTSP import sampleStride
+from fileCache import openDataset
+from rangeReader import getS3URL
+
+PRODUCTS = ['hourly', 'gridded']
+MAX_WORKERS = 16
+
+
+def args():
+    parser = argparse.ArgumentParser(description="Status of the LTSP products of many sites")
+    parser.add_argument('-sites', dest='sites', help='site codes, like NRSMAI NRSYON, NRS for all the National Reference Stations or ALL. Default NRS', type=str, nargs='+', default=['NRS'], required=False)
+    parser.add_argument('-product', dest='products', help='LTSP products: hourly and/or gridded. Default both', type=str, nargs='+', default=PRODUCTS, required=False)
+    parser.add_argument('-workers', dest='workers', help='max number of files opened at the same time. Default %i' % MAX_WORKERS, type=int, default=MAX_WORKERS, required=False)
+    parser.add_argument('-index', dest='index', help='build the availability index of the files if missing or out of date', default=False, action="store_true", required=False)
+    parser.add_argument('-json', dest='jsonFile', help='write the status as json to this file ("-" for the screen) instead of the table', type=str, default=None, required=False)
+    vargs = parser.parse_args()
+    return(vargs)
+
+
+def getSites(sites):
+    """
+    expand the site selection
+    :param sites: list of site codes, ['NRS'] for the National Reference Stations or ['ALL'] (or None) for all the sites
+    :return: list of site codes. None for all the sites
+    """
+    if not sites or sites == ['ALL']:
+        return None
+    if sites == ['NRS']:
+        df = getCatalogue(copy=False)
+        return sorted(df.site_code[df.site_code.str.startswith('NRS') & df.url.str.contains("_timeseries/")].unique())
+    return sites
+
+
+def fileStatus(site, product, url, buildIndex=False, session=None, opendap=False):
+    """
+    Open one LTSP file and summarise it. Runs in a worker thread (Range requests) or process (OPeNDAP)
+    :param site: site code
+    :param product: hourly or gridded
+    :param url: file url
+    :param buildIndex: True to build the availability index if it is missing or out of date
+    :param session: requests.Session shared by the Range requests of the worker threads
+    :param opendap: True to open the url with OPeNDAP instead of its S3 copy with Range requests
+    :return: dict
+    """
+    entry = {'site': site, 'product': product, 'url': url}
+    timeStart = time.time()
+    try:
+        with openDataset(url if opendap else getS3URL(url), session=session) as nc:
+            entry.update({'time_coverage_start': nc.attrs.get('time_coverage_start'),
+                          'time_coverage_end': nc.attrs.get('time_coverage_end'),
+                          'date_created': nc.attrs.get('date_created')})
+            if product == 'hourly':
+                entry['nInstruments'] = len(nc.INSTRUMENT)
+                entry['variables'] = [vv for vv in nc.data_vars if '_' not in vv]
+            else:
+                entry['depths'] = [float(dd) for dd in nc.DEPTH.values]
+                entry['variables'] = list(nc.data_vars)
+
+            index = getAvailabilityIndex(url, nc.attrs.get('date_created'), build=buildIndex, nc=nc)
+            if index is not None and 'TEMP' in index['variables']:
+                days = index['variableDays'][index['variables'].index('TEMP')]
+                entry.update({'availability': 'index', 'TEMP_coverage': round(100.0 * days.mean(), 1),
+                              'bar': dayPlot(days, lineLength=40)})
+            elif 'TEMP' in nc.data_vars:
+                sampleDim = 'OBSERVATION' if product == 'hourly' else 'TIME'
+                stride = sampleStride(nc.sizes[sampleDim], False)
+                temp = nc.TEMP.isel({sampleDim: slice(None, None, stride)}).transpose(sampleDim, ...).values
+                if temp.ndim > 1:
+                    ## any depth
+                    temp = np.where(np.isnan(temp).all(axis=1), np.nan, 0.0)
+                entry.update({'availability': 'sample 1/%i' % stride,
+                              'TEMP_coverage': round(availabilitySummary(temp)['coverage'], 1),
+                              'bar': blockPlot(temp, lineLength=40)})
+        entry['status'] = 'OK'
+    except Exception as err:
+        entry.update({'status': 'ERROR', 'error': repr(err)})
+    entry['seconds'] = round(time.time() - timeStart, 2)
+    if opendap:
+        entry['access'] = 'opendap'
+    return entry
+
+
+def _getSession(workers):
+    ## one pool of kept-alive connections for all the worker threads. None without requests
+    try:
+        import requests
+    except ImportError:
+        return None
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def networkStatus(sites=['NRS'], products=PRODUCTS, workers=MAX_WORKERS, buildIndex=False):
+    """
+    Status of the LTSP files of many sites, opened concurrently
+    :param sites: list of site codes, ['NRS'] for the National Reference Stations or ['ALL'] for all
+    :param products: hourly and/or gridded
+    :param workers: max number of files opened at the same time
+    :param buildIndex: True to build the availability index of the files if missing or out of date
+    :return: list of dicts, one per site and product, in the order of the sites
+    """
+    invalid = [product for product in products if product not in PRODUCTS]
+    if invalid:
+        raise ValueError("ERROR: invalid product type: %s. Must be hourly or gridded" % ", ".join(invalid))
+
+    dfNames = getLTSPfileNames(sites=getSites(sites), products=products)
+    entries = [None] * len(dfNames)
+    tasks = {}
+    for i, row in enumerate(dfNames.itertuples()):
+        if row.status == 'OK':
+            tasks[i] = (row.site, row.product, row.url)
+        else:
+            entries[i] = {'site': row.site, 'product': row.product, 'url': row.url, 'status': row.status,
+                          'candidates': row.candidates}
+
+    if tasks:
+        session = _getSession(workers)
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(tasks)))) as pool:
+            futures = {i: pool.submit(fileStatus, *task, buildIndex, session) for i, task in tasks.items()}
+            for i, future in futures.items():
+                entries[i] = future.result()
+        if session is not None:
+            session.close()
+
+    ## files not read with Range requests (not on S3, not netCDF4, no h5netcdf): OPeNDAP, one process each
+    retry = {i: task for i, task in tasks.items() if entries[i]['status'] == 'ERROR'}
+    if retry:
+        with ProcessPoolExecutor(max_workers=max(1, min(workers, len(retry)))) as pool:
+            futures = {i: pool.submit(fileStatus, *task, buildIndex, None, True) for i, task in retry.items()}
+            for i, future in futures.items():
+                entries[i] = future.result()
+
+    return sorted(entries, key=lambda entry: (entry['site'], products.index(entry['product'])))
+
+
+def printNetworkStatus(entries):
+    """
+    print the network status table
+    :param entries: list of dicts as returned by networkStatus
+    :return: nothing
+    """
+    table = []
+    for entry in entries:
+        size = ''
+        if 'nInstruments' in entry:
+            size = '%i instruments' % entry['nInstruments']
+        elif 'depths' in entry:
+            size = '%i depths' % len(entry['depths'])
+        table.append([entry['site'], entry['product'], entry['status'],
+                      (entry.get('time_coverage_start') or '')[:10], (entry.get('time_coverage_end') or '')[:10],
+                      size, entry.get('TEMP_coverage', ''), entry.get('bar', ''), entry.get('seconds', '')])
+    print(tabulate(table, tablefmt="plain",
+                   headers=['Site', 'Product', 'Status', 'Coverage FROM', 'Coverage THRU', 'Size', 'TEMP %', 'TEMP Availability', 'Seconds']))
+    print(LEGEND)
+    return
+
+
+if __name__ == "__main__":
+    vargs = args()
+    runStart = time.time()
+    entries = networkStatus(vargs.sites, vargs.products, vargs.workers, vargs.index)
+    if vargs.jsonFile:
+        document = json.dumps({'run_date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                               'run_seconds': round(time.time() - runStart, 2), 'files': entries}, indent=1)
+        if vargs.jsonFile == '-':
+            print(document)
+        else:
+            with open(vargs.jsonFile, 'w') as ff:
+                ff.write(document)
+    else:
+        printNetworkStatus(entries)
+        print('%i files in %.1f seconds' % (len(entries), time.time() - runStart))
@@ -0,0 +1,136 @@
+## Write tables extracted from LTSP files as csv, parquet or arrow
+## the data is written incrementally, one instrument (or chunk) at a time
+## for parquet and arrow, the global attributes and the instrument table go
+## into the file key/value metadata as json
+import os
+import json
+import shutil
+
+import pandas as pd
+
+FORMATS = {'csv': '.csv', 'parquet': '.parquet', 'arrow': '.arrow'}
+## csv format of the times, fixed so that a block with only midnight times is not written as dates
+CSV_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def readMetadata(fileName):
+    '''
+    Read the global attributes and the instrument table from a parquet or arrow output
+    :param fileName: parquet directory or arrow file written by LTSPWriter
+    :return: (dict of global attributes, instruments dataframe)
+    '''
+    import pyarrow.parquet as pq
+    import pyarrow.ipc as ipc
+
+    if os.path.isdir(fileName):
+        schema = pq.read_schema(os.path.join(fileName, '_common_metadata'))
+    else:
+        with ipc.open_file(fileName) as reader:
+            schema = reader.schema
+    metadata = schema.metadata or {}
+    attrs = json.loads(metadata.get(b'global_attributes', b'{}'))
+    instruments = pd.DataFrame(json.loads(metadata.get(b'instruments', b'[]')))
+    return attrs, instruments
+
+
+class LTSPWriter(object):
+    '''
+    Incremental writer of LTSP tables
+    csv: one file, appended
+    parquet: a directory partitioned as site_code=SITE/instrument_index=N/part-0.parquet
+    arrow: one Arrow IPC file, readable with memory map
+    :param outFileName: output file name without extension
+    :param outputFormat: csv, parquet or arrow
+    :param siteCode: site code, for the parquet partitions
+    :param attrs: dict of global attributes
+    :param instruments: dataframe with the per-instrument metadata
+    :param sep: csv separator
+    :param append: for csv, append to an existing file (e.g. with metadata lines on top). Otherwise
+                   any previous output is removed
+    '''
+
+    def __init__(self, outFileName, outputFormat='csv', siteCode=None, attrs=None, instruments=None, sep=',', append=False):
+        if outputFormat not in FORMATS:
+            raise ValueError('ERROR: %s is not a valid output format. Must be one of %s' % (outputFormat, ", ".join(FORMATS)))
+        self.outputFormat = outputFormat
+        self.fileName = outFileName + FORMATS[outputFormat]
+        self.siteCode = siteCode
+        self.sep = sep
+        self.nRecords = 0
+        self.schema = None
+        self._writer = None
+        self._instrument = None
+        self._header = True
+
+        if not (append and outputFormat == 'csv'):
+            if os.path.isdir(self.fileName):
+                shutil.rmtree(self.fileName)
+            elif os.path.exists(self.fileName):
+                os.remove(self.fileName)
+
+        self.metadata = {'global_attributes': json.dumps({key: str(value) for key, value in (attrs or {}).items()})}
+        if instruments is not None:
+            self.metadata['instruments'] = instruments.to_json(orient='records', date_format='iso')
+
+        if outputFormat != 'csv':
+            import pyarrow as pa
+            self._pa = pa
+
+    def write(self, df, instrument=None):
+        '''
+        Write a block of records
+        :param df: dataframe
+        :param instrument: instrument_index of the block, for the parquet partitions
+        :return: nothing
+        '''
+        if self.outputFormat == 'csv':
+            df.to_csv(self.fileName, sep=self.sep, index=False, header=self._header, mode='a', date_format=CSV_DATE_FORMAT)
+            self._header = False
+        else:
+            if self.outputFormat == 'parquet':
+                df = df.drop(columns=['instrument_index', 'site_code'], errors='ignore')
+            if self.schema is None:
+                table = self._pa.Table.from_pandas(df, preserve_index=False)
+                self.schema = table.schema.remove_metadata().with_metadata(self.metadata)
+            table = self._pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+            if self.outputFormat == 'parquet':
+                self._parquetWriter(instrument).write_table(table)
+            else:
+                if self._writer is None:
+                    import pyarrow.ipc as ipc
+                    self._writer = ipc.new_file(self.fileName, self.schema)
+                self._writer.write_table(table)
+        self.nRecords += len(df)
+
+    def _parquetWriter(self, instrument):
+        import pyarrow.parquet as pq
+        if self._writer is None or instrument != self._instrument:
+            if self._writer is not None:
+                self._writer.close()
+            partition = os.path.join(self.fileName, 'site_code=%s' % self.siteCode, 'instrument_index=%s' % instrument)
+            os.makedirs(partition, exist_ok=True)
+            self._writer = pq.ParquetWriter(os.path.join(partition, 'part-0.parquet'), self.schema)
+            self._instrument = instrument
+        return self._writer
+
+    def close(self, columns=None):
+        '''
+        Finish the output. For parquet, write the dataset _common_metadata
+        :param columns: column names, to write the csv header if there was no data
+        :return: output file name
+        '''
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self.outputFormat == 'csv':
+            if self._header and columns is not None:
+                pd.DataFrame(columns=columns).to_csv(self.fileName, sep=self.sep, index=False, mode='a')
+        elif self.outputFormat == 'parquet':
+            import pyarrow.parquet as pq
+            os.makedirs(self.fileName, exist_ok=True)
+            schema = self.schema if self.schema is not None else self._pa.schema([], metadata=self.metadata)
+            pq.write_metadata(schema, os.path.join(self.fileName, '_common_metadata'))
+        elif self.schema is None:
+            import pyarrow.ipc as ipc
+            ipc.new_file(self.fileName, self._pa.schema([], metadata=self.metadata)).close()
+        return self.fileName
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+rangeReader.py
+Lazy byte-level access to the netCDF4/HDF5 files on S3 (or the THREDDS fileServer)
+with HTTP Range requests. The file is seen as a read-only file object, read in fixed
+size blocks that are kept in a LRU block cache, and opened by xarray with the h5netcdf
+engine: only the HDF5 metadata and the chunks behind the selected variables and
+slices are fetched. Consecutive missing blocks are fetched with one request over one
+kept-alive connection.
+Requires h5netcdf (and h5py). Not for the OPeNDAP urls, use them with xarray directly
+"""
+
+import io
+import argparse
+import http.client
+import urllib.parse
+from collections import OrderedDict
+
+import xarray as xr
+
+from getLTSPname import WEBROOTS
+
+BLOCK_SIZE = 256 * 1024
+CACHE_BLOCKS = 512
+
+
+def args():
+    parser = argparse.ArgumentParser(description="Open a netCDF4 file on S3 with HTTP Range requests")
+    parser.add_argument('-url', dest='url', help='S3, THREDDS fileServer or OPeNDAP url of the file', type=str, default=None, required=True)
+    parser.add_argument('-var', dest='varname', help='variable to read', type=str, default=None, required=False)
+    parser.add_argument('-isel', dest='isel', help='index selection of the variable, like DEPTH=3 or TIME=0:1000', type=str, nargs='+', default=[], required=False)
+    parser.add_argument('-block', dest='blockSize', help='block size in KB. Default %i' % (BLOCK_SIZE // 1024), type=int, default=BLOCK_SIZE // 1024, required=False)
+    vargs = parser.parse_args()
+    return(vargs)
+
+
+def getS3URL(url):
+    """
+    S3 url of a file from its OPeNDAP url. Other urls are not changed
+    :param url: url
+    :return: url
+    """
+    if url.startswith(WEBROOTS['opendap']):
+        return WEBROOTS['S3'] + url[len(WEBROOTS['opendap']):]
+    return url
+
+
+class RangeFile(io.RawIOBase):
+    """
+    Read-only, seekable file object over HTTP Range requests, with a LRU block cache
+    """
+
+    def __init__(self, url, blockSize=BLOCK_SIZE, cacheBlocks=CACHE_BLOCKS, timeout=60, session=None):
+        """
+        :param url: http(s) url of the file. The server must accept Range requests
+        :param blockSize: size in bytes of the blocks read and cached
+        :param cacheBlocks: max number of blocks in the cache
+        :param timeout: seconds
+        :param session: requests.Session shared by many files (and threads), so its pool of kept-alive
+                        connections is reused from one file to the next. Default one connection per file
+        """
+        super().__init__()
+        self.url = url
+        self.session = session
+        self.blockSize = blockSize
+        self.cacheBlocks = cacheBlocks
+        self.timeout = timeout
+        self.nRequests = 0
+        self.bytesFetched = 0
+        self._blocks = OrderedDict()
+        self._position = 0
+        self._connection = None
+        self.size = self._getSize()
+
+    def __repr__(self):
+        return '<RangeFile %s: %i bytes, %i requests, %i bytes fetched>' % (self.url, self.size, self.nRequests, self.bytesFetched)
+
+    def _connect(self):
+        parsed = urllib.parse.urlsplit(self.url)
+        connectionClass = http.client.HTTPSConnection if parsed.scheme == 'https' else http.client.HTTPConnection
+        self._connection = connectionClass(parsed.netloc, timeout=self.timeout)
+        self._path = parsed.path + ('?' + parsed.query if parsed.query else '')
+
+    def _request(self, method, headers):
+        ## status, reason, headers and content of the response
+        if self.session is not None:
+            ## identity: the byte ranges are of the file as stored
+            response = self.session.request(method, self.url, headers=dict(headers, **{'Accept-Encoding': 'identity'}), timeout=self.timeout)
+            return response.status_code, response.reason, response.headers, response.content
+        ## one retry with a new connection: the kept-alive connection may have been closed by the server
+        for attempt in range(2):
+            if self._connection is None:
+                self._connect()
+            try:
+                self._connection.request(method, self._path, headers=headers)
+                response = self._connection.getresponse()
+                data = response.read()
+                return response.status, response.reason, response.headers, data
+            except (http.client.HTTPException, OSError):
+                self._connection.close()
+                self._connection = None
+                if attempt:
+                    raise
+
+    def _getSize(self):
+        status, reason, headers, _ = self._request('HEAD', {})
+        if status != 200:
+            raise IOError('ERROR: %s: HTTP %i %s' % (self.url, status, reason))
+        if headers.get('Accept-Ranges', 'bytes') != 'bytes':
+            raise IOError('ERROR: %s: the server does not accept Range requests' % self.url)
+        return int(headers['Content-Length'])
+
+    def _fetch(self, first, last):
+        ## blocks first to last (inclusive) in one request
+        start = first * self.blockSize
+        end = min((last + 1) * self.blockSize, self.size) - 1
+        status, _, _, data = self._request('GET', {'Range': 'bytes=%i-%i' % (start, end)})
+        if status != 206 or len(data) != end - start + 1:
+            raise IOError('ERROR: %s: Range request bytes=%i-%i failed: HTTP %i, %i bytes' % (self.url, start, end, status, len(data)))
+        self.nRequests += 1
+        self.bytesFetched += len(data)
+        return {block: data[(block - first) * self.blockSize:(block - first + 1) * self.blockSize] for block in range(first, last + 1)}
+
+    def _getBlocks(self, first, last):
+        blocks = {}
+        missing = []
+        for block in range(first, last + 1):
+            if block in self._blocks:
+                self._blocks.move_to_end(block)
+                blocks[block] = self._blocks[block]
+            else:
+                missing.append(block)
+        ## runs of consecutive missing blocks
+        runStart = 0
+        for i in range(1, len(missing) + 1):
+            if i == len(missing) or missing[i] != missing[i - 1] + 1:
+                blocks.update(self._fetch(missing[runStart], missing[i - 1]))
+                runStart = i
+        for block in missing:
+            self._blocks[block] = blocks[block]
+        while len(self._blocks) > self.cacheBlocks:
+            self._blocks.popitem(last=False)
+        return blocks
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        elif whence == io.SEEK_END:
+            self._position = self.size + offset
+        else:
+            raise ValueError('ERROR: invalid whence %r' % whence)
+        return self._position
+
+    def readinto(self, buffer):
+        buffer = memoryview(buffer).cast('B')
+        start = self._position
+        end = min(start + len(buffer), self.size)
+        if end <= start:
+            return 0
+        first, last = start // self.blockSize, (end - 1) // self.blockSize
+        blocks = self._getBlocks(first, last)
+        data = b''.join(blocks[block] for block in range(first, last + 1))
+        offset = start - first * self.blockSize
+        buffer[:end - start] = data[offset:offset + end - start]
+        self._position = end
+        return end - start
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+        self._blocks.clear()
+        super().close()
+
+
+def openRangeDataset(url, blockSize=BLOCK_SIZE, cacheBlocks=CACHE_BLOCKS, session=None, **kwargs):
+    """
+    open a netCDF4 file on S3 or the THREDDS fileServer lazily, with HTTP Range requests.
+    OPeNDAP urls are changed to S3
+    :param url: url of the file
+    :param blockSize: size in bytes of the blocks read and cached
+    :param cacheBlocks: max number of blocks in the cache
+    :param session: requests.Session shared by the files opened (see RangeFile)
+    :param kwargs: passed to xr.open_dataset
+    :return: xarray dataset. Its RangeFile (request statistics) is in ds.encoding['rangeFile']
+    """
+    rangeFile = RangeFile(getS3URL(url), blockSize=blockSize, cacheBlocks=cacheBlocks, session=session)
+    ds = xr.open_dataset(rangeFile, engine='h5netcdf', **kwargs)
+    ds.encoding['rangeFile'] = rangeFile
+    return ds
+
+
+if __name__ == "__main__":
+    vargs = args()
+    with openRangeDataset(vargs.url, blockSize=vargs.blockSize * 1024) as nc:
+        rangeFile = nc.encoding['rangeFile']
+        print(nc)
+        print('header: %i requests, %.1f KB' % (rangeFile.nRequests, rangeFile.bytesFetched / 1024))
+        if vargs.varname:
+            selection = {}
+            for item in vargs.isel:
+                dim, index = item.split('=')
+                selection[dim] = slice(*[int(ii) if ii else None for ii in index.split(':')]) if ':' in index else int(index)
+            values = nc[vargs.varname].isel(selection).values
+            print('%s%s: %i values, %i requests, %.1f KB of %.1f KB in total' % (vargs.varname, selection, values.size, rangeFile.nRequests,
+                  rangeFile.bytesFetched / 1024, rangeFile.size / 1024))
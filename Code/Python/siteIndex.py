@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+siteIndex.py
+Spatial index of sites and grids: the nearest site (or grid cell) of many points at once,
+with the distance, so the points too far away are flagged and not silently snapped.
+  SiteIndex: KD-tree (scipy) over scattered sites (AODN moorings, GBR logger reefs).
+             The positions are 3D unit vectors, so the distances are great circle distances
+  GridIndex: regular or sorted lat/lon grid (VISST), binary search on each axis
+Both answer in O(log n) per point
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS = 6371.0
+
+
+def args():
+    parser = argparse.ArgumentParser(description="Nearest site or grid cell of a list of points. Default the nearest AODN mooring site")
+    parser.add_argument('-points', dest='pointsFile', help='csv file with Site, Latitude and Longitude columns', type=str, default=None, required=True)
+    parser.add_argument('-loggers', dest='parquetDir', help='nearest reef of the GBR logger parquet archive', type=str, default=None, required=False)
+    parser.add_argument('-grid', dest='gridFile', help='nearest grid cell of a netCDF file with latitude and longitude axes, like a VISST file', type=str, default=None, required=False)
+    parser.add_argument('-maxdist', dest='maxDistance', help='max distance in km to the site. Default 10 km for the sites, the grid extent for the grids', type=float, default=None, required=False)
+    vargs = parser.parse_args()
+    return(vargs)
+
+
+def toXYZ(lat, lon):
+    """
+    positions as 3D unit vectors
+    :param lat: latitudes in degrees
+    :param lon: longitudes in degrees
+    :return: array (n, 3)
+    """
+    lat, lon = np.radians(np.asarray(lat, dtype=float)), np.radians(np.asarray(lon, dtype=float))
+    return np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)))
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    great circle distance
+    :param lat1, lon1, lat2, lon2: positions in degrees, numbers or arrays
+    :return: distance in km
+    """
+    lat1, lon1, lat2, lon2 = [np.radians(np.asarray(xx, dtype=float)) for xx in (lat1, lon1, lat2, lon2)]
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+class SiteIndex(object):
+    '''
+    KD-tree over scattered sites
+    :param lat: latitudes of the sites
+    :param lon: longitudes of the sites
+    :param names: names of the sites. Default their position in the list
+    '''
+
+    def __init__(self, lat, lon, names=None):
+        from scipy.spatial import cKDTree
+
+        self.lat = np.asarray(lat, dtype=float)
+        self.lon = np.asarray(lon, dtype=float)
+        self.names = np.asarray(names if names is not None else np.arange(len(self.lat)))
+        self._tree = cKDTree(toXYZ(self.lat, self.lon))
+
+    def __len__(self):
+        return len(self.lat)
+
+    def query(self, lat, lon, maxDistance=10.0):
+        """
+        nearest site of every point
+        :param lat: latitudes of the points
+        :param lon: longitudes of the points
+        :param maxDistance: max distance in km, the points further away are flagged. None for no limit
+        :return: dataframe, one row per point: index, name, latitude and longitude of the nearest site,
+                 distance (km) and inDomain (False if further than maxDistance)
+        """
+        chord, index = self._tree.query(toXYZ(lat, lon))
+        distance = 2 * EARTH_RADIUS * np.arcsin(np.clip(chord / 2, 0, 1))
+        return pd.DataFrame({'index': index, 'name': self.names[index], 'latitude': self.lat[index],
+                             'longitude': self.lon[index], 'distance': distance,
+                             'inDomain': distance <= maxDistance if maxDistance is not None else np.ones(len(index), dtype=bool)})
+
+    def within(self, lat, lon, radius):
+        """
+        sites within a radius of every point
+        :param lat: latitudes of the points
+        :param lon: longitudes of the points
+        :param radius: radius in km
+        :return: list of arrays of site indices, one per point
+        """
+        chord = 2 * np.sin(radius / EARTH_RADIUS / 2)
+        return [np.array(sorted(ii), dtype=int) for ii in self._tree.query_ball_point(toXYZ(lat, lon), chord)]
+
+
+class GridIndex(object):
+    '''
+    Nearest cell of a grid with 1D latitude and longitude axes, sorted (ascending or descending)
+    :param lat: latitude axis
+    :param lon: longitude axis
+    '''
+
+    def __init__(self, lat, lon):
+        self.lat = pd.Index(np.asarray(lat, dtype=float))
+        self.lon = pd.Index(np.asarray(lon, dtype=float))
+        ## the grid covers the cell centres plus half a cell on every side
+        self._latRange = self._extent(self.lat)
+        self._lonRange = self._extent(self.lon)
+
+    @staticmethod
+    def _extent(axis):
+        halfCell = np.abs(np.diff(axis)).max() / 2 if len(axis) > 1 else 0.0
+        return axis.min() - halfCell, axis.max() + halfCell
+
+    def query(self, lat, lon, maxDistance=None):
+        """
+        nearest grid cell of every point, as nc.sel(method="nearest")
+        :param lat: latitudes of the points
+        :param lon: longitudes of the points
+        :param maxDistance: max distance in km to the cell centre. Default: only the points out of the
+                            grid extent are flagged
+        :return: dataframe, one row per point: latIndex, lonIndex, latitude and longitude of the cell centre,
+                 distance (km) and inDomain
+        """
+        lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+        latIdx = self.lat.get_indexer(lat, method='nearest')
+        lonIdx = self.lon.get_indexer(lon, method='nearest')
+        latCell, lonCell = self.lat.values[latIdx], self.lon.values[lonIdx]
+        distance = haversine(lat, lon, latCell, lonCell)
+        inDomain = ((lat >= self._latRange[0]) & (lat <= self._latRange[1]) &
+                    (lon >= self._lonRange[0]) & (lon <= self._lonRange[1]))
+        if maxDistance is not None:
+            inDomain &= distance <= maxDistance
+        return pd.DataFrame({'latIndex': latIdx, 'lonIndex': lonIdx, 'latitude': latCell, 'longitude': lonCell,
+                             'distance': distance, 'inDomain': inDomain})
+
+
+def mooringSiteIndex(df=None, realtime=False):
+    """
+    index of the AODN mooring sites, at the median position of their files in the catalogue
+    :param df: catalogue dataframe. Default the (cached) moorings catalogue
+    :param realtime: True for the realtime catalogue
+    :return: SiteIndex, named by site_code
+    """
+    if df is None:
+        from catalogCache import getCatalogue
+        df = getCatalogue(realtime=realtime, copy=False)
+    if 'LATITUDE' in df.columns and 'LONGITUDE' in df.columns:
+        position = df[['site_code', 'LATITUDE', 'LONGITUDE']]
+    elif 'geom' in df.columns:
+        ## WFS geometry, POINT (lon lat)
+        lonLat = df.geom.str.extract(r'POINT\s*\(\s*([-\d.eE]+)\s+([-\d.eE]+)').astype(float)
+        position = pd.DataFrame({'site_code': df.site_code, 'LATITUDE': lonLat[1], 'LONGITUDE': lonLat[0]})
+    else:
+        raise ValueError("ERROR: the catalogue has no site positions (LATITUDE/LONGITUDE or geom)")
+    position = position.dropna().groupby('site_code').median()
+    return SiteIndex(position.LATITUDE, position.LONGITUDE, position.index)
+
+
+def loggerSiteIndex(parquetDir, latName='lat', lonName='lon'):
+    """
+    index of the reefs of the GBR logger archive, at the median position of their records
+    :param parquetDir: parquet archive (see extractGBRLoggerSite.py)
+    :param latName: name of the latitude column
+    :param lonName: name of the longitude column
+    :return: SiteIndex, named by gbrmpa_reef_id
+    """
+    from extractGBRLoggerSite import loggerDataset
+
+    table = loggerDataset(parquetDir).to_table(columns=['gbrmpa_reef_id', latName, lonName])
+    position = table.group_by('gbrmpa_reef_id').aggregate([(latName, 'approximate_median'), (lonName, 'approximate_median')]).to_pandas()
+    position = position.sort_values('gbrmpa_reef_id')
+    return SiteIndex(position[latName + '_approximate_median'], position[lonName + '_approximate_median'], position.gbrmpa_reef_id)
+
+
+if __name__ == "__main__":
+    vargs = args()
+    df = pd.read_csv(vargs.pointsFile)
+
+    if vargs.gridFile:
+        import xarray as xr
+        with xr.open_dataset(vargs.gridFile) as nc:
+            index = GridIndex(nc.latitude.values, nc.longitude.values)
+        dfNearest = index.query(df.Latitude, df.Longitude, vargs.maxDistance)
+    else:
+        index = loggerSiteIndex(vargs.parquetDir) if vargs.parquetDir else mooringSiteIndex()
+        dfNearest = index.query(df.Latitude, df.Longitude, vargs.maxDistance if vargs.maxDistance is not None else 10.0)
+
+    dfNearest.insert(0, 'Site', df.Site.values)
+    print(dfNearest.round({'latitude': 4, 'longitude': 4, 'distance': 2}).to_string(index=False))
+    print('%i of %i points out of the domain' % ((~dfNearest.inDomain).sum(), len(dfNearest)))
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+test_NRSgetTS.py
+TEMP of several depths of a synthetic gridded product in one hyperslab read, and the csv files
+of NRSgetTS.
+Run with python -m pytest Code/Python
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+import NRSgetTS
+from NRSgetTS import getTempSlab
+
+
+@pytest.fixture
+def gridded():
+    time = pd.date_range('2012-01-01', '2012-12-31', freq='h')
+    depth = np.arange(0.0, 110.0, 10.0)
+    temp = np.random.default_rng(0).uniform(15, 25, (len(time), len(depth)))
+    return xr.Dataset({'TEMP': (('TIME', 'DEPTH'), temp)}, coords={'TIME': time, 'DEPTH': depth})
+
+
+@pytest.mark.parametrize('depths', [[0, 100], [100, 0, 50], [10, 20], [30], [0, 30, 100], [20, 20]])
+def test_getTempSlab(gridded, depths):
+    slab = getTempSlab(gridded, depths, '2012-03-01', '2012-03-31')
+    expected = gridded.TEMP.sel(DEPTH=depths, TIME=slice('2012-03-01', '2012-03-31T23:59'))
+    xr.testing.assert_identical(slab, expected)
+
+
+def test_NRSgetTS(catalogue, griddedFile, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(NRSgetTS, 'openDataset', lambda url: xr.open_dataset(griddedFile))
+    nc = xr.open_dataset(griddedFile)
+
+    ## a window inside the record: the file names have the dates of the window
+    fileNames = NRSgetTS.NRSgetTS('NRSMAI', [100, 20], '2012-06-01', '2012-06-30')
+    assert fileNames == ['NRSMAI_TEMP_100m_20120601-20120630.csv', 'NRSMAI_TEMP_20m_20120601-20120630.csv']
+    for fileName, depth in zip(fileNames, [100, 20]):
+        df = pd.read_csv(fileName, index_col='TIME', parse_dates=True)
+        expected = nc.TEMP.sel(DEPTH=depth, TIME=slice('2012-06-01', '2012-06-30T23:00')).to_series()
+        assert (df.index == expected.index).all()
+        np.testing.assert_array_equal(df.TEMP.values.astype('float32'), expected.values)
+
+    ## the whole record: the dates of the coverage
+    assert NRSgetTS.NRSgetTS('NRSMAI', 0) == ['NRSMAI_TEMP_0m_20120101-20121231.csv']
+    assert len(pd.read_csv('NRSMAI_TEMP_0m_20120101-20121231.csv')) == nc.sizes['TIME']
+    assert NRSgetTS.NRSgetTS('NRSMAI', 0, '2013-01-01', '2013-02-01') is None
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+test_availability.py
+run-length encoding, gap statistics and block plots of data availability, compared with
+itertools.groupby.
+Run with python -m pytest Code/Python
+"""
+
+from itertools import groupby
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+
+import availability
+from availability import BLOCK_SYMBOLS
+
+
+def _series(seed, n=1000):
+    ## runs of data and of missing values of random lengths
+    rng = np.random.default_rng(seed)
+    x = rng.normal(size=n)
+    x[np.cumsum(rng.integers(1, 50, n)) % 2 == 1] = np.nan
+    x[np.repeat(rng.random(n // 20) < 0.3, 20)] = np.nan
+    return x
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_run_length(seed):
+    x = _series(seed)
+    expected = [(key, len(list(group))) for key, group in groupby(~np.isnan(x))]
+    starts, lengths, values = availability.runLength(~np.isnan(x))
+    assert list(zip(values, lengths)) == expected
+    assert list(starts) == list(np.cumsum([0] + [n for _, n in expected[:-1]]))
+
+
+@pytest.mark.parametrize('lineLength', [10, 40, 80, 333])
+@pytest.mark.parametrize('seed', range(5))
+def test_block_plot(seed, lineLength):
+    x = _series(seed)
+    runs = [(key, len(list(group))) for key, group in groupby(~np.isnan(x))]
+    lengths = np.array([n for _, n in runs])
+
+    ## every run within one symbol of its rounded share of the line, and the line exactly lineLength long
+    nSymbols = availability.blockSizes(lengths, lineLength)
+    assert nSymbols.sum() == lineLength
+    assert (np.abs(nSymbols - np.rint(lineLength * lengths / lengths.sum())) <= 1).all()
+    assert (nSymbols >= 0).all()
+    plot = availability.blockPlot(x, lineLength)
+    assert plot == ''.join(BLOCK_SYMBOLS[int(key)] * n for (key, _), n in zip(runs, nSymbols))
+
+
+def test_block_plot_inputs():
+    ## numpy, pandas, xarray and datetimes, all data, no data, empty
+    x = np.array([1.0, np.nan, np.nan, 4.0])
+    expected = BLOCK_SYMBOLS[1] * 2 + BLOCK_SYMBOLS[0] * 4 + BLOCK_SYMBOLS[1] * 2
+    assert availability.blockPlot(x, 8) == expected
+    assert availability.blockPlot(pd.Series(x), 8) == expected
+    assert availability.blockPlot(xr.DataArray(x), 8) == expected
+    assert availability.blockPlot(np.array(['2012-01-01', 'NaT', 'NaT', '2012-01-04'], dtype='datetime64[ns]'), 8) == expected
+    assert availability.blockPlot(np.ones(5), 8) == BLOCK_SYMBOLS[1] * 8
+    assert availability.blockPlot(np.full(5, np.nan), 8) == BLOCK_SYMBOLS[0] * 8
+    assert availability.blockPlot(np.zeros(0), 8) == ''
+    assert availability.runPlot([3, 0, 1], [True, False, False], 4) == BLOCK_SYMBOLS[1] * 3 + BLOCK_SYMBOLS[0]
+
+
+def test_summary():
+    time = np.arange(np.datetime64('2012-01-01T00'), np.datetime64('2012-01-01T10'))
+    x = xr.DataArray([1, np.nan, np.nan, 4, 5, np.nan, np.nan, np.nan, 9, 10], coords={'TIME': time}, dims='TIME')
+    summary = availability.availabilitySummary(x)
+    assert (summary['nTotal'], summary['nData'], summary['coverage']) == (10, 5, 50.0)
+    assert (summary['nGaps'], summary['gapMax'], summary['gapMean'], summary['gapMedian']) == (2, 3, 2.5, 2.5)
+    assert (summary['gapMaxStart'], summary['gapMaxEnd']) == (time[5], time[7])
+
+    summary = availability.availabilitySummary(np.ones(3))
+    assert (summary['coverage'], summary['nGaps'], summary['gapMax']) == (100.0, 0, 0)
+    assert 'gapMaxStart' not in summary
+
+
+def test_blockPlot_module():
+    ## the old module still gives the same function
+    import blockPlot
+    assert blockPlot.blockPlot is availability.blockPlot
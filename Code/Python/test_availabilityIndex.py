@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+test_availabilityIndex.py
+availability index of the synthetic hourly and gridded files of conftest.py: content, storage,
+staleness, and its use by the reports.
+Run with python -m pytest Code/Python
+"""
+
+import os
+
+import numpy as np
+import xarray as xr
+import pytest
+
+import availabilityIndex
+import infoLTSP
+import NRSgetTS
+from availabilityIndex import buildIndex, writeIndex, readIndex, getAvailabilityIndex, dayPlot
+from conftest import CATALOGUE
+
+
+@pytest.fixture(autouse=True)
+def cacheDir(tmp_path, monkeypatch):
+    monkeypatch.setenv('QIMOS_CACHE_DIR', str(tmp_path / 'cache'))
+
+
+def _days(time, valid):
+    ## days with data, from the loaded arrays
+    day = (time.astype('datetime64[D]') - time.min().astype('datetime64[D]')).astype(int)
+    return set(day[valid])
+
+
+def test_hourly(hourlyFile):
+    index = buildIndex(hourlyFile)
+    nc = xr.open_dataset(hourlyFile)
+    time, instrumentIndex = nc.TIME.values, nc.instrument_index.values
+    assert index['product'] == 'hourly'
+    assert index['dayStart'] == '2012-01-01' and index['nDays'] == 152
+    assert index['variables'] == ['DEPTH', 'TEMP', 'PSAL']
+    assert list(index['instrumentCount']) == list(np.bincount(instrumentIndex, minlength=4))
+    for ii in range(4):
+        assert set(np.flatnonzero(index['instrumentDays'][ii])) == _days(time, instrumentIndex == ii)
+    assert set(np.flatnonzero(index['variableDays'][2])) == _days(time, ~np.isnan(nc.PSAL.values))
+    assert index['variableCount'][2] == np.isfinite(nc.PSAL.values).sum()
+    assert index['instrumentTimeMin'][0] == np.datetime64('2012-01-01T00:00:00')
+    assert np.isnat(index['instrumentTimeMax'][2])
+
+
+def test_gridded(griddedFile):
+    index = buildIndex(griddedFile)
+    nc = xr.open_dataset(griddedFile)
+    assert index['product'] == 'gridded' and index['nDays'] == 366
+    assert index['depths'] == list(nc.DEPTH.values)
+    for ii, depth in enumerate(nc.DEPTH.values):
+        valid = ~np.isnan(nc.TEMP.sel(DEPTH=depth).values)
+        assert set(np.flatnonzero(index['depthDays'][ii])) == _days(nc.TIME.values, valid)
+        assert index['depthCount'][ii] == valid.sum()
+    ## 10 days gap at all the depths
+    assert not index['variableDays'][0, 161:171].any() and index['variableDays'][0, 160]
+
+
+def test_write_read(hourlyFile):
+    index = buildIndex(hourlyFile)
+    fileName = writeIndex(index)
+    assert fileName == availabilityIndex.indexFileName(hourlyFile)
+    assert os.listdir(availabilityIndex.getIndexDir()) == [os.path.basename(fileName)]
+    stored = readIndex(hourlyFile)
+    for key, value in index.items():
+        if isinstance(value, np.ndarray):
+            np.testing.assert_array_equal(stored[key], value)
+        else:
+            assert stored[key] == value
+    ## another file, or a corrupted index: no index
+    assert readIndex(hourlyFile + 'x') is None
+    with open(fileName, 'wb') as ff:
+        ff.write(b'not an index')
+    assert readIndex(hourlyFile) is None
+
+
+def test_stale(hourlyFile):
+    assert getAvailabilityIndex(hourlyFile, build=False) is None
+    built = getAvailabilityIndex(hourlyFile)['built']
+    assert getAvailabilityIndex(hourlyFile, build=False)['built'] == built
+    assert getAvailabilityIndex(hourlyFile, '2021-08-24T19:59:36')['built'] == built
+    ## the file was reprocessed
+    assert getAvailabilityIndex(hourlyFile, '2024-01-01T00:00:00', build=False) is None
+
+
+def test_reports(hourlyFile, griddedFile, monkeypatch, capsys):
+    ## with an index, the bars are the days with data
+    monkeypatch.setattr(infoLTSP, 'getFileName', lambda site, fType: {'H': hourlyFile, 'G': griddedFile}[fType])
+    index = getAvailabilityIndex(hourlyFile)
+    infoLTSP.infoLTSPh('PIL050', infoInst=True)
+    out = capsys.readouterr().out
+    assert 'Availability by day, from the availability index' in out
+    assert dayPlot(index['variableDays'][1]) in out
+    assert dayPlot(index['instrumentDays'][3], lineLength=40) in out
+
+    index = getAvailabilityIndex(griddedFile)
+    infoLTSP.infoLTSPg('NRSMAI')
+    out = capsys.readouterr().out
+    for days in index['depthDays']:
+        assert dayPlot(days, lineLength=40) in out
+
+
+def test_NRSgetTS(catalogue, griddedFile, monkeypatch, capsys):
+    ## the depth availability of the file details comes from the index of the file url
+    monkeypatch.setattr(NRSgetTS, 'openDataset', lambda url: xr.open_dataset(griddedFile))
+    NRSgetTS.NRSgetTS('NRSMAI', [15])
+    out = capsys.readouterr().out
+    assert 'ERROR: Requested DEPTH (15 m) is not available' in out
+    assert 'Data availability at' not in out
+
+    gridded = CATALOGUE.url[(CATALOGUE.site_code == 'NRSMAI') & CATALOGUE.url.str.contains('gridded')].item()
+    url = 'http://thredds.aodn.org.au/thredds/dodsC/' + gridded
+    index = getAvailabilityIndex(url, nc=xr.open_dataset(griddedFile))
+    NRSgetTS.NRSgetTS('NRSMAI', [15])
+    out = capsys.readouterr().out
+    for depth, days in zip(index['depths'], index['depthDays']):
+        assert 'Data availability at %gm: %s' % (depth, dayPlot(days, lineLength=40)) in out
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+test_batchConvert.py
+parallel conversion of synthetic hourly files, skip of the files up to date, manifest.
+Run with python -m pytest Code/Python
+"""
+
+import os
+import json
+import time
+
+import pytest
+
+import batchConvert
+from conftest import makeHourly
+
+
+@pytest.fixture
+def hourlyFiles(tmp_path):
+    ## the same site in two directories, and another file
+    fileNames = []
+    for path, name in [('a', 'PIL050_hourly-timeseries_2012.nc'), ('b', 'PIL050_hourly-timeseries_2013.nc'), ('b', 'PIL100_hourly-timeseries_2012.nc')]:
+        (tmp_path / path).mkdir(exist_ok=True)
+        fileNames.append(str(tmp_path / path / name))
+        makeHourly(fileNames[-1], seed=len(fileNames))
+    return fileNames
+
+
+def test_convert_then_skip(hourlyFiles, tmp_path):
+    output_path = str(tmp_path / 'out')
+    result = batchConvert.batchConvert(hourlyFiles, output_path=output_path, workers=2)
+    assert [entry['input'] for entry in result] == hourlyFiles
+    assert [entry['status'] for entry in result] == ['converted'] * 3
+    assert sorted(os.listdir(output_path)) == sorted([batchConvert.MANIFEST] +
+                                                     [os.path.basename(ff).replace('.nc', ext) for ff in hourlyFiles for ext in ['.csv', '_MD.csv']])
+
+    ## nothing changed: all skipped. A changed source is converted again
+    assert [entry['status'] for entry in batchConvert.batchConvert(hourlyFiles, output_path=output_path, workers=2)] == ['skipped'] * 3
+    os.utime(hourlyFiles[1], (time.time() + 10, time.time() + 10))
+    result = batchConvert.batchConvert(hourlyFiles, output_path=output_path, workers=2)
+    assert [entry['status'] for entry in result] == ['skipped', 'converted', 'skipped']
+    assert result[0]['nRecords'] == result[1]['nRecords']
+
+    ## forced, or with other options
+    assert [entry['status'] for entry in batchConvert.batchConvert(hourlyFiles[:1], output_path=output_path, force=True)] == ['converted']
+    assert [entry['status'] for entry in batchConvert.batchConvert(hourlyFiles[:1], output_path=output_path, outputFormat='arrow')] == ['converted']
+
+    with open(os.path.join(output_path, batchConvert.MANIFEST)) as ff:
+        manifest = json.load(ff)
+    assert sorted(entry['input'] for entry in manifest['files']) == sorted(hourlyFiles)
+
+
+def test_imos2csv_outputs(hourlyFiles, tmp_path):
+    ## imos2csv names its files after the site: the batch names them after the input files
+    output_path = str(tmp_path / 'out')
+    result = batchConvert.batchConvert(hourlyFiles, 'imos2csv', startDate='2012-01-01', endDate='2012-02-01', output_path=output_path)
+    assert [entry['status'] for entry in result] == ['converted'] * 3
+    assert len(set(entry['output'] for entry in result)) == 3
+    assert result[0]['output'] == os.path.join(output_path, 'PIL050_hourly-timeseries_2012_20120101-20120201.csv')
+    assert result[0]['options']['param'] == ['TEMP']
+
+
+def test_errors(hourlyFiles, tmp_path):
+    output_path = str(tmp_path / 'out')
+    ## same file name in two directories
+    makeHourly(str(tmp_path / 'b' / 'PIL050_hourly-timeseries_2012.nc'))
+    with pytest.raises(ValueError, match='would write the same output'):
+        batchConvert.batchConvert(hourlyFiles + [str(tmp_path / 'b' / 'PIL050_hourly-timeseries_2012.nc')], output_path=output_path)
+    with pytest.raises(ValueError, match='needs start and end dates'):
+        batchConvert.batchConvert(hourlyFiles, 'imos2csv', output_path=output_path)
+    with pytest.raises(ValueError, match='not a valid tool'):
+        batchConvert.batchConvert(hourlyFiles, 'ncdump', output_path=output_path)
+
+    ## a file that can't be converted fails alone
+    result = batchConvert.batchConvert([hourlyFiles[0], str(tmp_path / 'missing.nc')], output_path=output_path)
+    assert [entry['status'] for entry in result] == ['converted', 'failed']
+    assert 'error' in result[1]
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+test_catalogCache.py
+TTL, conditional refresh and offline fallback of the catalogue cache, against a local geoserver.
+Run with python -m pytest Code/Python
+"""
+
+import os
+import time
+import urllib.error
+
+import pytest
+
+import catalogCache
+from conftest import CATALOGUE
+
+
+def _changeCatalogue(csvFile):
+    ## one more row, newer than the cached copy
+    CATALOGUE.iloc[:-1].to_csv(csvFile, index=False)
+    os.utime(csvFile, (time.time() + 10, time.time() + 10))
+
+
+def test_ttl_and_refresh(catalogue):
+    df = catalogCache.getCatalogue()
+    assert list(df.url) == list(CATALOGUE.url)
+    assert sorted(os.listdir(catalogCache.getCacheDir())) == ['moorings_all_map_realtime-FALSE.json', 'moorings_all_map_realtime-FALSE.parquet']
+
+    ## within the TTL the cached copy is used, even by a new process
+    _changeCatalogue(catalogue.csvFile)
+    catalogCache._memCache.clear()
+    assert len(catalogCache.getCatalogue()) == len(CATALOGUE)
+
+    ## after it the server is asked again and the changed catalogue replaces the cached one
+    assert len(catalogCache.getCatalogue(ttl=0)) == len(CATALOGUE) - 1
+    catalogCache._memCache.clear()
+    assert len(catalogCache.getCatalogue()) == len(CATALOGUE) - 1
+
+
+def test_not_modified_keeps_dataframe(catalogue):
+    df = catalogCache.getCatalogue(copy=False)
+    fetched = catalogCache._readMeta(os.path.join(catalogCache.getCacheDir(), 'moorings_all_map_realtime-FALSE.json'))['fetched']
+    time.sleep(0.01)
+    assert catalogCache.getCatalogue(refresh=True, copy=False) is df
+    assert catalogCache._readMeta(os.path.join(catalogCache.getCacheDir(), 'moorings_all_map_realtime-FALSE.json'))['fetched'] > fetched
+
+
+def test_offline(catalogue, capsys):
+    catalogCache.getCatalogue()
+    catalogue.httpd.shutdown()
+    catalogue.httpd.server_close()
+
+    ## stale cached copy, server down: the cached copy is used with a warning
+    df = catalogCache.getCatalogue(ttl=0)
+    assert list(df.url) == list(CATALOGUE.url)
+    assert 'WARNING: catalogue server not available' in capsys.readouterr().out
+
+    ## nothing cached: the error goes up
+    catalogCache.clearCache()
+    with pytest.raises(urllib.error.URLError):
+        catalogCache.getCatalogue()
+
+
+def test_site_catalogue(catalogue):
+    df = catalogCache.getSiteCatalogue('NRSYON')
+    assert list(df.index) == [0, 1, 2]
+    assert set(df.site_code) == {'NRSYON'}
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+test_extractCloud.py
+sites of a synthetic clipped VISST product extracted all at once, compared with a nearest
+selection of every site, and the site store updated incrementally.
+Run with python -m pytest Code/Python
+"""
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+
+from extractCloud import prepareCloud, siteCells, selectCells, extractSites, updateSiteStore, siteClimatology
+from getHW8clouds import TIME_CHUNK, readState, writeState
+
+## sites of the coordinates file: the last two are out of the grid
+SITES = pd.DataFrame({'Site': ['Heron', 'Lizard', 'Davies', 'Osprey', 'Perth', 'Fiji'],
+                      'Latitude': [-23.44, -14.67, -18.83, -13.9, -31.95, -17.7],
+                      'Longitude': [151.91, 145.45, 147.63, 146.6, 115.86, 178.0]})
+
+
+def makeCloud(nTime=2 * TIME_CHUNK + 10, seed=0, freq='h'):
+    ## clipped VISST product: descending latitudes, latitude and longitude as coordinates
+    lat = np.arange(-7.5, -30.0, -0.5)
+    lon = np.arange(141.0, 160.0, 0.5)
+    time = pd.date_range('2018-11-01', periods=nTime, freq=freq)
+    rng = np.random.default_rng(seed)
+    cloud = rng.uniform(0, 100, (nTime, len(lat), len(lon))).astype('float32')
+    cloud[rng.uniform(size=cloud.shape) < 0.1] = np.nan
+    return xr.Dataset({'cloud_percentage': (('time', 'lat', 'lon'), cloud),
+                       'cloud_height': (('time', 'lat', 'lon'), rng.uniform(0, 12, cloud.shape).astype('float32'))},
+                      coords={'time': time, 'latitude': ('lat', lat), 'longitude': ('lon', lon)})
+
+
+@pytest.fixture
+def cloud():
+    return prepareCloud(makeCloud())
+
+
+def test_site_cells(cloud, capsys):
+    df, cells = siteCells(cloud, SITES)
+    assert list(df.Site) == ['Heron', 'Lizard', 'Davies', 'Osprey']
+    assert 'WARNING: sites out of the domain, not extracted: Perth, Fiji' in capsys.readouterr().out
+    for (_, site), (_, cell) in zip(df.iterrows(), cells.iterrows()):
+        nearest = cloud.sel(lat=site.Latitude, lon=site.Longitude, method='nearest')
+        assert (cell.latitude, cell.longitude) == (nearest.lat.item(), nearest.lon.item())
+    ## the sites further than 20 km of their cell centre
+    distance = siteCells(cloud, SITES)[1].distance.values
+    df, cells = siteCells(cloud, SITES, maxDistance=20)
+    assert list(df.Site) == list(SITES.Site[:4][distance <= 20]) and len(df) == 3
+
+
+def test_select_cells(cloud):
+    ## several time chunks of the cube, read one box at a time
+    df, cells = siteCells(cloud, SITES)
+    ds = selectCells(cloud, cells)
+    assert list(ds.data_vars) == ['cloud_percentage', 'cloud_height']
+    expected = cloud.isel(lat=xr.DataArray(cells.latIndex.values, dims='site'), lon=xr.DataArray(cells.lonIndex.values, dims='site'))
+    xr.testing.assert_identical(ds, expected)
+
+
+def test_extract_sites(cloud):
+    dfSites = extractSites(cloud, SITES)
+    assert list(dfSites.Site.unique()) == ['Heron', 'Lizard', 'Davies', 'Osprey']
+    for _, site in SITES[:4].iterrows():
+        expected = cloud.sel(lat=site.Latitude, lon=site.Longitude, method='nearest').to_dataframe()
+        dfSite = dfSites[dfSites.Site == site.Site]
+        assert (dfSite.index == expected.index).all()
+        for column in ['cloud_percentage', 'cloud_height', 'lat', 'lon']:
+            np.testing.assert_array_equal(dfSite[column].values, expected[column].values)
+
+
+def test_no_site(cloud):
+    with pytest.raises(ValueError, match='no site in the domain of the grid'):
+        extractSites(cloud, SITES[4:])
+
+
+@pytest.fixture
+def daily():
+    ## 400 days: several time chunks and every month of the year
+    pytest.importorskip('zarr')
+    return prepareCloud(makeCloud(400, freq='D'))
+
+
+def _nearest(nc, sites):
+    ## series of the sites, one nearest selection per site
+    return {site.Site: nc.sel(lat=site.Latitude, lon=site.Longitude, method='nearest') for _, site in sites.iterrows()}
+
+
+def _assertStore(store, nc, sites):
+    ds = xr.open_zarr(store).load()
+    assert list(ds.site.values) == list(sites.Site)
+    assert list(ds.indexes['time']) == list(nc.indexes['time'])
+    for name, expected in _nearest(nc, sites).items():
+        for vv in ['cloud_percentage', 'cloud_height']:
+            np.testing.assert_array_equal(ds[vv].sel(site=name).values, expected[vv].values)
+        assert (ds.latCell.sel(site=name).item(), ds.lonCell.sel(site=name).item()) == (expected.lat.item(), expected.lon.item())
+
+
+def test_site_store(daily, tmp_path):
+    ## the new time steps of every update are appended, the new sites get their full history
+    store = str(tmp_path / 'sites.zarr')
+    state = updateSiteStore(daily.isel(time=slice(0, 100)), SITES[:2], store)
+    assert state['nTime'] == 100 and state['lastTime'] == str(daily.indexes['time'][99])
+    _assertStore(store, daily.isel(time=slice(0, 100)), SITES[:2])
+
+    state = updateSiteStore(daily.isel(time=slice(0, 250)), SITES, store)
+    assert state['nTime'] == 250 and [row[0] for row in state['sites']] == ['Heron', 'Lizard', 'Davies', 'Osprey']
+    _assertStore(store, daily.isel(time=slice(0, 250)), SITES[:4])
+
+    ## nothing new
+    assert updateSiteStore(daily.isel(time=slice(0, 250)), SITES[:1], store) == readState(store, {})
+    state = updateSiteStore(daily, SITES[:1], store)
+    assert state['nTime'] == 400
+    _assertStore(store, daily, SITES[:4])
+
+
+def test_resume(daily, tmp_path):
+    ## an update interrupted after the arrays were written but before the state: the store is cut
+    ## back to the state and updated again
+    store = str(tmp_path / 'sites.zarr')
+    updateSiteStore(daily.isel(time=slice(0, 100)), SITES[:2], store)
+    state = readState(store, {})
+    updateSiteStore(daily.isel(time=slice(0, 200)), SITES[:3], store)
+    writeState(store, state)
+    assert dict(xr.open_zarr(store).sizes) == {'time': 200, 'site': 3}
+
+    state = updateSiteStore(daily, SITES, store)
+    _assertStore(store, daily, SITES[:4])
+    expected = str(tmp_path / 'expected.zarr')
+    updateSiteStore(daily.isel(time=slice(0, 100)), SITES[:2], expected)
+    assert updateSiteStore(daily, SITES, expected) == state
+
+
+def test_history_mismatch(daily, tmp_path):
+    ## new sites need the time steps of the store in the product
+    store = str(tmp_path / 'sites.zarr')
+    updateSiteStore(daily.isel(time=slice(0, 100)), SITES[:2], store)
+    with pytest.raises(ValueError, match='the 100 time steps of .* are not in the cloud product'):
+        updateSiteStore(daily.isel(time=slice(50, 200)), SITES[:3], store)
+
+
+def test_site_climatology(daily, tmp_path):
+    ## the monthly means of the sums of the updates, as a groupby of the whole store
+    store = str(tmp_path / 'sites.zarr')
+    with pytest.raises(ValueError, match='is empty'):
+        siteClimatology(store)
+    for nTime, nSites in [(50, 1), (170, 3), (400, 4)]:
+        updateSiteStore(daily.isel(time=slice(0, nTime)), SITES[:nSites], store)
+    dfClim = siteClimatology(store)
+    df = xr.open_zarr(store)[['cloud_percentage', 'cloud_height']].to_dataframe()
+    df['month'] = df.index.get_level_values('time').month
+    grouped = df.groupby(['site', 'month'])
+    for vv in ['cloud_percentage', 'cloud_height']:
+        expected = grouped[vv].mean().reindex(dfClim.index.rename(['site', 'month']))
+        np.testing.assert_allclose(dfClim[vv].values, expected.values, rtol=1e-6)
+        assert list(dfClim[vv + '_count']) == list(grouped[vv].count().reindex(expected.index))
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+test_extractGBRLoggerSite.py
+sites of the synthetic GBR logger archive of conftest.py, read with the site and parameter
+filters in the parquet reader, from the archive and from its partitioned copy, compared with
+a pandas selection, and many sites extracted in one scan of the archive.
+Run with python -m pytest Code/Python
+"""
+
+import os
+
+import pandas as pd
+import pytest
+
+import extractGBRLoggerSite
+from extractGBRLoggerSite import extractSite, extractSites, repartitionArchive, isPartitioned, selectSites, siteCodeName
+from conftest import LOGGER_SITES
+
+
+def _expected(df, codes, parameter='Water Temperature', columns=None):
+    ## rows of the sites, in the order of the archive
+    dfSites = df[df.gbrmpa_reef_id.isin(codes) & ((df.parameter == parameter) if parameter else True)]
+    return dfSites[columns or list(df.columns)].reset_index(drop=True)
+
+
+@pytest.fixture
+def partitioned(loggers, tmp_path):
+    parquetDir, df = loggers
+    return repartitionArchive(parquetDir, str(tmp_path / 'partitioned')), df
+
+
+@pytest.mark.parametrize('siteCode', ['18-096', '1001', '14-116b'])
+def test_extract_site(loggers, siteCode):
+    parquetDir, df = loggers
+    pd.testing.assert_frame_equal(extractSite(siteCode, parquetDir=parquetDir), _expected(df, [siteCode]), check_dtype=False)
+
+
+def test_extract_columns(loggers):
+    parquetDir, df = loggers
+    dfSite = extractSite('23-052', None, parquetDir, columns=['time', 'qc_val'])
+    pd.testing.assert_frame_equal(dfSite, _expected(df, ['23-052'], None, ['time', 'qc_val']), check_dtype=False)
+
+
+def test_partitioned(partitioned):
+    parquetDir, df = partitioned
+    assert isPartitioned(parquetDir)
+    ## one directory per reef id and parameter, url encoded
+    assert sorted(os.listdir(os.path.join(parquetDir, 'gbrmpa_reef_id=1001'))) == ['parameter=Water%20Pressure', 'parameter=Water%20Temperature']
+    ## same columns as the archive, the numeric looking reef id stays a string
+    dfSite = extractSite('1001', parquetDir=parquetDir)
+    assert list(dfSite.columns) == list(df.columns)
+    assert (dfSite.gbrmpa_reef_id == '1001').all()
+    pd.testing.assert_frame_equal(dfSite, _expected(df, ['1001']), check_dtype=False, check_categorical=False)
+
+
+def test_select_sites():
+    assert selectSites(LOGGER_SITES, ['1', '23-052', 'XX-000']) == [LOGGER_SITES[1], LOGGER_SITES[2], 'XX-000']
+    assert selectSites(LOGGER_SITES, ['0'], regex='Lizard') == [LOGGER_SITES[0]] + LOGGER_SITES[4:]
+    assert siteCodeName(LOGGER_SITES[0]) == ('18-096', 'DaviesReef')
+    assert siteCodeName('18-096') == ('18-096', '18-096')
+
+
+def test_site_list(tmp_path):
+    fileName = str(tmp_path / 'siteList.txt')
+    with open(fileName, 'w') as ff:
+        ff.write('\n'.join(LOGGER_SITES))
+    assert extractGBRLoggerSite.readSiteList(fileName) == LOGGER_SITES
+
+
+@pytest.mark.parametrize('archive', ['loggers', 'partitioned'])
+def test_extract_sites(archive, request, tmp_path):
+    ## small batches and buffers: the csv files are appended by many flushes
+    parquetDir, df = request.getfixturevalue(archive)
+    outDir = str(tmp_path / 'out')
+    os.makedirs(outDir)
+    outFiles = extractSites(LOGGER_SITES, parquetDir=parquetDir, outDir=outDir, batchSize=1000, bufferRows=3000)
+    ## two sites with the same name: the second file has the reef id
+    assert [os.path.basename(fileName) for fileName, _ in outFiles.values()] == \
+        ['DaviesReef.csv', 'MyrmidonReef.csv', 'HeronIsland.csv', 'OneTree.csv', 'LizardIsland.csv', 'LizardIsland_14-116b.csv']
+    for siteCode, (fileName, nRecords) in outFiles.items():
+        dfSite = pd.read_csv(fileName, dtype={'gbrmpa_reef_id': str})
+        expected = extractSite(siteCode, parquetDir=parquetDir)
+        assert nRecords == len(dfSite) == len(expected)
+        assert list(dfSite.columns) == list(df.columns)
+        if nRecords:
+            ## one csv per site, in the order of the archive
+            pd.testing.assert_frame_equal(dfSite, _expected(df, [siteCode]).astype({'time': str}), check_dtype=False)
+
+
+def test_extract_sites_columns(loggers, tmp_path):
+    ## the reef id is read to split the rows, but not written
+    parquetDir, df = loggers
+    outFiles = extractSites(LOGGER_SITES[:2], None, parquetDir, ['time', 'qc_val'], str(tmp_path), workers=1, bufferRows=100)
+    for siteCode, (fileName, nRecords) in outFiles.items():
+        dfSite = pd.read_csv(fileName)
+        pd.testing.assert_frame_equal(dfSite, _expected(df, [siteCode], None, ['time', 'qc_val']).astype({'time': str}))
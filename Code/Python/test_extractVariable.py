@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+test_extractVariable.py
+rectangular NOMINAL_DEPTH x TIME grid of the synthetic hourly file of conftest.py,
+compared with a scatter of the observations one at a time, in memory, lazy, written
+to netCDF4 and Zarr, and sparse.
+Run with python -m pytest Code/Python
+"""
+
+import numpy as np
+import xarray as xr
+import pytest
+
+import extractVariable
+from conftest import makeHourly
+
+
+@pytest.fixture
+def sharedDepthFile(tmp_path):
+    ## instruments 0 and 3 at the same nominal depth and overlapping in time: the last one is kept
+    ds = makeHourly(str(tmp_path / 'tmp.nc'))
+    ds['NOMINAL_DEPTH'] = ('INSTRUMENT', np.array([10, 20, 30, 10], dtype='float32'))
+    fileName = str(tmp_path / 'PIL050_hourly-timeseries_shared.nc')
+    ds.to_netcdf(fileName)
+    return fileName
+
+
+def _reference(fileName, varname):
+    ## one observation at a time, in instrument order
+    nc = xr.open_dataset(fileName).load()
+    time = nc.TIME.values.astype('datetime64[h]')
+    timeSeq = np.arange(time.min(), time.max() + np.timedelta64(1, 'h'))
+    ndSeq = np.unique(nc.NOMINAL_DEPTH.values)
+    grid = np.full((len(ndSeq), len(timeSeq)), np.nan)
+    depth = np.full((len(ndSeq), len(timeSeq)), np.nan)
+    for ii in np.argsort(nc.instrument_index.values, kind='stable'):
+        row = list(ndSeq).index(nc.NOMINAL_DEPTH.values[nc.instrument_index.values[ii]])
+        col = int((time[ii] - timeSeq[0]) // np.timedelta64(1, 'h'))
+        grid[row, col] = nc[varname].values[ii]
+        depth[row, col] = nc.DEPTH.values[ii]
+    return ndSeq, timeSeq, grid, depth
+
+
+@pytest.mark.parametrize('varname', ['TEMP', 'PSAL'])
+def test_get_variable(hourlyFile, varname):
+    ndSeq, timeSeq, grid, depth = _reference(hourlyFile, varname)
+    ds = extractVariable.getVariable(hourlyFile, varname)
+    assert list(ds.NOMINAL_DEPTH.values) == list(ndSeq)
+    assert (ds.TIME.values == timeSeq).all()
+    np.testing.assert_array_equal(ds[varname].values, grid)
+    np.testing.assert_array_equal(ds.DEPTH.values, depth)
+    assert ds.attrs['keywords'] == 'DEPTH, %s, HOURLY, AGGREGATED' % varname
+
+
+def test_last_instrument_wins(sharedDepthFile):
+    ndSeq, timeSeq, grid, depth = _reference(sharedDepthFile, 'TEMP')
+    ds = extractVariable.getVariable(sharedDepthFile, 'TEMP')
+    assert list(ds.NOMINAL_DEPTH.values) == [10, 20, 30]
+    np.testing.assert_array_equal(ds.TEMP.values, grid)
+
+
+def test_equal_depths(hourlyFile):
+    ## 0.1m rows from the shallowest to the deepest nominal depth, the instruments in their rows
+    ds = extractVariable.getVariable(hourlyFile, 'TEMP', equalDepths=True)
+    assert ds.sizes['NOMINAL_DEPTH'] == 301
+    byDepth = extractVariable.getVariable(hourlyFile, 'TEMP')
+    for nominalDepth in byDepth.NOMINAL_DEPTH.values:
+        row = int(round((nominalDepth - 10) / 0.1))
+        np.testing.assert_array_equal(ds.TEMP.values[row], byDepth.TEMP.sel(NOMINAL_DEPTH=nominalDepth).values)
+    assert np.isnan(ds.TEMP.values[1:100]).all()
+
+
+@pytest.mark.parametrize('chunks', [(1, 100), (2, 24 * 30), (50, 100000)])
+@pytest.mark.parametrize('equalDepths', [False, True])
+def test_lazy(sharedDepthFile, chunks, equalDepths):
+    pytest.importorskip('dask')
+    ds = extractVariable.getVariable(sharedDepthFile, 'TEMP', equalDepths, dtype='float32')
+    lazy = extractVariable.getVariableLazy(sharedDepthFile, 'TEMP', equalDepths, chunks=chunks)
+    assert lazy.TEMP.chunks is not None
+    assert lazy.TEMP.data.chunksize == (min(chunks[0], ds.sizes['NOMINAL_DEPTH']), min(chunks[1], ds.sizes['TIME']))
+    xr.testing.assert_identical(lazy.compute(), ds)
+
+
+@pytest.mark.parametrize('outName', ['TEMP.nc', 'TEMP.zarr'])
+def test_write(hourlyFile, tmp_path, outName):
+    pytest.importorskip('dask')
+    if outName.endswith('.zarr'):
+        pytest.importorskip('zarr')
+    outFileName = extractVariable.writeVariable(hourlyFile, 'TEMP', str(tmp_path / outName), chunks=(2, 500))
+    ds = extractVariable.getVariable(hourlyFile, 'TEMP', dtype='float32')
+    written = xr.open_dataset(outFileName, engine='zarr' if outName.endswith('.zarr') else None).load()
+    np.testing.assert_array_equal(written.TEMP.values, ds.TEMP.values)
+    np.testing.assert_array_equal(written.DEPTH.values, ds.DEPTH.values)
+    assert (written.TIME.values == ds.TIME.values).all()
+    if outName.endswith('.zarr'):
+        ## the chunks without observations, like the empty hours of the record, are not written
+        import zarr
+        array = zarr.open_group(outFileName, mode='r')['TEMP']
+        assert array.nchunks_initialized < array.nchunks
+
+
+def test_sparse(sharedDepthFile):
+    pytest.importorskip('scipy')
+    ds = extractVariable.getVariable(sharedDepthFile, 'TEMP')
+    sparse = extractVariable.getVariableSparse(sharedDepthFile, 'TEMP')
+    assert sparse.shape == (ds.sizes['NOMINAL_DEPTH'], ds.sizes['TIME'])
+    assert sparse.nnz == int(np.isfinite(ds.TEMP.values).sum())
+    xr.testing.assert_identical(sparse.toDataset(), ds)
+
+    ## a row, as a table of the observed hours
+    row = sparse.getRow(19)
+    observed = ds.TEMP.sel(NOMINAL_DEPTH=20).dropna('TIME')
+    assert (row.TIME.values == observed.TIME.values).all()
+    np.testing.assert_array_equal(row.TEMP.values, observed.values)
+    np.testing.assert_array_equal(row.DEPTH.values, ds.DEPTH.sel(NOMINAL_DEPTH=20).dropna('TIME').values)
+
+
+def test_sparse_sel(sharedDepthFile):
+    pytest.importorskip('scipy')
+    ds = extractVariable.getVariable(sharedDepthFile, 'TEMP', dtype='float32')
+    sparse = extractVariable.getVariableSparse(sharedDepthFile, 'TEMP', dtype='float32')
+    sub = sparse.sel(nominalDepth=[31, 9], timeStart='2012-01-20', timeEnd='2012-02-10T05')
+    expected = ds.sel(NOMINAL_DEPTH=[30, 10], TIME=slice('2012-01-20', '2012-02-10T05'))
+    assert sub.TIME[0] == np.datetime64('2012-01-20T00', 'h') and sub.TIME[-1] == np.datetime64('2012-02-10T05', 'h')
+    xr.testing.assert_identical(sub.toDataset(), expected)
+    xr.testing.assert_identical(sparse.sel().toDataset(), ds)
+
+
+def test_not_hourly(tmp_path, capsys):
+    ds = makeHourly(str(tmp_path / 'tmp.nc'))
+    ds.attrs['abstract'] = 'Gridded Time Series Product'
+    ds.to_netcdf(str(tmp_path / 'gridded.nc'))
+    assert extractVariable.getVariable(str(tmp_path / 'gridded.nc'), 'TEMP') is None
+    assert 'not an hourly LTSP' in capsys.readouterr().out
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+test_fileCache.py
+refresh of a changed file and eviction of the file cache, against a local http server.
+Run with python -m pytest Code/Python
+"""
+
+import os
+import time
+import threading
+import functools
+import http.server
+
+import pytest
+
+import fileCache
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    ## THREDDS fileServer layout served from a temporary directory, cache in another one
+    wwwDir = tmp_path / 'www'
+    (wwwDir / 'thredds' / 'fileServer' / 'IMOS').mkdir(parents=True)
+    monkeypatch.setenv('QIMOS_CACHE_DIR', str(tmp_path / 'cache'))
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=str(wwwDir))
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield wwwDir / 'thredds' / 'fileServer', 'http://127.0.0.1:%i/thredds/fileServer/' % httpd.server_port
+    httpd.shutdown()
+
+
+def _objects():
+    return sorted(ff for ff in os.listdir(os.path.join(fileCache.getFileCacheDir(), 'objects')) if ff.endswith('.nc'))
+
+
+def test_refresh_then_evict(server):
+    rootDir, rootURL = server
+    fileName = rootDir / 'IMOS' / 'file.nc'
+    fileName.write_bytes(b'first version')
+    first = fileCache.getLocalFile(rootURL + 'IMOS/file.nc', download=True)
+
+    ## the file changes on the server: the refreshed copy replaces the old one
+    fileName.write_bytes(b'second, longer version')
+    os.utime(fileName, (time.time() + 10, time.time() + 10))
+    second = fileCache.getLocalFile(rootURL + 'IMOS/file.nc', download=True, refresh=True)
+    assert second != first
+    assert not os.path.exists(first)
+    assert _objects() == [os.path.basename(second)]
+
+    ## an orphan left by an interrupted refresh is removed by the next eviction
+    orphan = os.path.join(fileCache.getFileCacheDir(), 'objects', '0' * 64 + '.nc')
+    with open(orphan, 'wb') as ff:
+        ff.write(b'orphan')
+    os.utime(orphan, (time.time() - 2 * fileCache.ORPHAN_AGE, time.time() - 2 * fileCache.ORPHAN_AGE))
+    assert fileCache.evict() == []
+    assert _objects() == [os.path.basename(second)]
+
+    ## evicted down to nothing: no object left
+    assert fileCache.evict(maxSize=0) == ['IMOS/file.nc']
+    assert _objects() == []
+
+
+def test_refresh_keeps_shared_object(server):
+    rootDir, rootURL = server
+    for name in ['a.nc', 'b.nc']:
+        (rootDir / 'IMOS' / name).write_bytes(b'same content')
+    shared = fileCache.getLocalFile(rootURL + 'IMOS/a.nc', download=True)
+    assert fileCache.getLocalFile(rootURL + 'IMOS/b.nc', download=True) == shared
+
+    ## a.nc changes, b.nc still refers to the old object
+    (rootDir / 'IMOS' / 'a.nc').write_bytes(b'new content of a')
+    os.utime(rootDir / 'IMOS' / 'a.nc', (time.time() + 10, time.time() + 10))
+    fileCache.getLocalFile(rootURL + 'IMOS/a.nc', download=True, refresh=True)
+    assert os.path.exists(shared)
+    assert len(_objects()) == 2
+
+
+def test_threads(server):
+    ## the thread pools of the tools cache files at the same time: no download or index entry is lost
+    from concurrent.futures import ThreadPoolExecutor
+
+    rootDir, rootURL = server
+    names = ['file%02i.nc' % ii for ii in range(16)]
+    for ii, name in enumerate(names):
+        (rootDir / 'IMOS' / name).write_bytes(os.urandom(100000 + ii))
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        localFiles = list(pool.map(lambda name: fileCache.getLocalFile(rootURL + 'IMOS/' + name, download=True), names))
+
+    index = fileCache._readIndex()
+    assert sorted(index) == ['IMOS/' + name for name in names]
+    for name, localFile in zip(names, localFiles):
+        with open(localFile, 'rb') as ff:
+            assert ff.read() == (rootDir / 'IMOS' / name).read_bytes()
+    assert len(_objects()) == len(names)
+    assert not [ff for ff in os.listdir(fileCache.getFileCacheDir()) if ff.endswith('.tmp')]
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+test_geoserverCatalog.py
+queries of the indexed moorings catalogue against the synthetic catalogue of conftest.py.
+Run with python -m pytest Code/Python
+"""
+
+import pytest
+
+import catalogCache
+import geoserverCatalog
+from conftest import CATALOGUE
+
+S3 = 'https://s3-ap-southeast-2.amazonaws.com/imos-data/'
+
+
+def _urls(mask):
+    ## expected urls, in time_coverage_start order
+    return list(CATALOGUE[mask].sort_values(by='time_coverage_start', kind='stable').url)
+
+
+@pytest.mark.parametrize('criteria, mask', [
+    ({}, CATALOGUE.site_code.notna()),
+    ({'site': 'PIL050'}, CATALOGUE.site_code == 'PIL050'),
+    ({'varname': 'PSAL'}, CATALOGUE.variables.str.contains('PSAL')),
+    ({'featuretype': 'profile'}, CATALOGUE.feature_type == 'profile'),
+    ({'datacategory': 'velocity'}, CATALOGUE.data_category == 'Velocity'),
+    ({'fileversion': 1, 'varname': 'TEMP'}, (CATALOGUE.file_version == 1) & CATALOGUE.variables.str.contains('TEMP')),
+    ({'timestart': '2012-07-01', 'timeend': '2012-12-31', 'fileversion': 1}, (CATALOGUE.site_code == 'PIL050') & (CATALOGUE.file_version == 1)),
+    ({'site': 'NRSMAI', 'filterin': ['hourly'], 'filterout': ['velocity', 'non-QC']}, (CATALOGUE.site_code == 'NRSMAI') & CATALOGUE.url.str.contains('_hourly-timeseries_')),
+])
+def test_query(catalogue, criteria, mask):
+    assert geoserverCatalog.get_moorings_urls(**criteria) == [S3 + url for url in _urls(mask)]
+
+
+def test_webroot(catalogue):
+    urls = geoserverCatalog.get_moorings_urls(site='PIL050', featuretype='profile', webURL='opendap')
+    assert urls == ['http://thredds.aodn.org.au/thredds/dodsC/' + _urls(CATALOGUE.feature_type == 'profile')[0]]
+
+
+@pytest.mark.parametrize('criteria', [{'varname': 'NOPE'}, {'site': 'NOPE'}, {'featuretype': 'trajectory'},
+                                      {'fileversion': 3}, {'datacategory': 'NOPE'}, {'timestart': '2012-13-01'}])
+def test_invalid(catalogue, criteria):
+    with pytest.raises(ValueError, match='ERROR'):
+        geoserverCatalog.get_moorings_urls(**criteria)
+
+
+def test_rebuilt_with_catalogue(catalogue):
+    ## the indexes are built once per catalogue download
+    first = geoserverCatalog.getMooringsCatalogue()
+    assert geoserverCatalog.getMooringsCatalogue() is first
+    catalogCache.getCatalogue(refresh=True)
+    assert geoserverCatalog.getMooringsCatalogue() is first
+    catalogCache.clearCache()
+    assert geoserverCatalog.getMooringsCatalogue() is not first
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+test_getHW8clouds.py
+clip of synthetic VISST granules (latitude and longitude as data variables, like the satcorps
+files) into a Zarr cube, read back by extractCloud, the ingestion of the days of a local stand-in
+of the VISST server, and the recovery of an interrupted append.
+Run with python -m pytest Code/Python
+"""
+
+import os
+import types
+import threading
+import functools
+import http.server
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+
+import getHW8clouds
+from extractCloud import openCloud, prepareCloud
+
+
+def makeGranule(fileName, time, seed=0):
+    ## VISST grid: descending latitudes, 4 cloud types, time as a scalar variable
+    lat = np.arange(-5.0, -35.0, -0.5)
+    lon = np.arange(138.0, 165.0, 0.5)
+    rng = np.random.default_rng(seed)
+    ds = xr.Dataset({'cloud_percentage': (('lat', 'lon', 'cld_type'), rng.uniform(0, 100, (len(lat), len(lon), 4)).astype('float32')),
+                     'latitude': ('lat', lat), 'longitude': ('lon', lon), 'time': pd.Timestamp(time)})
+    ds.to_netcdf(fileName)
+    return ds
+
+
+def test_clip_to_cloud_cube(tmp_path):
+    granules = [makeGranule(tmp_path / ('granule%i.nc' % ii), '2018-11-01T%02i:00' % (3 * ii), seed=ii) for ii in range(2)]
+    clipped = [getHW8clouds.clipGranule((tmp_path / ('granule%i.nc' % ii)).as_uri()) for ii in range(2)]
+    assert 'latitude' in clipped[0].coords and 'longitude' in clipped[0].coords
+
+    store = str(tmp_path / 'cube.zarr')
+    state = getHW8clouds.readState(store)
+    getHW8clouds.appendDay(xr.concat(clipped, dim='time'), store, '2018-11-01', state)
+    nc = prepareCloud(openCloud(store))
+
+    box = getHW8clouds.GBR_BOX
+    assert nc.indexes['lat'].min() >= box[0] and nc.indexes['lat'].max() <= box[1]
+    assert nc.indexes['lon'].min() >= box[2] and nc.indexes['lon'].max() <= box[3]
+    assert list(nc.time.values) == [np.datetime64('2018-11-01T00:00'), np.datetime64('2018-11-01T03:00')]
+    ## total cloud (cld_type 0) of the granules at a cell of the box
+    for ii, granule in enumerate(granules):
+        expected = granule.set_coords(['latitude', 'longitude']).set_index(lat='latitude', lon='longitude').cloud_percentage
+        assert nc.cloud_percentage.isel(time=ii).sel(lat=-20.0, lon=150.0).values == expected.sel(lat=-20.0, lon=150.0).isel(cld_type=0).item()
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(tmp_path):
+    ## VISST server: a directory per day with the granules of 3 hours of the day, and its index page
+    wwwDir = tmp_path / 'visst'
+    for day in ['2018-11-01', '2018-11-02', '2018-11-04']:
+        dayDir = wwwDir / pd.Timestamp(day).strftime('%Y/%m/%d')
+        dayDir.mkdir(parents=True)
+        for hour in [0, 3, 6]:
+            time = pd.Timestamp(day) + pd.Timedelta(hours=hour)
+            makeGranule(dayDir / time.strftime('HM8V03.0.SH.%Y%j.%H%M.PX.08K.NC'), time, seed=hour + time.day)
+        ## a granule of the other hemisphere, not ingested
+        makeGranule(dayDir / pd.Timestamp(day).strftime('HM8V03.0.NH.%Y%j.0000.PX.08K.NC'), day)
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(QuietHandler, directory=str(wwwDir)))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield types.SimpleNamespace(url='http://127.0.0.1:%i/' % httpd.server_port, wwwDir=wwwDir)
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_list_granules(server):
+    urls = getHW8clouds.listGranules('2018-11-01', server.url)
+    assert [os.path.basename(url) for url in urls] == ['HM8V03.0.SH.2018305.%s.PX.08K.NC' % hour for hour in ['0000', '0300', '0600']]
+    assert getHW8clouds.listGranules('2018-11-03', server.url) == []
+
+
+@pytest.mark.parametrize('storeName', ['cube.zarr', 'daily'])
+def test_ingest(server, tmp_path, storeName, capsys):
+    store = str(tmp_path / storeName)
+    state = getHW8clouds.ingest('2018-11-01', '2018-11-02', store, server=server.url, workers=2)
+    assert state == getHW8clouds.readState(store) == {'days': {'20181101': 3, '20181102': 3}, 'nTime': 6}
+    ## the days already ingested are skipped, a day without granules is not recorded
+    state = getHW8clouds.ingest('2018-11-01', '2018-11-04', store, server=server.url, workers=2)
+    assert state['days'] == {'20181101': 3, '20181102': 3, '20181104': 3} and state['nTime'] == 9
+    assert '2018-11-03: no granules' in capsys.readouterr().out
+
+    nc = prepareCloud(openCloud(store))
+    times = [pd.Timestamp(day) + pd.Timedelta(hours=hour) for day in ['2018-11-01', '2018-11-02', '2018-11-04'] for hour in [0, 3, 6]]
+    assert list(nc.indexes['time']) == times
+    granule = xr.open_dataset(server.wwwDir / '2018/11/04/HM8V03.0.SH.2018308.0300.PX.08K.NC')
+    expected = granule.set_coords(['latitude', 'longitude']).set_index(lat='latitude', lon='longitude').cloud_percentage
+    assert nc.cloud_percentage.isel(time=7).sel(lat=-20.0, lon=150.0).values == expected.sel(lat=-20.0, lon=150.0, cld_type=0).item()
+
+
+def test_truncate_zarr(tmp_path):
+    ## an append interrupted after the arrays were written but before the state
+    store = str(tmp_path / 'sites.zarr')
+    ds = xr.Dataset({'cloud': (('time', 'site'), np.arange(12.0).reshape(4, 3))},
+                    coords={'time': pd.date_range('2018-11-01', periods=4, freq='h'), 'site': ['a', 'b', 'c']})
+    ds.to_zarr(store, mode='w', zarr_format=2)
+    getHW8clouds.writeState(store, {'nTime': 4})
+    ds.assign_coords(time=ds.time + pd.Timedelta(hours=4)).to_zarr(store, append_dim='time')
+    assert xr.open_zarr(store).sizes['time'] == 8
+
+    getHW8clouds.truncateZarr(store, {'time': getHW8clouds.readState(store)['nTime']})
+    xr.testing.assert_identical(xr.open_zarr(store).load(), ds)
+    ## other dimensions, and the sizes already right: nothing changes
+    getHW8clouds.truncateZarr(store, {'time': 4, 'site': 2})
+    xr.testing.assert_identical(xr.open_zarr(store).load(), ds.isel(site=slice(0, 2)))
+    getHW8clouds.truncateZarr(store, {'time': 4})
+    assert dict(xr.open_zarr(store).sizes) == {'time': 4, 'site': 2}
+
+
+def test_state(tmp_path):
+    store = str(tmp_path / 'cube.zarr')
+    assert getHW8clouds.readState(store) == {'days': {}, 'nTime': 0}
+    assert getHW8clouds.readState(store, {'nTime': 0}) == {'nTime': 0}
+    getHW8clouds.writeState(store, {'days': {'20181101': 3}, 'nTime': 3})
+    assert getHW8clouds.readState(store) == {'days': {'20181101': 3}, 'nTime': 3}
+    assert os.listdir(tmp_path) == ['cube.zarr.state.json']
+    ## a corrupted state is a new store
+    with open(getHW8clouds.stateFileName(store), 'w') as ff:
+        ff.write('{"days": ')
+    assert getHW8clouds.readState(store) == {'days': {}, 'nTime': 0}
+
+
+def test_resume(server, tmp_path):
+    ## the arrays of a day written without its state: the day is cut off and appended again
+    store = str(tmp_path / 'cube.zarr')
+    getHW8clouds.ingest('2018-11-01', '2018-11-02', store, server=server.url)
+    state = getHW8clouds.readState(store)
+    getHW8clouds.ingest('2018-11-04', store=store, server=server.url)
+    getHW8clouds.writeState(store, state)
+    assert xr.open_zarr(store).sizes['time'] == 9
+
+    state = getHW8clouds.ingest('2018-11-04', store=store, server=server.url)
+    assert state['nTime'] == 9
+    expected = getHW8clouds.ingest('2018-11-01', '2018-11-04', str(tmp_path / 'expected.zarr'), server=server.url)
+    assert expected == state
+    xr.testing.assert_identical(xr.open_zarr(store).load(), xr.open_zarr(str(tmp_path / 'expected.zarr')).load())
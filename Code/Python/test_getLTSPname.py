@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+test_getLTSPname.py
+resolution of the LTSP file names of many sites, against the synthetic catalogue of conftest.py.
+Run with python -m pytest Code/Python
+"""
+
+import pytest
+
+import getLTSPname
+
+S3 = getLTSPname.WEBROOTS['S3']
+
+
+def test_status(catalogue):
+    df = getLTSPname.getLTSPfileNames(sites=['NRSMAI', 'NRSYON', 'PIL050'], products=['gridded'], webURL='S3')
+    assert list(df.site) == ['NRSMAI', 'NRSYON', 'PIL050']
+    assert list(df.status) == ['OK', 'AMBIGUOUS', 'MISSING']
+    assert list(df.nMatches) == [1, 2, 0]
+    assert df.url[0] == S3 + 'IMOS/ANMN/NRS/NRSMAI/gridded_timeseries/IMOS_ANMN-NRS_TZ_20080828_NRSMAI_FV02_TEMP-gridded-timeseries_END-20230406_C-20230511.nc'
+    assert df.url.isna()[1] and len(df.candidates[1]) == 2
+
+
+def test_defaults(catalogue):
+    ## all the products, aggregated TEMP only, all the sites with LTSP products
+    df = getLTSPname.getLTSPfileNames()
+    assert sorted(df.site.unique()) == ['NRSMAI', 'NRSYON']
+    assert list(df[df.site == 'NRSMAI']['product']) == getLTSPname.PRODUCTS
+    assert list(df[df.site == 'NRSMAI'].status) == ['OK'] * 4
+    assert list(df[df['product'] == 'aggregated'].param) == ['TEMP', 'TEMP']
+    assert df[df['product'] != 'aggregated'].param.isna().all()
+
+
+def test_same_as_single_site(catalogue):
+    ## the batch matches the single site resolution
+    df = getLTSPname.getLTSPfileNames(sites=['NRSMAI'], params=['TEMP', 'PSAL'])
+    for row in df.itertuples():
+        assert row.url == getLTSPname.getLTSPfileName('NRSMAI', row.product, param=row.param or 'TEMP')
+    assert df.url[df.param == 'PSAL'].str.contains('PSAL-aggregated').all()
+
+
+def test_invalid(catalogue):
+    with pytest.raises(ValueError, match='invalid product type: daily'):
+        getLTSPname.getLTSPfileNames(products=['hourly', 'daily'])
+    with pytest.raises(ValueError, match='wrong webURL'):
+        getLTSPname.getLTSPfileNames(webURL='ftp')
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+test_hourly2csv.py
+conversion of the synthetic hourly file of conftest.py, compared with a per-instrument groupby.
+Run with python -m pytest Code/Python
+"""
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from hourly2csv import hourly2csv
+from conftest import makeHourly
+
+
+def _groupby(fileName):
+    ## the data and the metadata of every instrument, from a groupby of the whole file
+    df = xr.open_dataset(fileName).drop_vars(['instrument_id', 'source_file']).drop_dims('INSTRUMENT').to_pandas()
+    df = df.sort_values('instrument_index', kind='stable').reset_index(drop=True)
+    summary = df.groupby('instrument_index').TIME.agg(['min', 'max', 'count'])
+    return df, summary
+
+
+def test_convert(hourlyFile, tmp_path):
+    fileName, nRecords = hourly2csv(hourlyFile, output_path=str(tmp_path))
+    expected, summary = _groupby(hourlyFile)
+    assert nRecords == len(expected)
+    df = pd.read_csv(fileName, parse_dates=['TIME'])
+    pd.testing.assert_frame_equal(df, expected[df.columns], check_dtype=False, atol=1e-5)
+
+    metadata = pd.read_csv(fileName.replace('.csv', '_MD.csv'))
+    assert list(metadata.instrumentID) == [0, 1, 2, 3]
+    assert list(metadata.instrumentName) == ['SBE39-%i; 100%i' % (ii, ii) for ii in range(4)]
+    assert list(metadata.nObservations) == [summary['count'].get(ii, 0) for ii in range(4)]
+    ## the instrument without observations has no start and end
+    assert metadata.startTime.isna()[2] and metadata.endTime.isna()[2]
+    for ii in [0, 1, 3]:
+        assert pd.Timestamp(metadata.startTime[ii]) == summary['min'][ii]
+        assert pd.Timestamp(metadata.endTime[ii]) == summary['max'][ii]
+
+
+def test_unsorted_instruments(tmp_path):
+    ## instrument blocks not in instrument order: the output is sorted by instrument, keeping the TIME order
+    ds = makeHourly(str(tmp_path / 'sorted.nc'))
+    index = ds.instrument_index.values
+    order = np.concatenate([np.flatnonzero(index == ii) for ii in [3, 1, 0]])
+    fileName = str(tmp_path / 'PIL050_hourly-timeseries_unsorted.nc')
+    ds.isel(OBSERVATION=order).to_netcdf(fileName)
+
+    hourly2csv(str(tmp_path / 'sorted.nc'), output_path=str(tmp_path))
+    hourly2csv(fileName, output_path=str(tmp_path))
+    with open(str(tmp_path / 'sorted.csv')) as ff, open(fileName.replace('.nc', '.csv')) as gg:
+        assert ff.read() == gg.read()
+    with open(str(tmp_path / 'sorted_MD.csv')) as ff, open(fileName.replace('.nc', '_MD.csv')) as gg:
+        assert ff.read() == gg.read()
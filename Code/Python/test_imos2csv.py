@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+test_imos2csv.py
+binary search of the OBSERVATION ranges, and extraction of a date window of the synthetic
+hourly file of conftest.py, in one go and in chunks.
+Run with python -m pytest Code/Python
+"""
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+
+from imos2csv import imos2csv, searchSorted, observationRanges
+
+
+def _expected(hourlyFile, startDate, endDate):
+    ## the window selected on the whole loaded file
+    nc = xr.open_dataset(hourlyFile).load()
+    inside = (nc.TIME >= np.datetime64(startDate)) & (nc.TIME <= np.datetime64(endDate))
+    return nc.isel(OBSERVATION=np.flatnonzero(inside.values))
+
+
+@pytest.mark.parametrize('stride', [1, 3, 16, 1000])
+@pytest.mark.parametrize('side', ['left', 'right'])
+def test_search_sorted(stride, side):
+    ## sorted values with repeats, searched inside a block, values in and out of the block
+    rng = np.random.default_rng(1)
+    values = np.sort(rng.integers(0, 200, 500))
+    var = xr.DataArray(values)
+    targets = [-1, 0, 5, 50, 51, 99, 150, 199, 250]
+    for lo, hi in [(0, 500), (17, 333), (100, 101), (200, 200)]:
+        expected = lo + np.searchsorted(values[lo:hi], targets, side=side)
+        assert list(searchSorted(var, targets, lo, hi, side, stride)) == list(expected)
+
+
+@pytest.mark.parametrize('stride', [1, 50, 4096])
+def test_observation_ranges(hourlyFile, stride):
+    nc = xr.open_dataset(hourlyFile)
+    instrumentIndex, time = nc.instrument_index.values, nc.TIME.values
+    for startDate, endDate in [('2012-01-01', '2012-06-01'), ('2012-01-20', '2012-02-05'),
+                               ('2012-01-05', '2012-01-10'), ('2013-01-01', '2013-02-01')]:
+        startDate, endDate = np.datetime64(startDate), np.datetime64(endDate)
+        ## ranges of every instrument found on the loaded arrays
+        expected = []
+        for ii in range(nc.sizes['INSTRUMENT']):
+            inside = np.flatnonzero((instrumentIndex == ii) & (time >= startDate) & (time <= endDate))
+            if len(inside):
+                expected.append((ii, inside[0], inside[-1] + 1))
+        assert [tuple(int(kk) for kk in item) for item in observationRanges(nc, startDate, endDate, stride)] == expected
+
+
+def test_window(hourlyFile, tmp_path):
+    fileName, nMeta, nRecords = imos2csv(hourlyFile, ['TEMP', 'PSAL'], '2012-02-10', '2012-02-20', str(tmp_path))
+    assert fileName == str(tmp_path / 'PIL050_20120210-20120220.csv')
+    expected = _expected(hourlyFile, '2012-02-10', '2012-02-20')
+    assert nRecords == expected.sizes['OBSERVATION']
+
+    with open(fileName) as ff:
+        metadata = [next(ff) for ii in range(nMeta)]
+    assert 'site_code: PIL050\n' in metadata and 'missing_value: -99999\n' in metadata
+    df = pd.read_csv(fileName, sep='\t', skiprows=nMeta)
+    assert list(df.columns) == ['instrument_index', 'instrument_id', 'DEPTH', 'TEMP', 'PSAL', 'TIME']
+    assert list(df.instrument_index) == list(expected.instrument_index.values)
+    assert np.allclose(df.TEMP, expected.TEMP.values)
+    assert (pd.to_datetime(df.TIME).to_numpy() == expected.TIME.values).all()
+    assert set(df.instrument_id) == {'SBE39-0; 1000', 'SBE39-1; 1001'}
+
+
+def test_chunks(hourlyFile, tmp_path):
+    ## streamed in chunks shorter and longer than the instrument ranges: same output
+    outputs = []
+    for chunkSize in [None, 7, 100, 100000]:
+        result = imos2csv(hourlyFile, ['TEMP'], '2012-01-01', '2012-05-01', str(tmp_path), chunkSize=chunkSize,
+                          outName='PIL050_%s' % chunkSize)
+        with open(result[0]) as ff:
+            outputs.append(ff.read())
+    assert outputs[1:] == outputs[:1] * 3
+
+
+def test_empty_window(hourlyFile, tmp_path):
+    fileName, nMeta, nRecords = imos2csv(hourlyFile, ['TEMP'], '2013-01-01', '2013-02-01', str(tmp_path))
+    assert nRecords == 0
+    with open(fileName) as ff:
+        assert len(ff.readlines()) == nMeta + 1
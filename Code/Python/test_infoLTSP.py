@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+test_infoLTSP.py
+reports of the synthetic hourly and gridded files of conftest.py: coverage of every instrument,
+compared with a groupby, and availability bars from a decimated sample.
+Run with python -m pytest Code/Python
+"""
+
+import numpy as np
+import xarray as xr
+import pytest
+
+import infoLTSP
+from availability import instrumentCoverage, blockPlot, BLOCK_SYMBOLS
+from infoLTSP import infoHourlyInstrument
+from conftest import makeHourly
+
+
+@pytest.fixture
+def localFiles(hourlyFile, griddedFile, tmp_path, monkeypatch):
+    ## the reports open the local files instead of the catalogue urls
+    monkeypatch.setenv('QIMOS_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(infoLTSP, 'getFileName', lambda site, fType: {'H': hourlyFile, 'G': griddedFile}[fType])
+
+
+def _groupby(nc):
+    df = nc[['TIME', 'instrument_index']].to_dataframe()
+    return df.groupby('instrument_index').TIME.agg(['min', 'max'])
+
+
+def test_instrument_coverage(hourlyFile):
+    nc = xr.open_dataset(hourlyFile)
+    timeMin, timeMax = instrumentCoverage(nc)
+    expected = _groupby(nc)
+    assert list(timeMin[[0, 1, 3]]) == list(expected['min'])
+    assert list(timeMax[[0, 1, 3]]) == list(expected['max'])
+    ## the instrument without observations
+    assert np.isnat(timeMin[2]) and np.isnat(timeMax[2])
+
+
+def test_instrument_coverage_unsorted(tmp_path):
+    ds = makeHourly(str(tmp_path / 'sorted.nc'))
+    order = np.random.default_rng(0).permutation(ds.sizes['OBSERVATION'])
+    timeMin, timeMax = instrumentCoverage(ds.isel(OBSERVATION=order))
+    expected = instrumentCoverage(ds)
+    assert (timeMin[[0, 1, 3]] == expected[0][[0, 1, 3]]).all()
+    assert (timeMax[[0, 1, 3]] == expected[1][[0, 1, 3]]).all()
+
+
+def test_instrument_table(hourlyFile, capsys):
+    infoHourlyInstrument(xr.open_dataset(hourlyFile))
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].split()[:3] == ['Instrument_index', 'Instrument', 'id']
+    assert lines[1].split()[:5] == ['0', 'SBE39-0;', '1000', '2012-01-01', '2012-02-29']
+    assert lines[2].split()[:5] == ['1', 'SBE39-1;', '1001', '2012-02-01', '2012-05-31']
+    ## no coverage dates for the instrument without observations
+    assert lines[3].split()[:3] == ['2', 'SBE39-2;', '1002'] and '2012' not in lines[3]
+    assert lines[4].split()[3:5] == ['2012-01-15', '2012-01-29']
+    ## the bars: the start of the record, and 14.75 days of about 5 months of record
+    bars = [line.split()[-1] for line in lines[1:]]
+    assert bars[0].startswith(BLOCK_SYMBOLS[1]) and bars[1].startswith(BLOCK_SYMBOLS[0])
+    assert bars[3].count(BLOCK_SYMBOLS[1]) == 4
+
+
+def test_instrument_table_no_data(tmp_path, capsys):
+    ds = makeHourly(str(tmp_path / 'sorted.nc'))
+    infoHourlyInstrument(ds.isel(OBSERVATION=slice(0, 0)))
+    out = capsys.readouterr().out
+    assert 'No instrument with observations' in out
+    assert 'SBE39-3; 1003' in out
+
+
+def test_sample_stride():
+    assert infoLTSP.sampleStride(100) == 1
+    assert infoLTSP.sampleStride(4000) == 1
+    assert infoLTSP.sampleStride(4001) == 2
+    assert infoLTSP.sampleStride(10 ** 6) == 250
+    assert infoLTSP.sampleStride(10 ** 6, full=True) == 1
+    assert infoLTSP.sampleStride(10 ** 6, maxSamples=10 ** 6 - 1) == 2
+
+
+def _table(out):
+    ## report lines by their first word
+    return {line.split()[0]: line for line in out.splitlines() if line.strip()}
+
+
+@pytest.mark.parametrize('full', [False, True])
+def test_hourly_report(localFiles, hourlyFile, capsys, full):
+    infoLTSP.infoLTSPh('PIL050', full=full)
+    out = capsys.readouterr().out
+    table = _table(out)
+    nc = xr.open_dataset(hourlyFile)
+    stride = 1 if full else 2
+    assert table['TEMP'].split()[1] == blockPlot(nc.TEMP.values[::stride])
+    assert table['PSAL'].split()[1] == blockPlot(nc.PSAL.values[::stride])
+    assert ('Availability from 1 of every 2 values' in out) != full
+
+
+@pytest.mark.parametrize('full', [False, True])
+def test_gridded_report(localFiles, griddedFile, capsys, full):
+    infoLTSP.infoLTSPg('NRSMAI', full=full)
+    out = capsys.readouterr().out
+    nc = xr.open_dataset(griddedFile)
+    stride = 1 if full else 3
+    bars = [line.split()[-1] for line in out.splitlines() if 'Data Availability at' in line]
+    assert len(bars) == 11
+    for bar, depth in zip(bars, nc.DEPTH.values):
+        assert bar == blockPlot(nc.TEMP.sel(DEPTH=depth).values[::stride], lineLength=40)
+    ## no data in the first 3 months at the deepest depths
+    assert bars[0][0] == BLOCK_SYMBOLS[1] and bars[-1][0] == BLOCK_SYMBOLS[0]
+    assert ('Availability from 1 of every 3 values' in out) != full
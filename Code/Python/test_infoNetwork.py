@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+test_infoNetwork.py
+status of the LTSP files of the synthetic catalogue of conftest.py, read with Range requests
+from a local stand-in of S3.
+Run with python -m pytest Code/Python
+"""
+
+import numpy as np
+import pytest
+
+import getLTSPname
+import infoNetwork
+from availabilityIndex import getAvailabilityIndex
+from conftest import CATALOGUE, makeHourly, makeGridded
+
+pytest.importorskip('h5netcdf')
+
+
+@pytest.fixture
+def network(catalogue, s3, monkeypatch):
+    ## the NRSMAI files on S3. The NRSYON hourly file is not, and its OPeNDAP url is a local 404
+    monkeypatch.delenv('QIMOS_FILE_CACHE', raising=False)
+    monkeypatch.setitem(getLTSPname.WEBROOTS, 'opendap', 'http://127.0.0.1:%i/thredds/dodsC/' % s3.httpd.server_port)
+    urls = {}
+    for product, make in [('hourly', makeHourly), ('gridded', makeGridded)]:
+        key = CATALOGUE.url[(CATALOGUE.site_code == 'NRSMAI') & getLTSPname.productMask(CATALOGUE.url, product)].item()
+        (s3.bucketDir / key).parent.mkdir(parents=True, exist_ok=True)
+        make(str(s3.bucketDir / key))
+        urls[product] = getLTSPname.WEBROOTS['opendap'] + key
+    return urls
+
+
+def test_sites(catalogue):
+    assert infoNetwork.getSites(['NRS']) == ['NRSMAI', 'NRSYON']
+    assert infoNetwork.getSites(['ALL']) is None
+    assert infoNetwork.getSites(['PIL050']) == ['PIL050']
+
+
+def test_network_status(network, s3):
+    entries = infoNetwork.networkStatus(['NRS'], workers=4)
+    assert [(entry['site'], entry['product'], entry['status']) for entry in entries] == \
+        [('NRSMAI', 'hourly', 'OK'), ('NRSMAI', 'gridded', 'OK'), ('NRSYON', 'hourly', 'ERROR'), ('NRSYON', 'gridded', 'AMBIGUOUS')]
+    hourly, gridded = entries[:2]
+    assert hourly['nInstruments'] == 4 and hourly['variables'] == ['DEPTH', 'TEMP', 'PSAL']
+    assert hourly['availability'] == 'sample 1/2' and len(hourly['bar']) == 40
+    assert gridded['depths'] == list(np.arange(0.0, 110.0, 10.0))
+    assert gridded['time_coverage_start'] == '2012-01-01T00:00:00Z'
+    assert 'access' not in hourly
+    ## read with Range requests, then tried with OPeNDAP
+    assert entries[2]['access'] == 'opendap' and 'error' in entries[2]
+    assert len(entries[3]['candidates']) == 2
+
+
+def test_index(network):
+    ## the availability index is built from the file opened with Range requests, keyed by its OPeNDAP url
+    entries = infoNetwork.networkStatus(['NRSMAI'], ['gridded'], buildIndex=True)
+    assert entries[0]['availability'] == 'index'
+    index = getAvailabilityIndex(network['gridded'], entries[0]['date_created'], build=False)
+    assert entries[0]['TEMP_coverage'] == round(100.0 * index['variableDays'][0].mean(), 1)
+    assert infoNetwork.networkStatus(['NRSMAI'], ['gridded'])[0]['availability'] == 'index'
+
+
+def test_shared_session(network, s3):
+    ## the files opened one after the other reuse the kept-alive connection of the session
+    pytest.importorskip('requests')
+    session = infoNetwork._getSession(4)
+    for ii in range(3):
+        for product, url in network.items():
+            assert infoNetwork.fileStatus('NRSMAI', product, url, session=session)['status'] == 'OK'
+    session.close()
+    assert len(s3.httpd.connections) == 1
+
+
+def test_invalid_product(catalogue):
+    with pytest.raises(ValueError, match='invalid product type: velocity-hourly'):
+        infoNetwork.networkStatus(['NRSMAI'], ['velocity-hourly'])
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+test_ltspWriter.py
+parquet and arrow outputs of hourly2csv and imos2csv, compared with their csv outputs.
+Run with python -m pytest Code/Python
+"""
+
+import pandas as pd
+import pytest
+
+from hourly2csv import hourly2csv
+from imos2csv import imos2csv
+from ltspWriter import LTSPWriter, readMetadata
+
+pa = pytest.importorskip('pyarrow')
+
+
+def test_hourly_parquet(hourlyFile, tmp_path):
+    csvName, nRecords = hourly2csv(hourlyFile, 'csv', str(tmp_path))
+    parquetName, nParquet = hourly2csv(hourlyFile, 'parquet', str(tmp_path))
+    assert parquetName.endswith('.parquet') and nParquet == nRecords
+
+    ## one partition per instrument with observations
+    assert sorted(path.name for path in (tmp_path / parquetName.split('/')[-1] / 'site_code=PIL050').iterdir()) == \
+        ['instrument_index=0', 'instrument_index=1', 'instrument_index=3']
+    dfCSV = pd.read_csv(csvName, parse_dates=['TIME'])
+    dfParquet = pd.read_parquet(parquetName)
+    assert list(dfParquet.site_code.unique()) == ['PIL050']
+    dfParquet['instrument_index'] = dfParquet.instrument_index.astype(int)
+    dfParquet = dfParquet.sort_values(['instrument_index', 'TIME'], kind='stable').reset_index(drop=True)
+    pd.testing.assert_frame_equal(dfParquet[dfCSV.columns], dfCSV, check_dtype=False, atol=1e-5)
+
+    attrs, instruments = readMetadata(parquetName)
+    assert attrs['site_code'] == 'PIL050'
+    assert list(instruments.nObservations) == list(pd.read_csv(csvName.replace('.csv', '_MD.csv')).nObservations)
+
+
+def test_imos_arrow(hourlyFile, tmp_path):
+    csvName, nMeta, nRecords = imos2csv(hourlyFile, ['TEMP', 'PSAL'], '2012-01-20', '2012-03-10', str(tmp_path))
+    arrowName, nArrow, nArrowRecords = imos2csv(hourlyFile, ['TEMP', 'PSAL'], '2012-01-20', '2012-03-10', str(tmp_path),
+                                                chunkSize=100, outputFormat='arrow')
+    assert arrowName.endswith('.arrow') and nArrowRecords == nRecords
+
+    with pa.memory_map(arrowName) as source:
+        dfArrow = pa.ipc.open_file(source).read_all().to_pandas()
+    dfCSV = pd.read_csv(csvName, sep='\t', skiprows=nMeta, parse_dates=['TIME'])
+    pd.testing.assert_frame_equal(dfArrow, dfCSV, check_dtype=False, atol=1e-5)
+
+    attrs, instruments = readMetadata(arrowName)
+    assert attrs['time_coverage_start'] == '2012-01-20'
+    assert list(instruments.instrument_id) == ['SBE39-%i; 100%i' % (ii, ii) for ii in range(4)]
+
+
+@pytest.mark.parametrize('outputFormat', ['parquet', 'arrow'])
+def test_empty(tmp_path, outputFormat):
+    ## no data: the metadata is still there
+    writer = LTSPWriter(str(tmp_path / 'empty'), outputFormat, siteCode='PIL050', attrs={'site_code': 'PIL050'},
+                        instruments=pd.DataFrame({'instrument_index': [0]}))
+    fileName = writer.close(['TEMP', 'TIME'])
+    assert writer.nRecords == 0
+    attrs, instruments = readMetadata(fileName)
+    assert attrs == {'site_code': 'PIL050'} and list(instruments.instrument_index) == [0]
+
+
+def test_invalid_format(tmp_path):
+    with pytest.raises(ValueError, match='not a valid output format'):
+        LTSPWriter(str(tmp_path / 'out'), 'xlsx')
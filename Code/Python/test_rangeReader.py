@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+test_rangeReader.py
+netCDF4 files read with HTTP Range requests from the local stand-in of S3 of conftest.py,
+compared with the local files.
+Run with python -m pytest Code/Python
+"""
+
+import numpy as np
+import xarray as xr
+import pytest
+
+import rangeReader
+from rangeReader import RangeFile, openRangeDataset
+from conftest import makeHourly, makeGridded
+
+pytest.importorskip('h5netcdf')
+
+
+@pytest.fixture
+def files(s3):
+    ## the two products in the bucket, under an AODN like path
+    (s3.bucketDir / 'IMOS' / 'ANMN').mkdir(parents=True)
+    makeHourly(str(s3.bucketDir / 'IMOS' / 'ANMN' / 'hourly.nc'))
+    makeGridded(str(s3.bucketDir / 'IMOS' / 'ANMN' / 'gridded.nc'))
+    return {name: (s3.url + 'IMOS/ANMN/%s.nc' % name, str(s3.bucketDir / 'IMOS' / 'ANMN' / ('%s.nc' % name))) for name in ['hourly', 'gridded']}
+
+
+def test_range_file(files):
+    url, fileName = files['hourly']
+    with open(fileName, 'rb') as ff:
+        content = ff.read()
+    rangeFile = RangeFile(url, blockSize=1000, cacheBlocks=4)
+    assert rangeFile.size == len(content)
+    for start, length in [(0, 10), (995, 10), (2500, 3000), (len(content) - 5, 100), (len(content) + 5, 10)]:
+        rangeFile.seek(start)
+        assert rangeFile.read(length) == content[start:start + length]
+    rangeFile.seek(-5, 2)
+    assert rangeFile.read() == content[-5:]
+
+    ## the blocks read are cached: a read inside them needs no request
+    rangeFile.seek(len(content) - 900)
+    rangeFile.read(10)
+    nRequests = rangeFile.nRequests
+    rangeFile.seek(len(content) - 950)
+    assert rangeFile.read(100) == content[-950:-850]
+    assert rangeFile.nRequests == nRequests
+    ## consecutive missing blocks in one request
+    rangeFile.seek(10000)
+    rangeFile.read(3500)
+    assert rangeFile.nRequests == nRequests + 1
+    rangeFile.close()
+
+
+@pytest.mark.parametrize('name', ['hourly', 'gridded'])
+def test_open(files, name):
+    url, fileName = files[name]
+    ds = openRangeDataset(url, blockSize=16 * 1024)
+    local = xr.open_dataset(fileName)
+    xr.testing.assert_identical(ds.load(), local.load())
+
+
+def test_lazy(files):
+    ## a slice of a variable: only a part of the file is fetched
+    url, fileName = files['gridded']
+    ds = openRangeDataset(url, blockSize=16 * 1024)
+    rangeFile = ds.encoding['rangeFile']
+    temp = ds.TEMP.isel(DEPTH=5, TIME=slice(0, 100)).values
+    np.testing.assert_array_equal(temp, xr.open_dataset(fileName).TEMP.isel(DEPTH=5, TIME=slice(0, 100)).values)
+    assert rangeFile.bytesFetched < rangeFile.size
+
+
+def test_session(files):
+    requests = pytest.importorskip('requests')
+    url, fileName = files['hourly']
+    with requests.Session() as session:
+        ds = openRangeDataset(url, session=session)
+        xr.testing.assert_identical(ds.load(), xr.open_dataset(fileName).load())
+
+
+def test_errors(files, s3):
+    with pytest.raises(IOError, match='HTTP 404'):
+        RangeFile(s3.url + 'IMOS/ANMN/missing.nc')
+    assert rangeReader.getS3URL('http://thredds.aodn.org.au/thredds/dodsC/IMOS/ANMN/hourly.nc') == s3.url + 'IMOS/ANMN/hourly.nc'
+    assert rangeReader.getS3URL(s3.url + 'IMOS/ANMN/hourly.nc') == s3.url + 'IMOS/ANMN/hourly.nc'
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+test_siteIndex.py
+nearest sites and grid cells of random points, compared with a search over all the sites
+and with the nearest selection of xarray, and the extent of the grids.
+Run with python -m pytest Code/Python
+"""
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+
+from siteIndex import SiteIndex, GridIndex, haversine, mooringSiteIndex, loggerSiteIndex
+from conftest import LOGGER_SITES
+
+pytest.importorskip('scipy')
+
+
+@pytest.fixture
+def points():
+    rng = np.random.default_rng(0)
+    return rng.uniform(-30, -8, 500), rng.uniform(140, 160, 500)
+
+
+def test_haversine():
+    ## a degree of latitude, and a quarter of the equator
+    assert haversine(-20, 150, -21, 150) == pytest.approx(111.19, abs=0.01)
+    assert haversine(0, 0, 0, 90) == pytest.approx(np.pi / 2 * 6371.0)
+    np.testing.assert_allclose(haversine([0, -20], [0, 150], [0, -20], [0, 150]), [0, 0])
+
+
+def test_site_index(points):
+    rng = np.random.default_rng(1)
+    siteLat, siteLon = rng.uniform(-30, -8, 200), rng.uniform(140, 160, 200)
+    index = SiteIndex(siteLat, siteLon, ['S%03i' % ii for ii in range(200)])
+    assert len(index) == 200
+    lat, lon = points
+    dfNearest = index.query(lat, lon, maxDistance=50)
+    ## all the distances of every point
+    distance = haversine(lat[:, None], lon[:, None], siteLat[None, :], siteLon[None, :])
+    np.testing.assert_array_equal(dfNearest['index'].values, distance.argmin(axis=1))
+    np.testing.assert_allclose(dfNearest.distance.values, distance.min(axis=1), atol=1e-6)
+    assert list(dfNearest.name[:2]) == ['S%03i' % ii for ii in distance.argmin(axis=1)[:2]]
+    np.testing.assert_array_equal(dfNearest.inDomain.values, distance.min(axis=1) <= 50)
+    assert index.query(lat, lon, maxDistance=None).inDomain.all()
+
+    within = index.within(lat[:20], lon[:20], 100)
+    for ii in range(20):
+        np.testing.assert_array_equal(within[ii], np.flatnonzero(distance[ii] <= 100))
+
+
+@pytest.mark.parametrize('descending', [False, True])
+def test_grid_index(points, descending):
+    lat = np.arange(-30.0, -7.5, 0.5)
+    lat = lat[::-1] if descending else lat
+    lon = np.arange(141.0, 160.0, 0.5)
+    grid = xr.Dataset(coords={'lat': lat, 'lon': lon})
+    dfCells = GridIndex(lat, lon).query(*points)
+    for (pointLat, pointLon), (_, cell) in zip(zip(*points), dfCells.iterrows()):
+        nearest = grid.sel(lat=pointLat, lon=pointLon, method='nearest')
+        assert (cell.latitude, cell.longitude) == (nearest.lat.item(), nearest.lon.item())
+        assert (lat[cell.latIndex], lon[cell.lonIndex]) == (cell.latitude, cell.longitude)
+    np.testing.assert_allclose(dfCells.distance, haversine(*points, dfCells.latitude, dfCells.longitude))
+
+
+def test_grid_extent():
+    ## cell centres from -30 to -10 and 141 to 159.5: the grid covers half a cell more on every side
+    index = GridIndex(np.arange(-30.0, -9.5, 0.5), np.arange(141.0, 160.0, 0.5))
+    lat = [-20.0, -30.24, -30.26, -9.76, -9.74, -20.0, -20.0, -20.0, -20.0]
+    lon = [150.0, 150.0, 150.0, 150.0, 150.0, 140.76, 140.74, 159.74, 159.76]
+    dfCells = index.query(lat, lon)
+    assert list(dfCells.inDomain) == [True, True, False, True, False, True, False, True, False]
+    ## points out of the extent still get the nearest cell, on the edge
+    assert (dfCells.latitude[2], dfCells.longitude[6]) == (-30.0, 141.0)
+    ## and the points of the extent further than maxDistance from their cell centre
+    dfCells = index.query(lat, lon, maxDistance=20)
+    assert list(dfCells.inDomain) == [True, False, False, False, False, False, False, False, False]
+    ## a grid of one cell is only its centre
+    assert list(GridIndex([-20.0], [150.0]).query([-20.0, -20.1], [150.0, 150.0]).inDomain) == [True, False]
+
+
+def test_mooring_index():
+    ## positions from the WFS geometry, the median of the files of each site
+    df = pd.DataFrame({'site_code': ['NRSMAI', 'NRSMAI', 'NRSMAI', 'NRSYON'],
+                       'geom': ['POINT (148.23 -42.6)', 'POINT (148.25 -42.59)', 'POINT (148.2 -42.61)', 'POINT (153.56 -27.34)']})
+    index = mooringSiteIndex(df)
+    assert list(index.names) == ['NRSMAI', 'NRSYON']
+    assert (index.lat[0], index.lon[0]) == (-42.6, 148.23)
+    dfNearest = index.query([-42.65, -27.3, -30.0], [148.25, 153.5, 152.0])
+    assert list(dfNearest.name) == ['NRSMAI', 'NRSYON', 'NRSYON']
+    assert list(dfNearest.inDomain) == [True, True, False]
+    with pytest.raises(ValueError, match='the catalogue has no site positions'):
+        mooringSiteIndex(df[['site_code']])
+
+
+def test_logger_index(loggers):
+    parquetDir, df = loggers
+    index = loggerSiteIndex(parquetDir)
+    codes = sorted(line.split(' - ')[1] for line in LOGGER_SITES[:-1])
+    assert list(index.names) == codes
+    position = df.groupby('gbrmpa_reef_id')[['lat', 'lon']].median().loc[codes]
+    np.testing.assert_allclose(index.lat, position.lat.values)
+    np.testing.assert_allclose(index.lon, position.lon.values)